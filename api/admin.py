@@ -5,10 +5,11 @@ from abc import ABC
 from django.contrib import admin
 from django.contrib.admin import SimpleListFilter
 from django.contrib.auth.admin import UserAdmin
+from django.db import transaction
 from django.db.models import Count
 from rest_framework.authtoken.models import Token
 
-from .asyncstuff import process_completed_task
+from .asyncstuff import process_completed_task, reroute_conditional_stage
 from .models import (
     Campaign, Chain, TaskStage, ConditionalStage, Case, Task, CustomUser,
     Rank, RankLimit, RankRecord, CampaignManagement, Track, Log,
@@ -16,7 +17,9 @@ from .models import (
     Webhook, CopyField, StagePublisher, Quiz, ResponseFlattener, TaskAward,
     DynamicJson, PreviousManual, AutoNotification, ConditionalLimit,
     DatetimeSort, ErrorItem, TestWebhook, CampaignLinker, ApproveLink,
-    Language, Category, Country, TranslationAdapter, TranslateKey, Translation, CountTasksModifier, Volume, StageVolume
+    Language, Category, Country, TranslationAdapter, TranslateKey, Translation, CountTasksModifier, Volume, StageVolume,
+    PropagationJob, UserStageCounter, SelectableTask, ExportJob,
+    WebhookDelivery
 )
 from django.contrib import messages
 from django.utils.translation import ngettext
@@ -240,10 +243,12 @@ class ChainAdmin(admin.ModelAdmin):
         "campaign",
         "is_individual",
         "order_in_individuals",
+        "deferred_propagation",
     )
     list_filter = (
         "is_individual",
         "order_in_individuals",
+        "deferred_propagation",
         AutocompleteFilterFactory("Campaign", "campaign"),
     )
     autocomplete_fields = ("campaign",)
@@ -307,6 +312,24 @@ class StageAdmin(admin.ModelAdmin):
         return filter_by_admin_preference(queryset, request, "chain__")
 
 
+class ConditionalStageAdmin(StageAdmin):
+    actions = ["reroute"]
+
+    @admin.action(description='Reroute completed in tasks by current conditions')
+    def reroute(self, request, queryset):
+        created = 0
+        for stage in queryset.filter(pingpong=False,
+                                     conditional_limit__isnull=True):
+            with transaction.atomic():
+                created += reroute_conditional_stage(stage)
+
+        self.message_user(request, ngettext(
+            '%d task was created.',
+            '%d tasks were created.',
+            created,
+        ) % created, messages.SUCCESS)
+
+
 class ConditionalLimitAdmin(admin.ModelAdmin):
     model = ConditionalLimit
     list_display = ("conditional_stage", )
@@ -602,7 +625,10 @@ class TaskAdmin(admin.ModelAdmin):
 
     @admin.action(description='Mark selected tasks as completed')
     def make_completed(self, request, queryset):
+        pairs = UserStageCounter.get_pairs(queryset)
         updated = queryset.update(complete=True)
+        UserStageCounter.recount(pairs)
+        SelectableTask.remove_tasks(queryset.values("id"))
         for task in queryset:
             process_completed_task(task)  # ToDo: put complete=True inside cycle, account for possible interruptions
 
@@ -614,7 +640,10 @@ class TaskAdmin(admin.ModelAdmin):
 
     @admin.action(description='Mark selected tasks as completed force')
     def make_completed_force(self, request, queryset):
+        pairs = UserStageCounter.get_pairs(queryset)
         updated = queryset.update(complete=True, force_complete=True)
+        UserStageCounter.recount(pairs)
+        SelectableTask.remove_tasks(queryset.values("id"))
         self.message_user(request, ngettext(
             '%d task was successfully marked as force completed.',
             '%d tasks were successfully marked as force completed.',
@@ -1085,6 +1114,112 @@ class CountTasksModifierAdmin(admin.ModelAdmin):
     )
 
 
+class PropagationJobAdmin(admin.ModelAdmin):
+    list_display = ("id",
+                    "task",
+                    "status",
+                    "next_direct_task",
+                    "attempts",
+                    "created_at",
+                    "updated_at")
+    list_filter = ("status",
+                   AutocompleteFilterFactory("Stage", "task__stage"))
+    search_fields = ("task__id",)
+    raw_id_fields = ("task", "next_direct_task")
+    actions = ["retry"]
+
+    @admin.action(description='Retry selected failed propagations')
+    def retry(self, request, queryset):
+        jobs = list(queryset.filter(status=PropagationJob.Status.FAILED))
+        for job in jobs:
+            job.retry()
+
+        self.message_user(request, ngettext(
+            '%d propagation was scheduled again.',
+            '%d propagations were scheduled again.',
+            len(jobs),
+        ) % len(jobs), messages.SUCCESS)
+
+
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ("id",
+                    "campaign",
+                    "kind",
+                    "status",
+                    "rows_written",
+                    "total_rows",
+                    "attempts",
+                    "created_at",
+                    "updated_at")
+    list_filter = ("status", "kind", "campaign")
+    raw_id_fields = ("created_by", "response_flattener")
+    actions = ["resume"]
+
+    @admin.action(description='Resume selected failed exports')
+    def resume(self, request, queryset):
+        jobs = list(queryset.filter(status=ExportJob.Status.FAILED))
+        for job in jobs:
+            job.status = ExportJob.Status.PENDING
+            job.error = ""
+            job.save()
+            job.enqueue()
+
+        self.message_user(request, ngettext(
+            '%d export was scheduled again.',
+            '%d exports were scheduled again.',
+            len(jobs),
+        ) % len(jobs), messages.SUCCESS)
+
+
+class WebhookDeliveryAdmin(admin.ModelAdmin):
+    list_display = ("id",
+                    "stage",
+                    "in_task",
+                    "target",
+                    "status",
+                    "attempts",
+                    "next_attempt_at",
+                    "created_at",
+                    "updated_at")
+    list_filter = ("status",
+                   "target",
+                   AutocompleteFilterFactory("Stage", "stage"))
+    search_fields = ("in_task__id",)
+    raw_id_fields = ("stage", "in_task", "result_task")
+    actions = ["retry"]
+
+    @admin.action(description='Retry selected dead deliveries')
+    def retry(self, request, queryset):
+        deliveries = list(queryset.filter(
+            status=WebhookDelivery.Status.DEAD))
+        for delivery in deliveries:
+            delivery.retry()
+
+        self.message_user(request, ngettext(
+            '%d delivery was scheduled again.',
+            '%d deliveries were scheduled again.',
+            len(deliveries),
+        ) % len(deliveries), messages.SUCCESS)
+
+
+class UserStageCounterAdmin(admin.ModelAdmin):
+    list_display = ("id", "user", "stage", "total", "incomplete")
+    list_filter = (AutocompleteFilterFactory("Stage", "stage"),)
+    search_fields = ("user__email", "user__username")
+    raw_id_fields = ("user", "stage")
+    actions = ["recount"]
+
+    @admin.action(description='Recount selected counters from tasks')
+    def recount(self, request, queryset):
+        pairs = set(queryset.values_list("user_id", "stage_id"))
+        UserStageCounter.recount(pairs)
+        self.message_user(request, ngettext(
+            '%d counter was recounted.',
+            '%d counters were recounted.',
+            len(pairs),
+        ) % len(pairs), messages.SUCCESS)
+
+
 class VolumeAdmin(admin.ModelAdmin):
     list_display = ("track_fk", 'order')
 
@@ -1109,7 +1244,7 @@ admin.site.register(CampaignLinker, CampaignLinkerAdmin)
 admin.site.register(ApproveLink, ApproveLinkAdmin)
 admin.site.register(Chain, ChainAdmin)
 admin.site.register(TaskStage, TaskStageAdmin)
-admin.site.register(ConditionalStage, StageAdmin)
+admin.site.register(ConditionalStage, ConditionalStageAdmin)
 admin.site.register(ConditionalLimit, ConditionalLimitAdmin)
 admin.site.register(Stage, GeneralStageAdmin)
 admin.site.register(Integration, IntegrationAdmin)
@@ -1141,4 +1276,8 @@ admin.site.register(ErrorItem, ErrorItemAdmin)
 admin.site.register(TestWebhook, TestWebhookAdmin)
 admin.site.register(CountTasksModifier, CountTasksModifierAdmin)
 admin.site.register(Volume, VolumeAdmin)
+admin.site.register(PropagationJob, PropagationJobAdmin)
+admin.site.register(ExportJob, ExportJobAdmin)
+admin.site.register(WebhookDelivery, WebhookDeliveryAdmin)
+admin.site.register(UserStageCounter, UserStageCounterAdmin)
 admin.site.register(StageVolume, StageVolumeAdmin)
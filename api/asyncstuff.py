@@ -1,11 +1,15 @@
 import json
 import math
 import sys
+import time
 import traceback
+from functools import partial
+from itertools import islice
 
-import requests
 from django.apps import apps
-from django.db.models import F, Count
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Count, Subquery, OuterRef, Exists
 from django.utils import timezone
 from rest_framework import status
 
@@ -14,8 +18,14 @@ from api.constans import (
     TaskStageConstants, AutoNotificationConstants, ErrorConstants,
     ConditionalStageConstants)
 from api.models import (
-    TaskStage, ConditionalStage, Task, Case,
-    RankLimit, DatetimeSort, ApproveLink
+    ConditionalStage, Task, Case,
+    RankLimit, DatetimeSort, ApproveLink, PropagationJob, UserStageCounter,
+    SelectableTask, ExportJob, WebhookDelivery
+)
+from api.utils import webhook_client
+from api.utils.chain_graph import ChainGraph
+from api.utils.conditions import (
+    InvalidCondition, ConditionEvaluationError, UntranslatableCondition
 )
 from api.utils.utils import find_user, value_from_json, reopen_task, \
     get_ranks_where_user_have_parent_ranks, \
@@ -23,6 +33,9 @@ from api.utils.utils import find_user, value_from_json, reopen_task, \
     get_conditional_limit_count
 
 
+BULK_CHUNK_SIZE = 1000
+
+
 def get_next_direct_task(next_direct_task, task):
     if next_direct_task is not None:
         next_direct_task.complete = False
@@ -35,9 +48,8 @@ def get_next_direct_task(next_direct_task, task):
 
 
 def process_on_chain(current_stage, task):
-    in_conditional_pingpong_stages = ConditionalStage.objects \
-        .filter(out_stages=current_stage) \
-        .filter(pingpong=True)
+    in_conditional_pingpong_stages = ChainGraph.for_stage(current_stage) \
+        .in_pingpong_stages(current_stage.id)
     if len(in_conditional_pingpong_stages) > 0:
         for stage in in_conditional_pingpong_stages:
             if evaluate_conditional_stage(stage, task):
@@ -111,25 +123,127 @@ def process_completed_task(task):
     return None
 
 
+def run_propagation_job(job_id):
+    """
+    Entry point of the django_q cluster for deferred chain propagation.
+    The job is marked running in its own transaction, then its row is
+    locked for the whole run, so concurrent or repeated deliveries of the
+    same job are skipped and the chain is propagated only once. Failed
+    runs are retried with backoff.
+    """
+    with transaction.atomic():
+        if PropagationJob.claim(job_id) is None:
+            return None
+
+    with transaction.atomic():
+        job = PropagationJob.objects \
+            .select_for_update(skip_locked=True) \
+            .filter(pk=job_id, status=PropagationJob.Status.RUNNING) \
+            .select_related("task__stage__chain") \
+            .first()
+        if job is None:
+            return None
+
+        try:
+            with transaction.atomic():
+                next_direct_task = process_completed_task(job.task)
+        except Exception:
+            exc_type, value, tb = sys.exc_info()
+            if job.fail(f"{exc_type.__name__}: {value}"):
+                job.generate_error(
+                    exc_type=exc_type,
+                    details=f"Deferred propagation of task {job.task_id} "
+                            f"failed",
+                    tb=tb, tb_info=traceback.format_exc(),
+                    data=json.dumps({"task": job.task_id, "job": job.id})
+                )
+            return None
+
+        job.status = PropagationJob.Status.DONE
+        job.next_direct_task = next_direct_task
+        job.error = ""
+        job.save()
+        return next_direct_task
+
+
+def sweep_propagation_jobs():
+    """
+    Entry point of the sweep_propagation_jobs schedule of the django_q
+    cluster. Returns number of jobs pushed again.
+    """
+    return len(PropagationJob.sweep())
+
+
+def run_export_job(job_id):
+    """
+    Entry point of the django_q cluster for exports. Each chunk is
+    written in its own transaction with the job row locked, and the
+    checkpoint is saved with it. When the time budget of the run is
+    spent, the job is pushed to the cluster again and continues from the
+    checkpoint, so the export isn't killed by the cluster timeout.
+    """
+    deadline = time.monotonic() + settings.EXPORT_JOB_TIME_BUDGET
+    is_first_chunk = True
+    while True:
+        with transaction.atomic():
+            job = ExportJob.objects \
+                .select_for_update(skip_locked=True, of=("self",)) \
+                .filter(pk=job_id, status__in=[ExportJob.Status.PENDING,
+                                               ExportJob.Status.RUNNING]) \
+                .select_related("campaign", "response_flattener__task_stage") \
+                .first()
+            if job is None:
+                return None
+
+            attempts = job.attempts + is_first_chunk
+            is_first_chunk = False
+            try:
+                with transaction.atomic():
+                    job.attempts = attempts
+                    job.status = ExportJob.Status.RUNNING
+                    if job.total_rows is None:
+                        job.start()
+                    finished = job.write_chunk(settings.EXPORT_JOB_CHUNK_SIZE)
+                    if finished:
+                        job.status = ExportJob.Status.DONE
+                        job.error = ""
+                    job.save()
+            except Exception:
+                exc_type, value, tb = sys.exc_info()
+                # Progress of the failed chunk is dropped, the job is
+                # resumed from the last checkpoint.
+                job.refresh_from_db()
+                job.attempts = attempts
+                job.status = ExportJob.Status.FAILED
+                job.error = f"{exc_type.__name__}: {value}"
+                job.save()
+                job.generate_error(
+                    exc_type=exc_type,
+                    details=f"Export {job.id} failed",
+                    tb=tb, tb_info=traceback.format_exc(),
+                    data=json.dumps({"job": job.id})
+                )
+                return job
+            if finished:
+                return job
+        if time.monotonic() >= deadline:
+            job.enqueue()
+            return job
+
+
 def process_out_stages(current_stage, task):
-    out_task_stages = TaskStage.objects \
-        .filter(in_stages=current_stage)
-    out_conditional_stages = ConditionalStage.objects \
-        .filter(in_stages=current_stage).exclude(
-        conditional_limit__isnull=False
-    )
-    out_conditional_limit_stages = ConditionalStage.objects.filter(
-        in_stages=current_stage,
-        conditional_limit__isnull=False
-    ).order_by('conditional_limit__order', 'conditional_limit__created_at')
+    graph = ChainGraph.for_stage(current_stage)
+    out_task_stages = graph.out_task_stages(current_stage.id)
+    out_conditional_stages = graph.out_conditional_stages(current_stage.id)
+    out_conditional_limit_stages = graph.out_conditional_limit_stages(
+        current_stage.id)
     for stage in out_conditional_stages:
         process_conditional(stage, task)
     for stage in out_conditional_limit_stages:
         is_conditional_limit_created = process_conditional_limit(stage, task)
         if is_conditional_limit_created:
             break
-    for stage in out_task_stages:
-        create_new_task(stage, task)
+    create_new_tasks(out_task_stages, task)
 
 
 def process_conditional_limit(stage, in_task):
@@ -139,7 +253,7 @@ def process_conditional_limit(stage, in_task):
     return False
 
 
-def send_webhook_request(stage, in_task):
+def get_webhook_params(stage, in_task):
     params = {}
     if stage.webhook_payload_field:
         params[stage.webhook_payload_field] = json.dumps(in_task.responses)
@@ -148,7 +262,10 @@ def send_webhook_request(stage, in_task):
     if stage.webhook_params:
         params.update(stage.webhook_params)
     params["in_task_id"] = in_task.id
-    response = requests.get(stage.webhook_address, params=params)
+    return params
+
+
+def read_webhook_response(stage, response, params):
     if response:
         if stage.webhook_response_field:
             response = response.json()[stage.webhook_response_field]
@@ -166,10 +283,18 @@ def send_webhook_request(stage, in_task):
                                  "Service can't handle this request due to unforeseen behaviour of another service.")
 
 
-def process_webhook(stage, in_task, data=None):
+def send_webhook_request(stage, in_task):
+    params = get_webhook_params(stage, in_task)
+    response = webhook_client.send("get", stage.webhook_address,
+                                   params=params)
+    return read_webhook_response(stage, response, params)
+
+
+def process_webhook(stage, in_task, data=None, response=None):
     data = data if data else dict()
     data['stage'], data['case'] = stage, in_task.case
-    response = send_webhook_request(stage, in_task)
+    if response is None:
+        response = send_webhook_request(stage, in_task)
     data["responses"] = response
     data["complete"] = True
     new_task = in_task.out_tasks.filter(stage=stage).first()
@@ -182,6 +307,124 @@ def process_webhook(stage, in_task, data=None):
     return new_task
 
 
+class WebhookBatch:
+    """
+    Creates out tasks of stages calling webhooks. Requests of all added
+    stages are made at once on the thread pool of the webhook client, so
+    one slow webhook doesn't hold the others. Everything touching the
+    database is done in the calling thread before and after the requests.
+    """
+
+    def __init__(self):
+        self.pending = []
+
+    @staticmethod
+    def is_batchable(stage):
+        if stage.webhook_address:
+            return True
+        if stage.get_integration() or stage._translation_adapter:
+            return False
+        webhook = stage.get_webhook()
+        return bool(webhook and webhook.is_triggered)
+
+    def add(self, stage, in_task, user=None):
+        if stage.webhook_address:
+            for copy_field in stage.copy_fields.all():
+                in_task.responses = copy_field.copy_response(in_task)
+            new_task, params = None, get_webhook_params(stage, in_task)
+            if stage.webhook_outbox:
+                WebhookDelivery.record(stage, in_task, params)
+                return
+            call = partial(webhook_client.send, "get", stage.webhook_address,
+                           params=params)
+        else:
+            data = {"stage": stage, "case": in_task.case}
+            new_task = process_stage_assign(stage, data, in_task, user)
+            new_task = trigger_on_copy_input(stage, new_task, in_task)
+            url, params = stage.get_webhook().prepare(new_task)
+            call = partial(stage.get_webhook().request, url, params)
+        self.pending.append((stage, in_task, new_task, params, call))
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        if not pending:
+            return
+        futures = webhook_client.dispatch([call for *_, call in pending])
+        for (stage, in_task, new_task, params, _), future in \
+                zip(pending, futures):
+            if new_task is None:
+                response = read_webhook_response(stage, future.result(),
+                                                 params)
+                new_task = process_webhook(stage, in_task, response=response)
+            else:
+                stage.get_webhook().apply(new_task, future.result(), params)
+                new_task = finish_new_task(stage, new_task, in_task)
+            process_create_new_task_based_and_stage_assign(stage, new_task,
+                                                           in_task)
+
+
+def deliver_webhooks(target):
+    """
+    Entry point of the django_q cluster for the webhook outbox. Due
+    deliveries of the target are called at once through its pooled
+    session. Each response creates the out task in its own transaction;
+    failed deliveries are retried later or left dead.
+    """
+    with transaction.atomic():
+        deliveries = WebhookDelivery.claim(target)
+    if not deliveries:
+        return 0
+    futures = webhook_client.dispatch([
+        partial(webhook_client.send, "get", delivery.url,
+                params=delivery.params)
+        for delivery in deliveries
+    ])
+    for delivery, future in zip(deliveries, futures):
+        complete_webhook_delivery(delivery, future)
+    if deliveries[-1].has_due():
+        WebhookDelivery.enqueue(target)
+    return len(deliveries)
+
+
+def sweep_webhook_deliveries():
+    """
+    Entry point of the sweep_webhook_deliveries schedule of the django_q
+    cluster. Returns number of targets pushed again.
+    """
+    return len(WebhookDelivery.sweep())
+
+
+def complete_webhook_delivery(delivery, future):
+    stage, in_task = delivery.stage, delivery.in_task
+    try:
+        with transaction.atomic():
+            response = future.result()
+            response.raise_for_status()
+            if stage.webhook_response_field:
+                responses = response.json()[stage.webhook_response_field]
+            else:
+                responses = response.json()
+            new_task = process_webhook(stage, in_task, response=responses)
+            process_create_new_task_based_and_stage_assign(stage, new_task,
+                                                           in_task)
+            delivery.status = WebhookDelivery.Status.DONE
+            delivery.result_task = new_task
+            delivery.error = ""
+            delivery.save()
+    except Exception:
+        exc_type, value, tb = sys.exc_info()
+        with transaction.atomic():
+            if delivery.fail(f"{exc_type.__name__}: {value}"):
+                stage.generate_error(
+                    exc_type=exc_type,
+                    details=f"Webhook of stage {stage.id} failed "
+                            f"{delivery.attempts} times",
+                    tb=tb, tb_info=traceback.format_exc(),
+                    data=json.dumps({"delivery": delivery.id,
+                                     "task": in_task.id})
+                )
+
+
 def process_integration(stage, in_task):
     if not (in_task.complete and in_task.stage.assign_user_by == TaskStageConstants.INTEGRATOR):
         integration = stage.get_integration()
@@ -198,15 +441,19 @@ def process_integration(stage, in_task):
         return in_task
 
 
+def get_stage_assignee(stage, in_task):
+    assignee_task = Task.objects \
+        .filter(stage_id=stage.assign_user_from_stage_id) \
+        .filter(case=in_task.case)
+    return assignee_task[0].assignee
+
+
 def process_stage_assign(stage, data, in_task, user):
     if user:
         data["assignee"] = user
     elif stage.assign_user_by == TaskStageConstants.STAGE:
-        if stage.assign_user_from_stage is not None:
-            assignee_task = Task.objects \
-                .filter(stage=stage.assign_user_from_stage) \
-                .filter(case=in_task.case)
-            data["assignee"] = assignee_task[0].assignee
+        if stage.assign_user_from_stage_id is not None:
+            data["assignee"] = get_stage_assignee(stage, in_task)
     new_task = in_task.out_tasks.filter(stage=stage).first()
     if stage.chain.is_individual and new_task:
         # implement new logic task creation
@@ -224,13 +471,7 @@ def trigger_on_copy_input(stage, new_task, in_task):
     return new_task
 
 
-def trigger_on_webhook(stage, new_task):
-    webhook = stage.get_webhook()
-    if webhook and webhook.is_triggered:
-        webhook.trigger(new_task)
-
-
-def set_copied_fields(stage, new_task, responses=None):
+def set_copied_fields(stage, new_task, responses=None, save=True):
     responses = responses if responses else {}
     for copy_field in stage.copy_fields.all():
         responses.update(copy_field.copy_response(new_task))
@@ -240,37 +481,51 @@ def set_copied_fields(stage, new_task, responses=None):
     else:
         new_task.responses = responses
 
-    new_task.save()
+    if save:
+        new_task.save()
 
     return new_task
 
 
-def set_count_tasks_fields(stage, new_task, responses=None):
-    responses = responses if responses else {}
-    for count_tasks_modifier in stage.count_tasks_modifier.all():
-
-        task_query = Task.objects.filter(stage=count_tasks_modifier.stage_to_count_tasks_from)
-
-        if count_tasks_modifier.count_unique_users:
-            task_query = task_query.values('assignee').distinct()
+def count_modifier_tasks(count_tasks_modifier, complete=None, pending=()):
+    """
+    Count tasks of the modifier stage. Pending tasks are not saved yet,
+    but are counted as if they were.
+    """
+    task_query = Task.objects.filter(stage=count_tasks_modifier.stage_to_count_tasks_from)
+    pending = [t for t in pending
+               if t.stage_id == count_tasks_modifier.stage_to_count_tasks_from_id]
+    if complete is not None:
+        task_query = task_query.filter(complete=complete)
+        pending = [t for t in pending if t.complete == complete]
 
-        responses[count_tasks_modifier.field_to_write_count_to] = task_query.count()
+    if not count_tasks_modifier.count_unique_users:
+        return task_query.count() + len(pending)
 
-        #Complete tasks
-        task_query = Task.objects.filter(stage=count_tasks_modifier.stage_to_count_tasks_from,
-                                         complete=True)
+    count = task_query.values('assignee').distinct().count()
+    for assignee_id in {t.assignee_id for t in pending}:
+        if not task_query.filter(assignee_id=assignee_id).exists():
+            count += 1
+    return count
 
-        if count_tasks_modifier.count_unique_users:
-            task_query = task_query.values('assignee').distinct()
 
-        responses[count_tasks_modifier.field_to_write_count_complete] = task_query.count()
+def set_count_tasks_fields(stage, new_task, responses=None, pending=(),
+                           save=True):
+    responses = responses if responses else {}
+    for count_tasks_modifier in stage.count_tasks_modifier.all():
+        responses[count_tasks_modifier.field_to_write_count_to] = \
+            count_modifier_tasks(count_tasks_modifier, pending=pending)
+        responses[count_tasks_modifier.field_to_write_count_complete] = \
+            count_modifier_tasks(count_tasks_modifier, complete=True,
+                                 pending=pending)
 
     if new_task.responses:
         new_task.responses.update(responses)
     else:
         new_task.responses = responses
 
-    new_task.save()
+    if save:
+        new_task.save()
 
     return new_task
 
@@ -301,10 +556,11 @@ def process_create_new_task_based_and_stage_assign(stage, new_task, in_task):
 def create_new_task(stage, in_task, user=None):
     data = {"stage": stage, "case": in_task.case}
     new_task = None
-    if stage.webhook_address:
-        for copy_field in stage.copy_fields.all():
-            in_task.responses = copy_field.copy_response(in_task)
-        new_task = process_webhook(stage, in_task, data)
+    if WebhookBatch.is_batchable(stage):
+        batch = WebhookBatch()
+        batch.add(stage, in_task, user)
+        batch.flush()
+        return
     elif stage.get_integration():
         in_task = process_integration(stage, in_task)
     elif stage._translation_adapter:
@@ -328,18 +584,131 @@ def create_new_task(stage, in_task, user=None):
         # if tasks_with_same_stage_case_and_user_count > 0:
         #     return None
 
+        if TaskMaterializer.is_materializable(stage, in_task):
+            materializer = TaskMaterializer()
+            materializer.add(stage, in_task, user)
+            new_task = materializer.flush()[0][1]
+            process_create_new_task_based_and_stage_assign(stage, new_task,
+                                                           in_task)
+            return
+
         new_task = process_stage_assign(stage, data, in_task, user)
         new_task = trigger_on_copy_input(stage, new_task, in_task)
-        trigger_on_webhook(stage, new_task)
-        set_period(stage, new_task)
-        new_task = set_copied_fields(stage, new_task)
-        new_task = set_count_tasks_fields(stage, new_task)
-        process_auto_completed_task(stage, new_task)
-        new_task = process_previous_manual_assign(stage, new_task, in_task)
+        new_task = finish_new_task(stage, new_task, in_task)
 
     process_create_new_task_based_and_stage_assign(stage, new_task, in_task)
 
 
+def finish_new_task(stage, new_task, in_task):
+    set_period(stage, new_task)
+    new_task = set_copied_fields(stage, new_task)
+    new_task = set_count_tasks_fields(stage, new_task)
+    process_auto_completed_task(stage, new_task)
+    return process_previous_manual_assign(stage, new_task, in_task)
+
+
+class TaskMaterializer:
+    """
+    Computes final state of new tasks in memory (assignee, period, copied
+    and counted fields, auto complete flag) and writes all of them with one
+    bulk insert of tasks and one bulk insert of in_tasks links.
+    Tasks counted by count tasks modifiers include pending tasks, so
+    counts are the same as if tasks were saved one by one.
+    """
+
+    def __init__(self):
+        self.pending = []
+
+    @staticmethod
+    def is_materializable(stage, in_task):
+        """
+        Stages calling external services and individual chains, where the
+        existing out task is reused, are processed by create_new_task.
+        """
+        if stage.webhook_address or stage.get_integration() \
+                or stage._translation_adapter:
+            return False
+        webhook = stage.get_webhook()
+        if webhook and webhook.is_triggered:
+            return False
+        if stage.chain.is_individual \
+                and in_task.out_tasks.filter(stage=stage).exists():
+            return False
+        return True
+
+    @property
+    def pending_tasks(self):
+        return [new_task for stage, new_task, in_task in self.pending]
+
+    def add(self, stage, in_task, user=None):
+        new_task = Task(stage=stage, case=in_task.case)
+        if user:
+            new_task.assignee = user
+        elif stage.assign_user_by == TaskStageConstants.STAGE \
+                and stage.assign_user_from_stage_id is not None:
+            new_task.assignee = get_stage_assignee(stage, in_task)
+        if stage.copy_input and in_task.responses:
+            new_task.responses = dict(in_task.responses)
+        self.pending.append((stage, new_task, in_task))
+
+        set_period(stage, new_task)
+        set_copied_fields(stage, new_task, save=False)
+        set_count_tasks_fields(stage, new_task, pending=self.pending_tasks,
+                               save=False)
+        if stage.assign_user_by == TaskStageConstants.AUTO_COMPLETE:
+            new_task.complete = True
+        if stage.assign_user_by == TaskStageConstants.PREVIOUS_MANUAL:
+            try:
+                new_task.assignee = get_previous_manual_assignee(stage,
+                                                                 in_task)
+            except CustomApiException:
+                self.pending.pop()
+                raise
+        return new_task
+
+    def flush(self):
+        """
+        Write pending tasks. Returns list of (stage, new task, in task).
+        """
+        pending, self.pending = self.pending, []
+        if not pending:
+            return pending
+        Task.objects.bulk_create([new_task for _, new_task, _ in pending])
+        for _, new_task, _ in pending:
+            new_task.store_loaded_values()
+        new_tasks = [new_task for _, new_task, _ in pending]
+        UserStageCounter.add_tasks(new_tasks)
+        SelectableTask.add_tasks(new_tasks)
+        through = Task.in_tasks.through
+        through.objects.bulk_create([
+            through(from_task_id=new_task.id, to_task_id=in_task.id)
+            for _, new_task, in_task in pending
+        ])
+        return pending
+
+
+def create_new_tasks(stages, in_task):
+    """
+    Create tasks of all out stages of the propagation step. Tasks which
+    don't call external services are written at once by TaskMaterializer,
+    webhooks of the other stages are called at once by WebhookBatch.
+    """
+    materializer = TaskMaterializer()
+    webhooks = WebhookBatch()
+    for stage in stages:
+        if TaskMaterializer.is_materializable(stage, in_task):
+            materializer.add(stage, in_task)
+        elif WebhookBatch.is_batchable(stage):
+            webhooks.add(stage, in_task)
+        else:
+            create_new_task(stage, in_task)
+    webhooks.flush()
+    created = materializer.flush()
+    for stage, new_task, in_task in created:
+        process_create_new_task_based_and_stage_assign(stage, new_task,
+                                                       in_task)
+
+
 def set_period(stage, new_task):
     datetime_task = DatetimeSort.objects.filter(stage_id=stage.id)
     if datetime_task:
@@ -356,8 +725,8 @@ def process_conditional(stage, in_task):
     if evaluate_conditional_stage(stage, in_task) and not stage.pingpong:
         process_out_stages(stage, in_task)
     elif stage.pingpong:
-        out_task_stages = TaskStage.objects \
-            .filter(in_stages=stage)
+        out_task_stages = ChainGraph.for_stage(stage) \
+            .out_task_stages(stage.id)
         for stage in out_task_stages:
             out_tasks = in_task.out_tasks.filter(stage=stage)
             if len(out_tasks) > 0:
@@ -383,6 +752,171 @@ def process_conditional(stage, in_task):
                 create_new_task(stage, in_task)
 
 
+def select_fitting_tasks(stage, tasks):
+    """
+    Return tasks which responses fit the conditions of the stage.
+    Conditions are translated into a single SQL filter when possible,
+    otherwise they are evaluated in python chunk by chunk.
+    """
+    compiled = stage.get_compiled_conditions()
+    try:
+        aliases, q = compiled.to_filter(alias=f"_stage_{stage.id}")
+        return tasks.alias(**aliases).filter(q)
+    except UntranslatableCondition:
+        pass
+
+    fitting = []
+    rows = tasks.values_list("id", "responses")
+    for task_id, responses in rows.iterator(chunk_size=BULK_CHUNK_SIZE):
+        try:
+            if compiled.evaluate(responses):
+                fitting.append(task_id)
+        except ConditionEvaluationError:
+            continue
+    return tasks.filter(id__in=fitting)
+
+
+def is_plain_task_stage(stage):
+    """
+    Check that new tasks of the stage need nothing but assignment by rank
+    or by stage, so they may be created in bulk.
+    """
+    node = ChainGraph.for_stage(stage).nodes.get(stage.id)
+    if node is None or stage.webhook_address:
+        return False
+    if stage.assign_user_by not in [TaskStageConstants.RANK,
+                                    TaskStageConstants.STAGE]:
+        return False
+    if node.has_webhook or node.has_integration \
+            or node.has_translation_adapter or node.has_copy_fields:
+        return False
+    return not (stage.count_tasks_modifier.exists()
+                or DatetimeSort.objects.filter(stage_id=stage.id).exists())
+
+
+def bulk_create_out_tasks(stage, in_tasks):
+    """
+    Create a task of the stage for each of the in tasks. Tasks of plain
+    stages are inserted in bulk, others go through create_new_task.
+    Returns number of processed in tasks.
+    """
+    if not is_plain_task_stage(stage):
+        count = 0
+        in_tasks = in_tasks.iterator(chunk_size=BULK_CHUNK_SIZE)
+        while True:
+            chunk = list(islice(in_tasks, BULK_CHUNK_SIZE))
+            if not chunk:
+                break
+            materializer = TaskMaterializer()
+            for in_task in chunk:
+                if TaskMaterializer.is_materializable(stage, in_task):
+                    materializer.add(stage, in_task)
+                else:
+                    create_new_task(stage, in_task)
+            created = materializer.flush()
+            for _, new_task, in_task in created:
+                process_create_new_task_based_and_stage_assign(
+                    stage, new_task, in_task)
+            count += len(chunk)
+        return count
+
+    rows = in_tasks.values("id", "case_id", "responses")
+    if stage.assign_user_by == TaskStageConstants.STAGE \
+            and stage.assign_user_from_stage_id is not None:
+        rows = rows.annotate(new_assignee=Subquery(
+            Task.objects.filter(stage_id=stage.assign_user_from_stage_id,
+                                case=OuterRef("case"))
+            .values("assignee")[:1]
+        ))
+
+    through = Task.in_tasks.through
+    count = 0
+    rows = rows.iterator(chunk_size=BULK_CHUNK_SIZE)
+    while True:
+        chunk = list(islice(rows, BULK_CHUNK_SIZE))
+        if not chunk:
+            break
+        new_tasks = Task.objects.bulk_create([
+            Task(
+                stage=stage,
+                case_id=row["case_id"],
+                assignee_id=row.get("new_assignee"),
+                responses=(row["responses"] or {}) if stage.copy_input else {}
+            ) for row in chunk
+        ])
+        through.objects.bulk_create([
+            through(from_task_id=new_task.id, to_task_id=row["id"])
+            for new_task, row in zip(new_tasks, chunk)
+        ])
+        UserStageCounter.add_tasks(new_tasks)
+        SelectableTask.add_tasks(new_tasks)
+        count += len(chunk)
+    return count
+
+
+def select_not_duplicated_tasks(stage, tasks):
+    """
+    Return tasks passing the prevent_duplicate check of the stage (see
+    evaluate_conditional_stage): its first out stage has no task of the
+    same case and assignee yet. One task of each case and assignee is
+    taken.
+    """
+    out_ids = ChainGraph.for_stage(stage).out_ids(stage.id)
+    if not out_ids:
+        return tasks
+    duplicates = Task.objects.filter(stage_id=out_ids[0],
+                                     case=OuterRef("case"))
+    tasks = tasks \
+        .alias(_has_duplicate=Exists(
+            duplicates.filter(assignee=OuterRef("assignee"))),
+               _has_unassigned_duplicate=Exists(
+            duplicates.filter(assignee__isnull=True))) \
+        .exclude(_has_duplicate=True) \
+        .exclude(assignee__isnull=True, _has_unassigned_duplicate=True)
+    return tasks.filter(id__in=tasks.order_by("case", "assignee", "id")
+                        .distinct("case", "assignee").values("id"))
+
+
+def is_reroutable(stage):
+    """
+    Pingpong stages and stages with conditional limits depend on the
+    order of completion, they can't be rerouted.
+    """
+    node = ChainGraph.for_stage(stage).nodes.get(stage.id)
+    return not stage.pingpong \
+        and (node is None or node.limit_order is None)
+
+
+def reroute_conditional_stage(stage, tasks=None):
+    """
+    Route completed in tasks of the conditional stage which fit its
+    conditions but have no tasks on its out stages yet, e.g. after the
+    conditions were changed. Nested conditional stages are rerouted the
+    same way, pingpong and limited ones are skipped (see is_reroutable).
+    Stages with prevent_duplicate route tasks as evaluate_conditional_stage
+    does. Returns number of created tasks.
+    """
+    if not is_reroutable(stage):
+        return 0
+    graph = ChainGraph.for_stage(stage)
+    if tasks is None:
+        tasks = Task.objects.filter(stage_id__in=graph.in_ids(stage.id),
+                                    complete=True)
+    if stage.prevent_duplicate:
+        tasks = select_not_duplicated_tasks(stage, tasks)
+    else:
+        tasks = select_fitting_tasks(stage, tasks)
+
+    created = 0
+    for out_stage in graph.out_task_stages(stage.id):
+        created += bulk_create_out_tasks(
+            out_stage, tasks.exclude(out_tasks__stage=out_stage)
+        )
+    for out_stage in graph.out_conditional_stages(stage.id):
+        created += reroute_conditional_stage(out_stage, tasks)
+    return created
+
+
 def evaluate_conditional_stage(stage, task, is_limited=False):
     """Checks each response
        Returns True if all responses exist and fit to the conditions
@@ -390,7 +924,6 @@ def evaluate_conditional_stage(stage, task, is_limited=False):
     rules = stage.conditions
     rules = rules if rules else []
     responses = task.responses
-    results = list()
 
     # Check not to create duplicate tasks
     if stage.prevent_duplicate:
@@ -411,43 +944,33 @@ def evaluate_conditional_stage(stage, task, is_limited=False):
     if responses is None:
         return False
 
-    for rule in rules:
-        control_value = rule.get("value")
-        condition = rule.get("condition")
-        type_ = rule.get("type") if rule.get("type") else "string"
-
-        if not ConditionalStageConstants.SUPPORTED_TYPES.get(type_):
-            stage.generate_error(
-                exc_type=ValueError,
-                details=f"Invalid type {type_} provided on conditional stage {stage.id}",
-                tb=traceback.format_tb,
-                data=f"{rules}\n{rule}"
-            )
-            raise CustomApiException(status.HTTP_400_BAD_REQUEST,
-                                     f'{ErrorConstants.UNSUPPORTED_TYPE % type_} {ErrorConstants.SEND_TO_MODERATORS}')
-
-        actual_value = None
-        if not is_limited:
-            actual_value = get_value_from_dotted(rule["field"], responses)
-        elif is_limited:
-            actual_value = get_conditional_limit_count(stage, rule)
+    try:
+        compiled = stage.get_compiled_conditions()
+    except InvalidCondition as exc:
+        stage.generate_error(
+            exc_type=ValueError,
+            details=f"Invalid conditions in conditional stage {stage.id}: {exc}",
+            tb_info=traceback.format_exc(),
+            data=json.dumps({"conditions": rules})
+        )
+        raise CustomApiException(status.HTTP_400_BAD_REQUEST,
+                                 f'{ErrorConstants.UNSUPPORTED_TYPE % exc.rule_type} {ErrorConstants.SEND_TO_MODERATORS}')
 
-        try:
-            control_value = ConditionalStageConstants.SUPPORTED_TYPES.get(type_)(control_value)
-            f = ConditionalStageConstants.OPERATORS.get(condition)
-            results.append(f(control_value, actual_value))
-        except Exception as e:
-            exc_type, value, tb = sys.exc_info()
-            stage.generate_error(
-                exc_type=exc_type,
-                details=f"Invalid conditions in conditional stage {stage.id}",
-                tb=tb, tb_info=traceback.format_exc(),
-                data=json.dumps({"responses": responses, "conditions": rules})
-                )
-            raise CustomApiException(status.HTTP_400_BAD_REQUEST,
-                                     f'{ErrorConstants.UNSUPPORTED_TYPE % type_} {ErrorConstants.SEND_TO_MODERATORS}')
+    limit_count = None
+    if is_limited and len(compiled):
+        limit_count = get_conditional_limit_count(stage, rules)
 
-    return all(results)
+    try:
+        return compiled.evaluate(responses, limit_count)
+    except ConditionEvaluationError as exc:
+        stage.generate_error(
+            exc_type=type(exc.__cause__),
+            details=f"Invalid conditions in conditional stage {stage.id}",
+            tb=exc.__cause__.__traceback__, tb_info=traceback.format_exc(),
+            data=json.dumps({"responses": responses, "conditions": rules})
+            )
+        raise CustomApiException(status.HTTP_400_BAD_REQUEST,
+                                 f'{ErrorConstants.UNSUPPORTED_TYPE % exc.rule.type} {ErrorConstants.SEND_TO_MODERATORS}')
 
 
 def evaluate_conditional_logic_stage(stage: ConditionalStage, task: Task):
@@ -471,6 +994,19 @@ def evaluate_conditional_logic_stage(stage: ConditionalStage, task: Task):
 
 
 def assign_by_previous_manual(stage, new_task, in_task):
+    try:
+        user = get_previous_manual_assignee(stage, in_task)
+    except CustomApiException:
+        new_task.delete()
+        raise
+
+    new_task.assignee = user
+    new_task.save()
+
+    return new_task
+
+
+def get_previous_manual_assignee(stage, in_task):
     previous_manual_to_assign = stage.get_previous_manual_to_assign()
     task_with_email = Task.objects.filter(case=in_task.case,
                                           stage=previous_manual_to_assign.task_stage_email
@@ -483,18 +1019,13 @@ def assign_by_previous_manual(stage, new_task, in_task):
 
     if not user:
         reopen_task(task_with_email)
-        new_task.delete()
         raise CustomApiException(status.HTTP_400_BAD_REQUEST, ErrorConstants.ENTITY_DOESNT_EXIST % ('User', value))
 
     if not user.ranks.filter(ranklimits__in=RankLimit.objects.filter(stage__chain__campaign_id=stage.get_campaign())):
         reopen_task(task_with_email)
-        new_task.delete()
         raise CustomApiException(status.HTTP_400_BAD_REQUEST, ErrorConstants.ENTITY_IS_NOT_IN_CAMPAIGN % 'User')
 
-    new_task.assignee = user
-    new_task.save()
-
-    return new_task
+    return user
 
 
 def get_value_from_dotted(dotted_path, source_dict):
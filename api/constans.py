@@ -34,6 +34,15 @@ class ConditionalStageConstants:
         "nin": not_contains
     }
 
+    # Operators are called as operator(control, actual), so "value > actual"
+    # is "actual < value" in the database lookups.
+    MIRRORED_OPERATORS = {
+        ">": "<",
+        "<": ">",
+        ">=": "<=",
+        "<=": ">=",
+    }
+
     SUPPORTED_TYPES = {
         "boolean": bool,
         "number": float,
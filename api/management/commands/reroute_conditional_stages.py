@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.asyncstuff import reroute_conditional_stage, is_reroutable
+from api.models import ConditionalStage
+
+
+class Command(BaseCommand):
+    help = "Route completed in tasks of conditional stages which fit " \
+           "current conditions but have no out tasks yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument("stage_ids", nargs="+", type=int,
+                            help="Ids of conditional stages")
+
+    def handle(self, *args, **options):
+        stages = ConditionalStage.objects.filter(id__in=options["stage_ids"])
+        missing = set(options["stage_ids"]) - {stage.id for stage in stages}
+        if missing:
+            raise CommandError(
+                f"Conditional stages {sorted(missing)} don't exist.")
+
+        for stage in stages:
+            if not is_reroutable(stage):
+                self.stdout.write(self.style.WARNING(
+                    f"Skip pingpong or limited stage {stage.id}."))
+                continue
+            with transaction.atomic():
+                created = reroute_conditional_stage(stage)
+            self.stdout.write(self.style.SUCCESS(
+                f"Stage {stage.id}: {created} tasks created."))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.models import Quiz
+
+
+class Command(BaseCommand):
+    help = "Score completed tasks of quiz stages with the current " \
+           "correct responses. Tasks aren't reopened."
+
+    def add_arguments(self, parser):
+        parser.add_argument("stage_ids", nargs="+", type=int,
+                            help="Ids of quiz stages")
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="Number of tasks updated at once")
+
+    def handle(self, *args, **options):
+        quizzes = Quiz.objects.filter(task_stage_id__in=options["stage_ids"]) \
+            .select_related("task_stage", "correct_responses_task")
+        missing = set(options["stage_ids"]) - {quiz.pk for quiz in quizzes}
+        if missing:
+            raise CommandError(
+                f"Stages {sorted(missing)} have no quiz.")
+
+        for quiz in quizzes:
+            if not quiz.is_ready():
+                self.stdout.write(self.style.WARNING(
+                    f"Skip stage {quiz.pk}: quiz has no correct responses."))
+                continue
+            with transaction.atomic():
+                changed = quiz.rescore_tasks(quiz.task_stage.tasks.all(),
+                                             options["batch_size"])
+            self.stdout.write(self.style.SUCCESS(
+                f"Stage {quiz.pk}: {changed} tasks rescored."))
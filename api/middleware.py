@@ -0,0 +1,176 @@
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger("api.queries")
+
+PLACEHOLDER_LIST = re.compile(r"\(%s(\s*,\s*%s)*\)")
+SPACES = re.compile(r"\s+")
+
+
+def get_fingerprint(sql):
+    """
+    Return sql without variable parts: lists of parameters are collapsed,
+    so `id IN (%s, %s)` and `id IN (%s)` are the same query.
+    """
+    return SPACES.sub(" ", PLACEHOLDER_LIST.sub("(%s...)", sql)).strip()
+
+
+class QueryStats:
+    """
+    Counts queries of all database connections of the current thread
+    while it is entered. Action and budget are set by QueryStatsMiddleware
+    from the viewset handling the request.
+    """
+
+    def __init__(self, action=None, budget=None):
+        self.action = action
+        self.budget = budget
+        self.count = 0
+        self.time = 0.0
+        self.fingerprints = Counter()
+        self._wrappers = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - start
+            self.count += 1
+            self.fingerprints[get_fingerprint(sql)] += 1
+
+    def __enter__(self):
+        self._wrappers = ExitStack()
+        for connection in connections.all():
+            self._wrappers.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrappers.close()
+
+    def get_duplicates(self):
+        """
+        Return queries run more than once with the number of runs, the
+        most repeated first. Usually it is N+1 of a serializer.
+        """
+        return {sql: count for sql, count in self.fingerprints.most_common()
+                if count > 1}
+
+    @property
+    def duplicate_count(self):
+        return sum(count - 1 for count in self.get_duplicates().values())
+
+    @property
+    def over_budget(self):
+        return self.budget is not None and self.count > self.budget
+
+    def as_dict(self):
+        return {
+            "action": self.action,
+            "queries": self.count,
+            "time_ms": round(self.time * 1000, 1),
+            "duplicates": self.duplicate_count,
+            "budget": self.budget,
+            "repeated": [{"sql": sql[:300], "count": count}
+                         for sql, count in self.get_duplicates().items()][:5],
+        }
+
+
+def get_view_action(request, view_func):
+    """
+    Return name of the viewset action handling the request and its query
+    budget from query_budgets of the viewset.
+    """
+    cls = getattr(view_func, "cls", None)
+    if cls is None:
+        return getattr(view_func, "__name__", None), None
+    method = request.method.lower()
+    action = (getattr(view_func, "actions", None) or {}).get(method, method)
+    budget = (getattr(cls, "query_budgets", None) or {}).get(action)
+    return f"{cls.__name__}.{action}", budget
+
+
+class StreamingStats:
+    """
+    Streaming content of the response keeping query stats active while
+    the content is generated. Stats are logged once the response is
+    closed.
+    """
+
+    def __init__(self, content, stats, on_close):
+        self.content = content
+        self.stats = stats
+        self.on_close = on_close
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.content)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.stats.__exit__(None, None, None)
+        self.on_close()
+
+
+class QueryStatsMiddleware:
+    """
+    Records number, time and repeated queries of every request. Stats are
+    logged to the api.queries logger as JSON, at WARNING level when the
+    request is over the budget of its action, and returned in X-Query-*
+    headers when QUERY_STATS_HEADERS is on. Queries of streaming responses
+    are counted until the response is closed, their headers have only the
+    queries made before streaming. Not used unless QUERY_STATS_ENABLED is
+    on, so queries aren't wrapped in production by default.
+    """
+
+    def __init__(self, get_response):
+        if not settings.QUERY_STATS_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = QueryStats().__enter__()
+        request.query_stats = stats
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            stats.__exit__(None, None, None)
+            raise
+        response.query_stats = stats
+
+        if settings.QUERY_STATS_HEADERS:
+            response["X-Query-Action"] = stats.action or ""
+            response["X-Query-Count"] = stats.count
+            response["X-Query-Time"] = f"{stats.time * 1000:.1f}"
+            response["X-Query-Duplicates"] = stats.duplicate_count
+
+        if response.streaming:
+            response.streaming_content = StreamingStats(
+                response.streaming_content, stats,
+                lambda: self.log(request, response, stats))
+        else:
+            stats.__exit__(None, None, None)
+            self.log(request, response, stats)
+        return response
+
+    @staticmethod
+    def log(request, response, stats):
+        level = logging.WARNING if stats.over_budget else logging.DEBUG
+        if logger.isEnabledFor(level):
+            data = {"path": request.path, "method": request.method,
+                    "status": response.status_code, **stats.as_dict()}
+            logger.log(level, json.dumps(data), extra={"query_stats": data})
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        stats = request.query_stats
+        stats.action, stats.budget = get_view_action(request, view_func)
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.8 on 2026-10-18 19:23
+
+import api.models.campaign
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0126_auto_20241209_0644'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chain',
+            name='deferred_propagation',
+            field=models.BooleanField(default=False, help_text='If true, completed tasks of this chain are propagated by the background cluster instead of the request.'),
+        ),
+        migrations.CreateModel(
+            name='PropagationJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, help_text='Time of creation')),
+                ('updated_at', models.DateTimeField(auto_now=True, help_text='Last update time')),
+                ('status', models.CharField(choices=[('PE', 'Pending'), ('RU', 'Running'), ('DO', 'Done'), ('FA', 'Failed')], db_index=True, default='PE', help_text='Current state of the propagation', max_length=2)),
+                ('attempts', models.PositiveIntegerField(default=0, help_text='How many times the job has been run')),
+                ('error', models.TextField(blank=True, help_text='Error raised by the last failed run')),
+                ('next_direct_task', models.ForeignKey(blank=True, help_text='Next direct task found by the propagation', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.task')),
+                ('task', models.ForeignKey(help_text='Completed task whose chain propagation is deferred', on_delete=django.db.models.deletion.CASCADE, related_name='propagation_jobs', to='api.task')),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=(models.Model, api.models.campaign.CampaignInterface),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.8 on 2026-10-18 19:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0127_deferred_propagation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='audit_sample_rate',
+            field=models.FloatField(default=1.0, help_text='Share of detected task and stage changes written to the audit log. 1 logs all of them, 0 disables the audit.'),
+        ),
+    ]
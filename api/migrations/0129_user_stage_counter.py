@@ -0,0 +1,51 @@
+# Generated by Django 3.2.8 on 2026-10-18 19:52
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Q
+
+
+def fill_counters(apps, schema_editor):
+    Task = apps.get_model("api", "Task")
+    UserStageCounter = apps.get_model("api", "UserStageCounter")
+    counts = Task.objects.filter(assignee__isnull=False) \
+        .values("assignee_id", "stage_id") \
+        .annotate(total=Count("id"),
+                  incomplete=Count("id", filter=Q(complete=False))) \
+        .order_by()
+    batch = []
+    for row in counts.iterator():
+        batch.append(UserStageCounter(
+            user_id=row["assignee_id"], stage_id=row["stage_id"],
+            total=row["total"], incomplete=row["incomplete"]
+        ))
+        if len(batch) >= 1000:
+            UserStageCounter.objects.bulk_create(batch)
+            batch = []
+    UserStageCounter.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0128_campaign_audit_sample_rate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStageCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total', models.IntegerField(default=0, help_text='Number of tasks assigned to the user')),
+                ('incomplete', models.IntegerField(default=0, help_text='Number of incomplete tasks assigned to the user')),
+                ('stage', models.ForeignKey(help_text='Stage id', on_delete=django.db.models.deletion.CASCADE, related_name='user_counters', to='api.taskstage')),
+                ('user', models.ForeignKey(help_text='User id', on_delete=django.db.models.deletion.CASCADE, related_name='stage_counters', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='userstagecounter',
+            constraint=models.UniqueConstraint(fields=('user', 'stage'), name='unique_user_stage_counter'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.2.8 on 2026-10-18 19:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+FILL_POOL = """
+INSERT INTO api_selectabletask (rank_id, stage_id, task_id)
+SELECT DISTINCT limits.rank_id, task.stage_id, task.id
+FROM api_task task
+JOIN api_ranklimit limits ON limits.stage_id = task.stage_id
+JOIN api_taskstage stage ON stage.stage_ptr_id = task.stage_id
+WHERE NOT task.complete
+  AND task.assignee_id IS NULL
+  AND stage.assign_user_by <> 'IN'
+  AND EXISTS (
+    SELECT 1 FROM api_ranklimit listed
+    WHERE listed.stage_id = task.stage_id
+      AND listed.is_selection_open
+      AND listed.is_listing_allowed
+  )
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0129_user_stage_counter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SelectableTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.ForeignKey(help_text='Rank id', on_delete=django.db.models.deletion.CASCADE, related_name='selectable_tasks', to='api.rank')),
+                ('stage', models.ForeignKey(help_text='Stage id', on_delete=django.db.models.deletion.CASCADE, related_name='selectable_tasks', to='api.taskstage')),
+                ('task', models.ForeignKey(help_text='Task id', on_delete=django.db.models.deletion.CASCADE, related_name='selectable_entries', to='api.task')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='selectabletask',
+            index=models.Index(fields=['rank', 'stage', 'task'], name='selectable_rank_stage_task'),
+        ),
+        migrations.AddConstraint(
+            model_name='selectabletask',
+            constraint=models.UniqueConstraint(fields=('rank', 'task'), name='unique_selectable_task'),
+        ),
+        migrations.RunSQL(FILL_POOL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.8 on 2026-10-18 20:13
+
+import api.models.campaign
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0130_selectable_task'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, help_text='Time of creation')),
+                ('updated_at', models.DateTimeField(auto_now=True, help_text='Last update time')),
+                ('kind', models.CharField(choices=[('FL', 'Response flattener csv'), ('UA', 'User activity csv'), ('TD', 'Task dump')], help_text='Type of the export', max_length=2)),
+                ('filters', models.JSONField(blank=True, default=dict, help_text='Task filters. Allowed keys are listed in FILTER_FIELDS.')),
+                ('status', models.CharField(choices=[('PE', 'Pending'), ('RU', 'Running'), ('DO', 'Done'), ('FA', 'Failed')], db_index=True, default='PE', help_text='Current state of the export', max_length=2)),
+                ('columns', models.JSONField(blank=True, default=list, help_text='Columns of the csv, fixed when the export is started')),
+                ('parts', models.PositiveIntegerField(default=0, help_text='Number of written part files')),
+                ('last_id', models.PositiveIntegerField(default=0, help_text='Checkpoint: id of the last exported task')),
+                ('rows_written', models.PositiveIntegerField(default=0, help_text='Number of exported rows')),
+                ('total_rows', models.PositiveIntegerField(blank=True, help_text='Number of rows to export, counted when the export is started', null=True)),
+                ('attempts', models.PositiveIntegerField(default=0, help_text='How many times the job has been run')),
+                ('error', models.TextField(blank=True, help_text='Error raised by the last failed run')),
+                ('campaign', models.ForeignKey(help_text='Campaign of exported tasks', on_delete=django.db.models.deletion.CASCADE, related_name='export_jobs', to='api.campaign')),
+                ('created_by', models.ForeignKey(blank=True, help_text='User submitted the export', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='export_jobs', to=settings.AUTH_USER_MODEL)),
+                ('response_flattener', models.ForeignKey(blank=True, help_text='Response flattener of the flattener csv', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='export_jobs', to='api.responseflattener')),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=(models.Model, api.models.campaign.CampaignInterface),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.8 on 2026-10-18 20:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0131_export_job'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='exportjob',
+            name='kind',
+            field=models.CharField(choices=[('FL', 'Response flattener csv'), ('UA', 'User activity csv'), ('TD', 'Task dump'), ('PQ', 'Parquet')], help_text='Type of the export', max_length=2),
+        ),
+        migrations.AlterField(
+            model_name='exportjob',
+            name='response_flattener',
+            field=models.ForeignKey(blank=True, help_text='Response flattener of the flattener csv. Parquet export of the flattener stage uses it too.', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='export_jobs', to='api.responseflattener'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.8 on 2026-10-18 20:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0132_export_job_parquet'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhook',
+            name='connect_timeout',
+            field=models.FloatField(blank=True, help_text='Seconds to wait for connection to the webhook. WEBHOOK_CONNECT_TIMEOUT setting is used if empty.', null=True),
+        ),
+        migrations.AddField(
+            model_name='webhook',
+            name='max_retries',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Number of retries of failed connections and 502, 503, 504 responses. WEBHOOK_MAX_RETRIES setting is used if empty.', null=True),
+        ),
+        migrations.AddField(
+            model_name='webhook',
+            name='read_timeout',
+            field=models.FloatField(blank=True, help_text='Seconds to wait for the webhook response. WEBHOOK_READ_TIMEOUT setting is used if empty.', null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.8 on 2026-10-18 20:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0133_webhook_timeouts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhook',
+            name='cache_max_size',
+            field=models.PositiveIntegerField(blank=True, help_text='Largest size of cached response body in bytes. WEBHOOK_CACHE_MAX_SIZE setting is used if empty.', null=True),
+        ),
+        migrations.AddField(
+            model_name='webhook',
+            name='cache_responses',
+            field=models.BooleanField(default=False, help_text='Keep successful responses in the cache and reuse them for requests with the same method, url and data. Only for webhooks which response depends on the request alone, like dictionaries or geocoders.'),
+        ),
+        migrations.AddField(
+            model_name='webhook',
+            name='cache_timeout',
+            field=models.PositiveIntegerField(blank=True, help_text='Seconds cached response is reused. WEBHOOK_CACHE_TIMEOUT setting is used if empty.', null=True),
+        ),
+    ]
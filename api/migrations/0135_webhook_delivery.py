@@ -0,0 +1,44 @@
+# Generated by Django 3.2.8 on 2026-10-18 20:42
+
+import api.models.campaign
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0134_webhook_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taskstage',
+            name='webhook_outbox',
+            field=models.BooleanField(default=False, help_text='Call webhook_address in the background. The call is recorded with the completed task and the task of this stage is created when the webhook answers. Failed calls are retried.'),
+        ),
+        migrations.CreateModel(
+            name='WebhookDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, help_text='Time of creation')),
+                ('updated_at', models.DateTimeField(auto_now=True, help_text='Last update time')),
+                ('target', models.CharField(db_index=True, help_text='Scheme and host of the webhook. Deliveries of the same target are sent together and limited by WEBHOOK_OUTBOX_CONCURRENCY.', max_length=300)),
+                ('url', models.URLField(help_text='Webhook URL address', max_length=1000)),
+                ('params', models.JSONField(blank=True, default=dict, help_text='Get parameters sent to webhook')),
+                ('status', models.CharField(choices=[('PE', 'Pending'), ('RU', 'Running'), ('DO', 'Done'), ('DE', 'Dead')], db_index=True, default='PE', help_text='Current state of the delivery', max_length=2)),
+                ('attempts', models.PositiveIntegerField(default=0, help_text='How many times the webhook has been called')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, help_text="Delivery isn't sent before this time")),
+                ('error', models.TextField(blank=True, help_text='Error of the last failed attempt')),
+                ('in_task', models.ForeignKey(help_text='Task which data is sent to the webhook', on_delete=django.db.models.deletion.CASCADE, related_name='webhook_deliveries', to='api.task')),
+                ('result_task', models.ForeignKey(blank=True, help_text='Task created from the webhook response', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.task')),
+                ('stage', models.ForeignKey(help_text='Stage calling the webhook', on_delete=django.db.models.deletion.CASCADE, related_name='webhook_deliveries', to='api.taskstage')),
+            ],
+            bases=(models.Model, api.models.campaign.CampaignInterface),
+        ),
+        migrations.AddIndex(
+            model_name='webhookdelivery',
+            index=models.Index(fields=['target', 'status', 'next_attempt_at'], name='api_webhook_target_3e5647_idx'),
+        ),
+    ]
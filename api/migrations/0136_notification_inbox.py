@@ -0,0 +1,60 @@
+# Generated by Django 3.2.8 on 2026-10-18 20:52
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from collections import defaultdict
+
+
+def fill_inboxes(apps, schema_editor):
+    Notification = apps.get_model("api", "Notification")
+    NotificationStatus = apps.get_model("api", "NotificationStatus")
+    RankRecord = apps.get_model("api", "RankRecord")
+    NotificationInbox = apps.get_model("api", "NotificationInbox")
+    campaign_ids = Notification.objects.values_list("campaign_id", flat=True) \
+        .distinct().order_by()
+    for campaign_id in campaign_ids:
+        received = defaultdict(set)
+        targeted = Notification.objects.filter(
+            campaign_id=campaign_id, target_user__isnull=False
+        ).values_list("target_user_id", "id")
+        by_rank = RankRecord.objects.filter(
+            rank__notification__campaign_id=campaign_id
+        ).values_list("user_id", "rank__notification__id")
+        for user_id, notification_id in [*targeted, *by_rank]:
+            received[user_id].add(notification_id)
+        read = defaultdict(set)
+        for user_id, notification_id in NotificationStatus.objects.filter(
+                notification__campaign_id=campaign_id
+        ).values_list("user_id", "notification_id"):
+            read[user_id].add(notification_id)
+        NotificationInbox.objects.bulk_create([
+            NotificationInbox(user_id=user_id, campaign_id=campaign_id,
+                              total=len(ids), unread=len(ids - read[user_id]))
+            for user_id, ids in received.items()
+        ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0135_webhook_delivery'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationInbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total', models.IntegerField(default=0, help_text='Number of notifications sent to the user')),
+                ('unread', models.IntegerField(default=0, help_text="Number of notifications the user hasn't opened")),
+                ('campaign', models.ForeignKey(help_text='Campaign id', on_delete=django.db.models.deletion.CASCADE, related_name='notification_inboxes', to='api.campaign')),
+                ('user', models.ForeignKey(help_text='User id', on_delete=django.db.models.deletion.CASCADE, related_name='notification_inboxes', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='notificationinbox',
+            constraint=models.UniqueConstraint(fields=('user', 'campaign'), name='unique_user_campaign_inbox'),
+        ),
+        migrations.RunPython(fill_inboxes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.8 on 2026-10-18 20:56
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def delete_duplicates(apps, schema_editor):
+    NotificationStatus = apps.get_model("api", "NotificationStatus")
+    duplicates = NotificationStatus.objects \
+        .values("user_id", "notification_id") \
+        .annotate(first=Min("id"), count=Count("id")) \
+        .filter(count__gt=1)
+    for i in duplicates:
+        NotificationStatus.objects \
+            .filter(user_id=i["user_id"],
+                    notification_id=i["notification_id"]) \
+            .exclude(id=i["first"]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0136_notification_inbox'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='notificationstatus',
+            constraint=models.UniqueConstraint(fields=('user', 'notification'), name='unique_user_notification_status'),
+        ),
+    ]
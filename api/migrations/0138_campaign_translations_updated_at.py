@@ -0,0 +1,18 @@
+# Generated by Django 3.2.8 on 2026-10-18 21:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0137_notification_status_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='translations_updated_at',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Time of the last change of campaign translations. Translated schemas are cached by it.', null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations
+
+SCHEDULE_NAME = "sweep_webhook_deliveries"
+
+
+def create_schedule(apps, schema_editor):
+    Schedule = apps.get_model("django_q", "Schedule")
+    Schedule.objects.update_or_create(
+        name=SCHEDULE_NAME,
+        defaults={
+            "func": "api.asyncstuff.sweep_webhook_deliveries",
+            "schedule_type": "I",  # Schedule.MINUTES
+            "minutes": 5,
+            "repeats": -1,
+        },
+    )
+
+
+def delete_schedule(apps, schema_editor):
+    Schedule = apps.get_model("django_q", "Schedule")
+    Schedule.objects.filter(name=SCHEDULE_NAME).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0139_sweep_propagation_jobs_schedule'),
+        ('django_q', '0014_schedule_cluster'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_schedule, delete_schedule),
+    ]
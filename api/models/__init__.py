@@ -1,4 +1,4 @@
-from .base import BaseModel, BaseDatesModel
+from .base import BaseModel, BaseDatesModel, TrackedFieldsMixin
 from .campaign import Campaign, CampaignInterface
 from .admin_pref import AdminPreference
 from .approve_link import ApproveLink
@@ -12,27 +12,33 @@ from .copy_field import CopyField
 from .country import Country
 from .datetime_sort import DatetimeSort
 from .dynamic_json import DynamicJson
+from .export_job import ExportJob
 from .integration import Integration
 from .language import Language, validate_language_code
 from .log import Log
 from .previous_manual import PreviousManual
+from .propagation_job import PropagationJob
 from .quiz import Quiz
 from .rank import Rank
 from .rank_limit import RankLimit
 from .rank_record import RankRecord
 from .response_flattener import ResponseFlattener
+from .selectable_task import SelectableTask
 from .task import Task
 from .task_award import TaskAward
 from .track import Track
 from .user import CustomUser, UserDelete
+from .user_stage_counter import UserStageCounter
 
 from .error import ErrorGroup, ErrorItem
 from .localization import TranslateKey, Translation, TranslationAdapter
-from .notification import Notification, NotificationStatus, AutoNotification
+from .notification import (
+    Notification, NotificationStatus, AutoNotification, NotificationInbox
+)
 from .stage import (
     TaskStage, ConditionalStage, SchemaProvider, Stage, StagePublisher
 )
-from .webhook import Webhook, TestWebhook
+from .webhook import Webhook, TestWebhook, WebhookDelivery
 from .modifiers.count_tasks_modifier import CountTasksModifier
 
 from .volume import Volume
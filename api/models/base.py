@@ -1,3 +1,6 @@
+import copy
+import json
+
 from django.db import models
 
 
@@ -30,3 +33,123 @@ class BaseModel(BaseDatesModel):
 
     class Meta:
         abstract = True
+
+
+class LoadedJSON:
+    """
+    Loaded dict or list value kept as JSON dump. Dumping is much cheaper
+    than deepcopy of big task responses, and the value is decoded only
+    when the previous value is actually read.
+    """
+    __slots__ = ("dump",)
+
+    def __init__(self, dump):
+        self.dump = dump
+
+    def load(self):
+        return json.loads(self.dump)
+
+    def is_changed(self, value):
+        try:
+            return json.dumps(value, sort_keys=True) != self.dump
+        except (TypeError, ValueError):
+            return True
+
+
+def snapshot(value):
+    """
+    Return value to keep as loaded: mutable values may be changed in
+    place, so they are dumped, other values are kept as is.
+    """
+    if not isinstance(value, (dict, list)):
+        return value
+    try:
+        return LoadedJSON(json.dumps(value, sort_keys=True))
+    except (TypeError, ValueError):
+        return copy.deepcopy(value)
+
+
+class TrackedFieldsMixin:
+    """
+    Keeps values of tracked fields as they were loaded from the database
+    or last saved, so changes can be found without another SELECT.
+    Empty tracked_fields means all concrete fields. Fields deferred on
+    loading are not tracked. Use get_loaded_value() to read a value,
+    dicts and lists are kept as LoadedJSON.
+    """
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.store_loaded_values()
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None:
+            self.store_loaded_values()
+        else:
+            attnames = {self._meta.get_field(name).attname
+                        for name in update_fields}
+            self.store_loaded_values(attnames)
+
+    def get_tracked_attnames(self):
+        if self.tracked_fields:
+            return self.tracked_fields
+        return [field.attname for field in self._meta.concrete_fields]
+
+    def store_loaded_values(self, attnames=None):
+        loaded_values = getattr(self, "_loaded_values", None)
+        if attnames is None or loaded_values is None:
+            loaded_values = self._loaded_values = {}
+            attnames = self.get_tracked_attnames()
+        for attname in attnames:
+            if attname in self.__dict__ \
+                    and attname in self.get_tracked_attnames():
+                loaded_values[attname] = snapshot(self.__dict__[attname])
+
+    def load_tracked_values(self):
+        """
+        Fetch tracked values missing on the instance, e.g. if it wasn't
+        loaded from the database.
+        """
+        loaded_values = getattr(self, "_loaded_values", {})
+        missing = [attname for attname in self.get_tracked_attnames()
+                   if attname not in loaded_values]
+        if self.pk is None or not missing:
+            return
+        values = type(self)._base_manager.filter(pk=self.pk) \
+            .values(*missing).first()
+        if values is not None:
+            self._loaded_values = {**loaded_values, **values}
+
+    def has_loaded_value(self, attname):
+        return attname in getattr(self, "_loaded_values", {})
+
+    def get_loaded_value(self, attname):
+        value = self._loaded_values[attname]
+        if isinstance(value, LoadedJSON):
+            return value.load()
+        return value
+
+    def get_changed_fields(self):
+        """
+        Return dict of changed tracked fields: {attname: (old, new)}.
+        Returns None if the instance has no loaded values.
+        """
+        loaded_values = getattr(self, "_loaded_values", None)
+        if loaded_values is None:
+            return None
+        changed_fields = {}
+        for attname, value in loaded_values.items():
+            if attname not in self.__dict__:
+                continue
+            current = self.__dict__[attname]
+            if isinstance(value, LoadedJSON):
+                if value.is_changed(current):
+                    changed_fields[attname] = (value.load(), current)
+            elif current != value:
+                changed_fields[attname] = (value, current)
+        return changed_fields
@@ -1,3 +1,4 @@
+import random
 from abc import ABCMeta, abstractmethod
 
 from django.db import models
@@ -122,6 +123,25 @@ class Campaign(BaseModel, CampaignInterface):
         on_delete=models.SET_NULL,
     )
 
+    audit_sample_rate = models.FloatField(
+        default=1.0,
+        help_text="Share of detected task and stage changes written to the "
+                  "audit log. 1 logs all of them, 0 disables the audit."
+    )
+
+    translations_updated_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Time of the last change of campaign translations. "
+                  "Translated schemas are cached by it."
+    )
+
+    def should_audit(self):
+        if self.audit_sample_rate >= 1:
+            return True
+        return random.random() < self.audit_sample_rate
+
     def is_course_completed(self, request):
         """
         Check if the user has completed the course by verifying the existence
@@ -26,6 +26,12 @@ class Chain(BaseModel, CampaignInterface):
         default=ChainConstants.CHRONOLOGICALLY,
         help_text="What ordering will be used on tasks return in chain individuals."
     )
+    deferred_propagation = models.BooleanField(
+        default=False,
+        help_text="If true, completed tasks of this chain are propagated "
+                  "by the background cluster instead of the request."
+    )
+
     def get_campaign(self):
         return self.campaign
 
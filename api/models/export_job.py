@@ -0,0 +1,344 @@
+import csv
+import io
+import json
+import tempfile
+import zipfile
+from collections import defaultdict
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+
+from api.models import BaseDatesModel, CampaignInterface
+
+
+class ExportJob(BaseDatesModel, CampaignInterface):
+    """
+    Export of campaign tasks written by the django_q cluster. Output is
+    stored as numbered part files, one per chunk of tasks. The job keeps
+    the checkpoint of the last written chunk, so an interrupted export
+    continues from it instead of starting again.
+    """
+    campaign = models.ForeignKey(
+        "Campaign",
+        on_delete=models.CASCADE,
+        related_name="export_jobs",
+        help_text="Campaign of exported tasks"
+    )
+    created_by = models.ForeignKey(
+        "CustomUser",
+        on_delete=models.SET_NULL,
+        related_name="export_jobs",
+        blank=True,
+        null=True,
+        help_text="User submitted the export"
+    )
+
+    class Kind(models.TextChoices):
+        FLATTENER_CSV = 'FL', 'Response flattener csv'
+        USER_ACTIVITY_CSV = 'UA', 'User activity csv'
+        TASK_DUMP = 'TD', 'Task dump'
+        PARQUET = 'PQ', 'Parquet'
+
+    kind = models.CharField(
+        max_length=2,
+        choices=Kind.choices,
+        help_text="Type of the export"
+    )
+    response_flattener = models.ForeignKey(
+        "ResponseFlattener",
+        on_delete=models.CASCADE,
+        related_name="export_jobs",
+        blank=True,
+        null=True,
+        help_text="Response flattener of the flattener csv. Parquet "
+                  "export of the flattener stage uses it too."
+    )
+    filters = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Task filters. Allowed keys are listed in FILTER_FIELDS."
+    )
+
+    class Status(models.TextChoices):
+        PENDING = 'PE', 'Pending'
+        RUNNING = 'RU', 'Running'
+        DONE = 'DO', 'Done'
+        FAILED = 'FA', 'Failed'
+
+    status = models.CharField(
+        max_length=2,
+        choices=Status.choices,
+        default=Status.PENDING,
+        db_index=True,
+        help_text="Current state of the export"
+    )
+    columns = models.JSONField(
+        default=list,
+        blank=True,
+        help_text="Columns of the csv, fixed when the export is started"
+    )
+    parts = models.PositiveIntegerField(
+        default=0,
+        help_text="Number of written part files"
+    )
+    last_id = models.PositiveIntegerField(
+        default=0,
+        help_text="Checkpoint: id of the last exported task"
+    )
+    rows_written = models.PositiveIntegerField(
+        default=0,
+        help_text="Number of exported rows"
+    )
+    total_rows = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        help_text="Number of rows to export, counted when the export is "
+                  "started"
+    )
+    attempts = models.PositiveIntegerField(
+        default=0,
+        help_text="How many times the job has been run"
+    )
+    error = models.TextField(
+        blank=True,
+        help_text="Error raised by the last failed run"
+    )
+
+    FINISHED = (Status.DONE, Status.FAILED)
+    FILTER_FIELDS = (
+        'case', 'reopened', 'stage', 'stage__chain',
+        'stage__chain__is_individual', 'stage__chain__name',
+        'stage__volumes', 'assignee', 'assignee__ranks', 'complete',
+        'created_at__lte', 'created_at__gte', 'created_at__lt',
+        'created_at__gt', 'updated_at__lte', 'updated_at__gte',
+        'updated_at__lt', 'updated_at__gt',
+    )
+    DUMP_FIELDS = (
+        'id', 'case_id', 'stage_id', 'assignee_id', 'complete',
+        'force_complete', 'reopened', 'created_at', 'updated_at',
+        'responses',
+    )
+
+    @classmethod
+    def schedule(cls, **kwargs):
+        """
+        Create export job and push it to the django_q cluster once the
+        current transaction is committed.
+        """
+        job = cls.objects.create(**kwargs)
+        transaction.on_commit(job.enqueue)
+        return job
+
+    def enqueue(self):
+        from django_q.tasks import async_task
+        async_task(
+            "api.asyncstuff.run_export_job",
+            self.id,
+            task_name=f"export-{self.id}-{self.attempts}-{self.parts}",
+            group="export",
+        )
+
+    @property
+    def is_finished(self):
+        return self.status in self.FINISHED
+
+    @property
+    def progress(self):
+        if self.status == self.Status.DONE:
+            return 1.0
+        if not self.total_rows:
+            return 0.0
+        return min(self.rows_written / self.total_rows, 1.0)
+
+    @property
+    def extension(self):
+        if self.kind == self.Kind.PARQUET:
+            return "zip"
+        return "jsonl" if self.kind == self.Kind.TASK_DUMP else "csv"
+
+    @property
+    def content_type(self):
+        if self.kind == self.Kind.PARQUET:
+            return "application/zip"
+        if self.kind == self.Kind.TASK_DUMP:
+            return "application/x-ndjson"
+        return "text/csv"
+
+    def get_campaign(self):
+        return self.campaign
+
+    def get_tasks(self):
+        Task = apps.get_model("api.task")
+        tasks = Task.objects.filter(stage__chain__campaign=self.campaign_id,
+                                    **self.filters)
+        if self.response_flattener_id is not None:
+            tasks = tasks.filter(stage=self.response_flattener.task_stage_id)
+        # Lookups through many to many fields may duplicate tasks.
+        if "stage__volumes" in self.filters \
+                or "assignee__ranks" in self.filters:
+            tasks = tasks.distinct()
+        return tasks
+
+    def get_part_name(self, index):
+        return f"exports/{self.id}/part-{index:05d}.{self.extension}"
+
+    def write_part(self, content):
+        """
+        Write next part file. The part left by an interrupted run is
+        overwritten.
+        """
+        name = self.get_part_name(self.parts)
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        default_storage.save(name, ContentFile(content.encode()))
+        self.parts += 1
+
+    def get_partition_name(self, stage_id, date, index):
+        return f"exports/{self.id}/stage={stage_id}/date={date}/" \
+               f"part-{index:05d}.parquet"
+
+    def get_partition_files(self):
+        """
+        Return names of written parquet files.
+        """
+        names = []
+        directories = [f"exports/{self.id}"]
+        while directories:
+            directory = directories.pop()
+            if not default_storage.exists(directory):
+                continue
+            subdirectories, files = default_storage.listdir(directory)
+            directories += [f"{directory}/{i}" for i in subdirectories]
+            names += [f"{directory}/{i}" for i in files
+                      if i.endswith(".parquet")]
+        return sorted(names)
+
+    def write_partitions(self, rows):
+        """
+        Write parquet file of the chunk for each stage and date of task
+        creation. Files of an interrupted run are overwritten.
+        """
+        from api.utils.columnar_export import StageTable, write_parquet
+        TaskStage = apps.get_model("api.taskstage")
+        partitions = defaultdict(list)
+        for row in rows:
+            partitions[(row["stage_id"], row["created_at"].date())] \
+                .append(row)
+        stages = TaskStage.objects.in_bulk({i for i, _ in partitions})
+        tables = {}
+        for (stage_id, date), partition in sorted(partitions.items()):
+            if stage_id not in tables:
+                tables[stage_id] = StageTable(
+                    stages[stage_id],
+                    self.response_flattener if self.response_flattener_id
+                    else None
+                )
+            name = self.get_partition_name(stage_id, date, self.parts)
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            content = write_parquet(tables[stage_id].to_table(partition))
+            default_storage.save(name, ContentFile(content))
+        self.parts += 1
+
+    def iter_content(self):
+        if self.kind == self.Kind.PARQUET:
+            yield from self.iter_archive()
+            return
+        for index in range(self.parts):
+            with default_storage.open(self.get_part_name(index), "rb") as f:
+                yield from iter(lambda: f.read(64 * 1024), b"")
+
+    def iter_archive(self):
+        """
+        Zip parquet files keeping their stage and date directories.
+        """
+        prefix = f"exports/{self.id}/"
+        with tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024) as f:
+            with zipfile.ZipFile(f, "w") as archive:
+                for name in self.get_partition_files():
+                    with default_storage.open(name, "rb") as part:
+                        archive.writestr(name[len(prefix):], part.read())
+            f.seek(0)
+            yield from iter(lambda: f.read(64 * 1024), b"")
+
+    def delete_parts(self):
+        for index in range(self.parts):
+            default_storage.delete(self.get_part_name(index))
+
+    def start(self):
+        """
+        Write header part and count rows to export.
+        """
+        from api.utils.utils import USER_ACTIVITY_CSV_FIELDS
+        if self.kind == self.Kind.FLATTENER_CSV:
+            self.columns = self.response_flattener.ordered_columns() \
+                + ["description"]
+        elif self.kind == self.Kind.USER_ACTIVITY_CSV:
+            self.columns = USER_ACTIVITY_CSV_FIELDS
+        if self.columns:
+            output = io.StringIO()
+            csv.DictWriter(output, fieldnames=self.columns).writeheader()
+            self.write_part(output.getvalue())
+        self.total_rows = self.get_rows().count()
+
+    def get_rows(self):
+        from api.utils.utils import user_activity_groups
+        tasks = self.get_tasks()
+        if self.kind == self.Kind.USER_ACTIVITY_CSV:
+            return user_activity_groups(tasks) \
+                .order_by("stage", "assignee")
+        return tasks
+
+    def write_chunk(self, chunk_size):
+        """
+        Write the chunk following the checkpoint and move the checkpoint.
+        Return True if there is nothing left to export.
+        """
+        if self.kind == self.Kind.USER_ACTIVITY_CSV:
+            # Groups have no ids, they are read by offset.
+            rows = list(self.get_rows()[
+                self.rows_written:self.rows_written + chunk_size
+            ])
+        else:
+            if self.kind == self.Kind.TASK_DUMP:
+                fields = self.DUMP_FIELDS
+            elif self.kind == self.Kind.PARQUET:
+                fields = [field.attname for field in
+                          apps.get_model("api.task")._meta.concrete_fields]
+            else:
+                fields = self.response_flattener.get_export_fields()
+            rows = list(self.get_rows().filter(id__gt=self.last_id)
+                        .order_by("id").values(*fields)[:chunk_size])
+        if not rows:
+            return True
+
+        if self.kind == self.Kind.PARQUET:
+            self.write_partitions(rows)
+        elif self.kind == self.Kind.TASK_DUMP:
+            self.write_part("".join(
+                json.dumps(row, cls=DjangoJSONEncoder) + "\n" for row in rows
+            ))
+        else:
+            if self.kind == self.Kind.FLATTENER_CSV:
+                known_columns = set(self.columns)
+                rows = [
+                    self.response_flattener.describe_extra_columns(
+                        row, known_columns)
+                    for row in self.response_flattener.compile_plan()
+                    .flatten_many(rows)
+                ]
+            output = io.StringIO()
+            csv.DictWriter(output, fieldnames=self.columns).writerows(rows)
+            self.write_part(output.getvalue())
+
+        if self.kind != self.Kind.USER_ACTIVITY_CSV:
+            self.last_id = rows[-1]["id"]
+        self.rows_written += len(rows)
+        return len(rows) < chunk_size
+
+    def __str__(self):
+        return f"Export {self.id} of campaign {self.campaign_id}: " \
+               f"{self.get_status_display()}"
@@ -3,6 +3,8 @@ import json
 from typing import Any
 
 from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
 from django.db import models
 from django.db.models import QuerySet
 from rest_framework.request import Request
@@ -116,6 +118,23 @@ class TranslateKey(models.Model):
         cls.extract_fields_to_translate(schema, paths_to_text)
         return paths_to_text
 
+    @classmethod
+    def get_cached_keys_from_schema(cls, schema: str) -> dict[str, str]:
+        """
+        Same as get_keys_from_schema for json schema string. Keys are
+        cached by schema hash, so unchanged schemas aren't parsed again.
+
+        :param schema: json schema string of the TaskStage
+        :return: dict where key is a hashed hexdigset of the value, value is a text
+        """
+        cache_key = "translate_keys:" + hashlib.sha256(
+            schema.encode()).hexdigest()
+        keys = cache.get(cache_key)
+        if keys is None:
+            keys = cls.get_keys_from_schema(json.loads(schema))
+            cache.set(cache_key, keys, timeout=None)
+        return keys
+
     @classmethod
     def create_from_list(cls, campaign, texts: dict) -> QuerySet:
         """
@@ -143,24 +162,72 @@ class TranslateKey(models.Model):
 
     @classmethod
     def substitute_values(cls, schema: dict,
-                          translations):
+                          translations: dict):
         """
         Method substitute schema values of FIELDS_TO_COLLECT fields with 'translations' values in order to translate schema on traget language.
 
         :param schema: Schema where method will substitute values
-        :param translations: Translation QuerySet - available translations.
+        :param translations: Dictionary where key - hash of the source text, value - translation.
         :return:
         """
         if isinstance(schema, dict):
             for k, v in schema.items():
                 if k in cls.FIELDS_TO_COLLECT and isinstance(v, str):
-                    translation = translations.filter(
-                        key__key=hashlib.sha256(v.encode()).hexdigest()
-                    ).first()
-                    schema[k] = translation.text if translation else v
+                    schema[k] = translations.get(
+                        hashlib.sha256(v.encode()).hexdigest(), v)
                 elif isinstance(v, dict):
                     cls.substitute_values(v, translations)
 
+    @staticmethod
+    def get_stage_campaign_id(stage):
+        """
+        Campaign of the stage chain is cached, so stages loaded without
+        chain don't hit the database (see api/signals.py).
+        """
+        if stage._meta.get_field("chain").is_cached(stage):
+            return stage.chain.campaign_id
+        return cache.get_or_set(
+            f"chain_campaign:{stage.chain_id}",
+            lambda: apps.get_model("api.chain").objects.filter(
+                id=stage.chain_id
+            ).values_list("campaign_id", flat=True).first(),
+            timeout=None
+        )
+
+    @classmethod
+    def translate_schema(cls, campaign_id, schema: str,
+                         lang_code: str) -> str:
+        """
+        Return json schema translated on the language. Schemas are cached
+        by campaign translations version, language and schema hash, so
+        changed translations or schema get new entries. Cache miss fetches
+        all translations of the schema in one query.
+
+        :param campaign_id: Campaign of the translations
+        :param schema: Json schema string
+        :param lang_code: Language code
+        :return: translated json schema string
+        """
+        Translation = apps.get_model("api.translation")
+        cache_key = "translated_schema:{}:{}:{}:{}".format(
+            campaign_id, Translation.get_campaign_version(campaign_id),
+            lang_code, hashlib.sha256(schema.encode()).hexdigest()
+        )
+        translated = cache.get(cache_key)
+        if translated is None:
+            data = json.loads(schema)
+            all_fields = cls.get_keys_from_schema(data)
+            translations = dict(Translation.objects.filter(
+                key__campaign_id=campaign_id,
+                key__key__in=list(all_fields.keys()),
+                language__code=lang_code
+            ).values_list("key__key", "text"))
+            cls.substitute_values(data, translations)
+            translated = json.dumps(data, ensure_ascii=False)
+            cache.set(cache_key, translated,
+                      settings.TRANSLATED_SCHEMA_CACHE_TIMEOUT)
+        return translated
+
     @classmethod
     def get_translated_schema_by_stage(cls, stage,
                                             lang_code: str) -> dict:
@@ -171,16 +238,23 @@ class TranslateKey(models.Model):
         :param lang_code: Language code
         :return: translated schema
         """
+        return json.loads(cls.translate_schema(
+            cls.get_stage_campaign_id(stage), stage.get_json_schema(),
+            lang_code
+        ))
 
-        schema = json.loads(stage.get_json_schema())
-        all_fields = cls.get_keys_from_schema(schema)
-        translations = apps.get_model("api.translation").objects.filter(
-            key__key__in=list(all_fields.keys()),
-            language__code=lang_code
-        )
-
-        cls.substitute_values(schema, translations)
-        return schema
+    @staticmethod
+    def get_request_language(request):
+        """
+        Return code of the language of ?lang= query param if the language
+        exists. It is looked up once per request.
+        """
+        if not hasattr(request, "_translation_language"):
+            code = request.query_params.get("lang")
+            request._translation_language = code and apps.get_model(
+                "api.language").objects.filter(code=code) \
+                .values_list("code", flat=True).first()
+        return request._translation_language
 
     @classmethod
     def to_representation(cls, instance,
@@ -192,13 +266,12 @@ class TranslateKey(models.Model):
         :param request: Request to get language query param
         :return: instance with substituted language
         """
-        lang = apps.get_model("api.language").objects.filter(
-            code=request.query_params.get("lang")
-        ).first()
-        if lang:
-            json_schema = cls.get_translated_schema_by_stage(
-                instance, lang.code)
-            instance.json_schema = json.dumps(json_schema, ensure_ascii=False)
+        lang_code = cls.get_request_language(request)
+        if lang_code:
+            instance.json_schema = cls.translate_schema(
+                cls.get_stage_campaign_id(instance),
+                instance.get_json_schema(), lang_code
+            )
 
         return instance
 
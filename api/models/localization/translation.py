@@ -1,4 +1,6 @@
+from django.apps import apps
 from django.db import models
+from django.utils import timezone
 
 
 class Translation(models.Model):
@@ -35,6 +37,28 @@ class Translation(models.Model):
     )
 
 
+    @staticmethod
+    def get_campaign_version(campaign_id):
+        """
+        Return version of campaign translations. Translated schemas are
+        cached under it (see TranslateKey.translate_schema). Version is
+        read from the database, so all processes see the same one.
+        """
+        version = apps.get_model("api.campaign").objects.filter(
+            id=campaign_id
+        ).values_list("translations_updated_at", flat=True).first()
+        return version.timestamp() if version else 0
+
+    @staticmethod
+    def touch_campaigns(campaign_ids):
+        """
+        Give campaigns new translations version in the current transaction,
+        so their cached translated schemas are rebuilt.
+        """
+        apps.get_model("api.campaign").objects.filter(
+            id__in=set(campaign_ids)
+        ).update(translations_updated_at=timezone.now())
+
     @classmethod
     def create_from_list(cls, language, pairs):
         """
@@ -52,7 +76,13 @@ class Translation(models.Model):
         data_to_create = [cls(language=language, key_id=i[0], text=i[0])
                           for i in pairs if i[0] not in exists]
 
-        return cls.objects.bulk_create(data_to_create)
+        created = cls.objects.bulk_create(data_to_create)
+        if created:
+            TranslateKey = apps.get_model("api.translatekey")
+            cls.touch_campaigns(TranslateKey.objects.filter(
+                id__in=[i.key_id for i in created]
+            ).values_list("campaign_id", flat=True).distinct())
+        return created
 
     @classmethod
     def update_from_dict(cls, campaign, language, texts):
@@ -77,6 +107,7 @@ class Translation(models.Model):
             to_update[i].status = cls.Status.ANSWERED
 
         cls.objects.bulk_update(to_update, ["text", "status"])
+        cls.touch_campaigns([campaign.id])
 
     def __str__(self):
         return f"{self.key.key}: {self.language}"
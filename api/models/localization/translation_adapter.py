@@ -38,10 +38,11 @@ class TranslationAdapter(BaseDatesModel):
     def get_phrases_by_stages(chains):
         TranslateKey = apps.get_model("api.translatekey")
 
+        # Stages are ordered, so shared phrases always go to the first one.
         stages = chains.values(
             **{"stage_id": F("stages__taskstage"),
              "schema": F("stages__taskstage__json_schema")}
-        )
+        ).order_by("stages__taskstage")
 
         texts_by_stage = dict()
         all_keys = dict()
@@ -49,9 +50,8 @@ class TranslationAdapter(BaseDatesModel):
         for st in stages:
             if not st.get("schema"):
                 continue
-            new_phrases = TranslateKey.get_keys_from_schema(
-                json.loads(st.get("schema"))
-            )
+            new_phrases = TranslateKey.get_cached_keys_from_schema(
+                st.get("schema"))
 
             all_keys.update(new_phrases)
             texts_by_stage[st.get("stage_id")] = new_phrases
@@ -63,6 +63,9 @@ class TranslationAdapter(BaseDatesModel):
         Generating tasks for users who will translate phrases.
         If any phrase have been already translated - so this phrase will not be shown again.
         Every stage will have phrases only from its schema.
+        Existing translations are fetched in one query and phrases are
+        distributed in memory, so the number of queries doesn't depend on
+        the number of stages and phrases.
 
         :param stage: TaskStage
         :param in_tasks: In tasks for Task instances
@@ -74,67 +77,71 @@ class TranslationAdapter(BaseDatesModel):
         Case = apps.get_model("api.case")
 
         in_tasks = in_tasks if in_tasks else []
+        campaign = self.stage.get_campaign()
         # geenreate new TranslateKey for new phrases
         texts_by_stage, all_keys = self.get_phrases_by_stages(
-            self.stage.get_campaign().chains)
-        TranslateKey.create_from_list(self.stage.get_campaign(), all_keys)
-        translate_keys = TranslateKey.objects.filter(
-            campaign=self.stage.get_campaign(), key__in=all_keys.keys()) \
-            .distinct()
-
-        # all translations for our campaign
-        all_translations = Translation.objects.filter(
-            key__campaign=self.stage.get_campaign()
-        ).select_related("language").prefetch_related("key")
-
-        # array to store created tasks
-        tasks_to_create = []
-        # for adapter in stage.translation_adapters.select_related("source",
-        #                                                          "target").all():
-        # create translation class instances if they aren't exists in DB, if there is any new instance then create instances
+            campaign.chains)
+        TranslateKey.create_from_list(campaign, all_keys)
+        key_ids = dict(TranslateKey.objects.filter(
+            campaign=campaign, key__in=list(all_keys)
+        ).values_list("key", "id"))
+
+        # translations of our phrases on the target language
+        statuses = dict(Translation.objects.filter(
+            language=self.target, key_id__in=list(key_ids.values())
+        ).values_list("key__key", "status"))
+
+        # create translation class instances if they aren't exists in DB
         translations_to_create = [
-            Translation(key=key, language=self.target) for key in
-            translate_keys if
-            not all_translations.filter(
-                key=key, language=self.target, text__isnull=False)
+            Translation(key_id=key_id, language=self.target)
+            for key, key_id in key_ids.items() if key not in statuses
         ]
-
         if translations_to_create:
-            Translation.objects.bulk_create(translations_to_create)
-            all_translations = Translation.objects.filter(
-                key__campaign=self.stage.get_campaign()
-            ).select_related("language").prefetch_related("key")
+            Translation.objects.bulk_create(translations_to_create,
+                                            ignore_conflicts=True)
+            Translation.touch_campaigns([campaign.id])
+            statuses.update({key: Translation.Status.FREE
+                             for key in key_ids if key not in statuses})
+
+        # phrases that haven't been translated yet
+        free_keys = {key for key, status in statuses.items()
+                     if status == Translation.Status.FREE}
 
         # create tasks with schema that will show phrases that must be translated
-        with transaction.atomic():
-            for st, texts in texts_by_stage.items():
-                # phrases that haven't been translated yet
-                available_translations = all_translations.filter(
-                    language=self.target,
-                    status=Translation.Status.FREE,
-                    key__key__in=list(texts.keys())
+        tasks_to_create = []
+        pending_keys = set()
+        for st, texts in texts_by_stage.items():
+            available_keys = {k: v for k, v in texts.items()
+                              if k in free_keys and k not in pending_keys}
+            if available_keys:
+                tasks_to_create.append(
+                    Task(
+                        stage=self.stage,
+                        schema=TranslateKey.generate_schema_by_fields(
+                            available_keys, self.target.name)
+                    )
                 )
+                pending_keys.update(available_keys)
 
-                available_keys = {k: v for k, v in texts.items() if
-                                  k in available_translations.values_list(
-                                      "key__key", flat=True)
-                                  }
-                if available_keys:
-                    c = Case.objects.create()
-                    tasks_to_create.append(
-                        Task(
-                            stage=self.stage,
-                            case=c,
-                            schema=TranslateKey.generate_schema_by_fields(
-                                available_keys, self.target.name)
-
-                        )
-                    )
-                    available_translations.update(
-                        status=Translation.Status.PENDING)
+        if not tasks_to_create:
+            return
 
+        with transaction.atomic():
+            cases = Case.objects.bulk_create(
+                [Case() for _ in tasks_to_create])
+            for task, case in zip(tasks_to_create, cases):
+                task.case = case
             created_objects = Task.objects.bulk_create(tasks_to_create)
-            [i.in_tasks.add(*in_tasks) for i in created_objects]
+            apps.get_model("api.selectabletask").add_tasks(created_objects)
+            Task.in_tasks.through.objects.bulk_create([
+                Task.in_tasks.through(from_task_id=task.id,
+                                      to_task_id=in_task.id)
+                for task in created_objects for in_task in in_tasks
+            ])
+            Translation.objects.filter(
+                language=self.target, status=Translation.Status.FREE,
+                key_id__in=[key_ids[key] for key in pending_keys]
+            ).update(status=Translation.Status.PENDING)
 
     def save_translations(self, campaign, phrases: dict[str, str]):
         """
@@ -1,3 +1,4 @@
 from .notification import Notification
 from .auto_notification import AutoNotification
 from .notification_status import NotificationStatus
+from .notification_inbox import NotificationInbox
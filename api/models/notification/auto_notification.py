@@ -3,7 +3,7 @@ from django.db import models
 from api.constans import AutoNotificationConstants
 from api.models import BaseDatesModel, CampaignInterface
 
-from api.utils.push_notifications import send_push_notification
+from api.utils.push_notifications import queue_push_notification
 
 
 class AutoNotification(BaseDatesModel, CampaignInterface):
@@ -54,12 +54,8 @@ class AutoNotification(BaseDatesModel, CampaignInterface):
         new_notification.trigger_go = self.go
         new_notification.save()
 
-        #send push_notification
-        push_notification_data = {
-            'campaign_id': str(self.get_campaign().id),
-            'notification_id': str(new_notification.pk)
-        }
-        send_push_notification(u.fcm_token, new_notification.title, new_notification.text, push_notification_data)
+        if u.fcm_token:
+            queue_push_notification(new_notification.pk)
 
     def get_campaign(self):
         return self.notification.campaign
@@ -2,10 +2,12 @@ from django.apps import apps
 from django.db import models
 
 from api.constans import AutoNotificationConstants
-from api.models import BaseDatesModel, CampaignInterface
+from api.models import BaseDatesModel, CampaignInterface, TrackedFieldsMixin
 
 
-class Notification(BaseDatesModel, CampaignInterface):
+class Notification(TrackedFieldsMixin, BaseDatesModel, CampaignInterface):
+    tracked_fields = ("campaign_id", "rank_id", "target_user_id")
+
     title = models.CharField(
         max_length=150,
         help_text="Instance title"
@@ -73,6 +75,16 @@ class Notification(BaseDatesModel, CampaignInterface):
         help_text=('Trigger gone in this direction and this notification has been created.')
     )
 
+    def get_recipient_ids(self):
+        return apps.get_model("api.notificationinbox").get_recipient_ids(
+            self.campaign_id, self.rank_id, self.target_user_id)
+
+    def is_recipient(self, user_id):
+        if self.target_user_id == user_id:
+            return True
+        return self.rank_id is not None and apps.get_model("api.rankrecord") \
+            .objects.filter(rank_id=self.rank_id, user_id=user_id).exists()
+
     def open(self, user):
         notification_status, created = apps.get_model("api.notificationstatus") \
             .objects.get_or_create(
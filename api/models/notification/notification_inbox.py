@@ -0,0 +1,147 @@
+from collections import defaultdict
+
+from django.apps import apps
+from django.db import models
+from django.db.models import F
+
+
+class NotificationInbox(models.Model):
+    """
+    Number of campaign notifications sent to the user (directly or to
+    one of the user ranks) and how many of them aren't read yet. Counters
+    are kept in sync by notification, notification status and rank record
+    signals (see api/signals.py), so campaign lists don't count
+    notifications.
+    """
+    user = models.ForeignKey(
+        "CustomUser",
+        on_delete=models.CASCADE,
+        related_name="notification_inboxes",
+        help_text="User id"
+    )
+    campaign = models.ForeignKey(
+        "Campaign",
+        on_delete=models.CASCADE,
+        related_name="notification_inboxes",
+        help_text="Campaign id"
+    )
+    total = models.IntegerField(
+        default=0,
+        help_text="Number of notifications sent to the user"
+    )
+    unread = models.IntegerField(
+        default=0,
+        help_text="Number of notifications the user hasn't opened"
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "campaign"],
+                name="unique_user_campaign_inbox"
+            )
+        ]
+
+    @staticmethod
+    def get_recipient_ids(campaign_id, rank_id, target_user_id):
+        """
+        Return ids of users receiving notification of the rank and the
+        target user.
+        """
+        RankRecord = apps.get_model("api.rankrecord")
+        user_ids = set()
+        if campaign_id is None:
+            return user_ids
+        if target_user_id is not None:
+            user_ids.add(target_user_id)
+        if rank_id is not None:
+            user_ids.update(RankRecord.objects.filter(rank_id=rank_id)
+                            .values_list("user_id", flat=True))
+        return user_ids
+
+    @classmethod
+    def add(cls, user_ids, campaign_id, total=0, unread=0):
+        """
+        Change counters of the users. Missing counters are created from
+        notifications, which already include the change.
+        """
+        if not user_ids or not total and not unread:
+            return
+        inboxes = cls.objects.filter(campaign_id=campaign_id,
+                                     user_id__in=user_ids)
+        existing = set(inboxes.values_list("user_id", flat=True))
+        inboxes.update(total=F("total") + total,
+                       unread=F("unread") + unread)
+        missing = set(user_ids) - existing
+        if missing:
+            cls.recount(missing, campaign_id)
+
+    @classmethod
+    def recount(cls, user_ids, campaign_id):
+        """
+        Recalculate counters of the users in the campaign from
+        notifications and their statuses.
+        """
+        if not user_ids:
+            return
+        Notification = apps.get_model("api.notification")
+        RankRecord = apps.get_model("api.rankrecord")
+        NotificationStatus = apps.get_model("api.notificationstatus")
+        received = defaultdict(set)
+        targeted = Notification.objects.filter(
+            campaign_id=campaign_id, target_user_id__in=user_ids
+        ).values_list("target_user_id", "id")
+        by_rank = RankRecord.objects.filter(
+            user_id__in=user_ids, rank__notification__campaign_id=campaign_id
+        ).values_list("user_id", "rank__notification__id")
+        for user_id, notification_id in [*targeted, *by_rank]:
+            received[user_id].add(notification_id)
+        read = defaultdict(set)
+        for user_id, notification_id in NotificationStatus.objects.filter(
+                user_id__in=user_ids,
+                notification__campaign_id=campaign_id
+        ).values_list("user_id", "notification_id"):
+            read[user_id].add(notification_id)
+
+        counts = {
+            user_id: (len(received[user_id]),
+                      len(received[user_id] - read[user_id]))
+            for user_id in user_ids
+        }
+        inboxes = list(cls.objects.filter(campaign_id=campaign_id,
+                                          user_id__in=user_ids))
+        for inbox in inboxes:
+            inbox.total, inbox.unread = counts.pop(inbox.user_id)
+        cls.objects.bulk_update(inboxes, ["total", "unread"])
+        cls.objects.bulk_create([
+            cls(user_id=user_id, campaign_id=campaign_id, total=total,
+                unread=unread)
+            for user_id, (total, unread) in counts.items()
+        ], ignore_conflicts=True)
+
+    @classmethod
+    def recount_ranks(cls, user_id, rank_ids):
+        """
+        Recalculate counters of campaigns having notifications of the
+        ranks, e.g. when the user gets or loses the rank.
+        """
+        Notification = apps.get_model("api.notification")
+        campaign_ids = Notification.objects.filter(rank_id__in=rank_ids) \
+            .values_list("campaign_id", flat=True).distinct()
+        for campaign_id in campaign_ids:
+            cls.recount([user_id], campaign_id)
+
+    @classmethod
+    def get_counters(cls, user):
+        """
+        Return dict of campaign id to (total, unread) of the user.
+        """
+        return {
+            campaign_id: (total, unread)
+            for campaign_id, total, unread in cls.objects.filter(user=user)
+            .values_list("campaign_id", "total", "unread")
+        }
+
+    def __str__(self):
+        return f"Inbox of user {self.user_id} in campaign " \
+               f"{self.campaign_id}: {self.unread}/{self.total}"
@@ -1,4 +1,10 @@
-from django.db import models
+from collections import Counter
+
+from django.apps import apps
+from django.db import connection, models
+from django.db.models import Exists, OuterRef, Q, ExpressionWrapper, \
+    BooleanField
+from django.utils import timezone
 
 from api.models import BaseDatesModel, CampaignInterface
 
@@ -17,6 +23,69 @@ class NotificationStatus(BaseDatesModel, CampaignInterface):
         related_name="notification_statuses",
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "notification"],
+                name="unique_user_notification_status"
+            )
+        ]
+
+    @classmethod
+    def mark_read(cls, user, notifications):
+        """
+        Mark the notifications read by the user with one insert of missing
+        statuses. Inbox counters are updated here, the insert doesn't send
+        signals. Returns number of marked and already read notifications.
+        """
+        Notification = apps.get_model("api.notification")
+        NotificationInbox = apps.get_model("api.notificationinbox")
+        rows = Notification.objects \
+            .filter(id__in=notifications.order_by().values("id")) \
+            .annotate(
+                is_read=Exists(cls.objects.filter(notification=OuterRef("pk"),
+                                                  user=user)),
+                is_recipient=ExpressionWrapper(
+                    Q(target_user=user) | Q(rank__in=user.ranks.values("id")),
+                    output_field=BooleanField())
+            ).values_list("id", "campaign_id", "is_read", "is_recipient")
+        rows = list(rows)
+        unread = {row[0]: row for row in rows if not row[2]}
+        marked = cls.insert_missing(user, list(unread))
+
+        # Only inserted statuses are counted: statuses created meanwhile,
+        # e.g. by open(), have already updated the counters.
+        counts = Counter(unread[notification_id][1]
+                         for notification_id in marked
+                         if unread[notification_id][3])
+        for campaign_id, count in counts.items():
+            NotificationInbox.add([user.id], campaign_id, unread=-count)
+        return len(marked), len(rows) - len(marked)
+
+    @classmethod
+    def insert_missing(cls, user, notification_ids):
+        """
+        Insert statuses of the user for the notifications in one query,
+        existing statuses are skipped. Returns ids of notifications whose
+        statuses were inserted.
+        """
+        if not notification_ids:
+            return []
+        qn = connection.ops.quote_name
+        opts = cls._meta
+        columns = ", ".join(qn(opts.get_field(name).column) for name in
+                            ["user", "notification", "created_at",
+                             "updated_at"])
+        now = timezone.now()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {qn(opts.db_table)} ({columns}) "
+                f"SELECT %s, id, %s, %s FROM unnest(%s) AS id "
+                f"ON CONFLICT DO NOTHING "
+                f"RETURNING {qn(opts.get_field('notification').column)}",
+                [user.id, now, now, notification_ids])
+            return [row[0] for row in cursor.fetchall()]
+
     def get_campaign(self):
         return self.notification.campaign
 
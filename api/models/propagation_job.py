@@ -0,0 +1,163 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
+
+from api.models import BaseDatesModel, CampaignInterface
+
+
+class PropagationJob(BaseDatesModel, CampaignInterface):
+    task = models.ForeignKey(
+        "Task",
+        on_delete=models.CASCADE,
+        related_name="propagation_jobs",
+        help_text="Completed task whose chain propagation is deferred"
+    )
+
+    class Status(models.TextChoices):
+        PENDING = 'PE', 'Pending'
+        RUNNING = 'RU', 'Running'
+        DONE = 'DO', 'Done'
+        FAILED = 'FA', 'Failed'
+
+    status = models.CharField(
+        max_length=2,
+        choices=Status.choices,
+        default=Status.PENDING,
+        db_index=True,
+        help_text="Current state of the propagation"
+    )
+    next_direct_task = models.ForeignKey(
+        "Task",
+        on_delete=models.SET_NULL,
+        related_name="+",
+        blank=True,
+        null=True,
+        help_text="Next direct task found by the propagation"
+    )
+    attempts = models.PositiveIntegerField(
+        default=0,
+        help_text="How many times the job has been run"
+    )
+    error = models.TextField(
+        blank=True,
+        help_text="Error raised by the last failed run"
+    )
+
+    FINISHED = (Status.DONE, Status.FAILED)
+
+    @classmethod
+    def schedule(cls, task):
+        """
+        Create propagation job for the completed task and push it to the
+        django_q cluster once the current transaction is committed.
+        Pending job of the same task is reused.
+        """
+        job = cls.objects.filter(
+            task=task, status=cls.Status.PENDING
+        ).first()
+        if job is None:
+            job = cls.objects.create(task=task)
+        transaction.on_commit(job.enqueue)
+        return job
+
+    def enqueue(self, next_run=None):
+        """
+        Push the job to the cluster, at next_run if it is given.
+        """
+        if next_run is not None:
+            from django_q.models import Schedule
+            from django_q.tasks import schedule
+            schedule("api.asyncstuff.run_propagation_job", self.id,
+                     schedule_type=Schedule.ONCE, next_run=next_run,
+                     repeats=1)
+            return
+        from django_q.tasks import async_task
+        async_task(
+            "api.asyncstuff.run_propagation_job",
+            self.id,
+            task_name=f"propagation-{self.id}",
+            group="follow_chain",
+        )
+
+    @classmethod
+    def claim(cls, job_id):
+        """
+        Mark the pending job running. Running job not finished in
+        PROPAGATION_STALE seconds is taken again, its worker is considered
+        dead: the worker running the job keeps its row locked, so it is
+        skipped here.
+        """
+        stale = timezone.now() - timedelta(seconds=settings.PROPAGATION_STALE)
+        job = cls.objects.select_for_update(skip_locked=True) \
+            .filter(models.Q(status=cls.Status.PENDING)
+                    | models.Q(status=cls.Status.RUNNING,
+                               updated_at__lt=stale),
+                    pk=job_id) \
+            .first()
+        if job is None:
+            return None
+        job.status = cls.Status.RUNNING
+        job.attempts += 1
+        job.save()
+        return job
+
+    @classmethod
+    def sweep(cls):
+        """
+        Push jobs lost by the cluster to it again: running jobs whose worker
+        died and pending jobs not taken in PROPAGATION_STALE seconds.
+        Running jobs which have spent their attempts are left failed.
+        Returns pushed jobs.
+        """
+        stale = timezone.now() - timedelta(seconds=settings.PROPAGATION_STALE)
+        jobs = cls.objects.filter(
+            status__in=[cls.Status.PENDING, cls.Status.RUNNING],
+            updated_at__lt=stale)
+        jobs.filter(status=cls.Status.RUNNING,
+                    attempts__gte=settings.PROPAGATION_MAX_ATTEMPTS) \
+            .update(status=cls.Status.FAILED,
+                    error="Worker of the job was lost.")
+        jobs = list(jobs.only("id"))
+        for job in jobs:
+            job.enqueue()
+        return jobs
+
+    def fail(self, error):
+        """
+        Schedule the next run with backoff or leave the job failed after
+        PROPAGATION_MAX_ATTEMPTS runs. Returns True if the job failed.
+        """
+        self.error = error
+        if self.attempts >= settings.PROPAGATION_MAX_ATTEMPTS:
+            self.status = self.Status.FAILED
+            self.save()
+            return True
+        self.status = self.Status.PENDING
+        self.save()
+        next_run = timezone.now() + timedelta(
+            seconds=settings.PROPAGATION_RETRY_BACKOFF
+            * 2 ** (self.attempts - 1))
+        transaction.on_commit(lambda: self.enqueue(next_run))
+        return False
+
+    def retry(self):
+        """
+        Run failed job again.
+        """
+        self.status = self.Status.PENDING
+        self.attempts = 0
+        self.error = ""
+        self.save()
+        transaction.on_commit(self.enqueue)
+
+    @property
+    def is_finished(self):
+        return self.status in self.FINISHED
+
+    def get_campaign(self):
+        return self.task.get_campaign()
+
+    def __str__(self):
+        return f"Propagation of task {self.task_id}: {self.get_status_display()}"
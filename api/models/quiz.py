@@ -1,6 +1,35 @@
+import json
+
+from django.apps import apps
+from django.conf import settings
 from django.db import models
+from django.db.models import F
 
 from api.models import BaseDatesModel
+from api.utils.lru import LRUCache
+
+
+class QuizAnswerKey:
+    """
+    Correct answers of the quiz compiled for scoring: tuples of question
+    key, correct answer as string and text listed for the incorrectly
+    answered question.
+    """
+    __slots__ = ("version", "entries")
+
+    def __init__(self, version, entries):
+        self.version = version
+        self.entries = tuple(entries)
+
+    def score(self, responses):
+        if not self.entries:
+            return 0, ""
+        get = responses.get
+        incorrect_questions = [text for key, answer, text in self.entries
+                               if str(get(key)) != answer]
+        correct = len(self.entries) - len(incorrect_questions)
+        return int(correct * 100 / len(self.entries)), \
+            "\n".join(incorrect_questions)
 
 
 class Quiz(BaseDatesModel):
@@ -49,8 +78,71 @@ class Quiz(BaseDatesModel):
                   "useful for exercises."
     )
 
+    # Answer keys compiled in the process memory by quiz id, at most
+    # QUIZ_ANSWER_KEY_CACHE_SIZE recently used ones.
+    _answer_keys = LRUCache(settings.QUIZ_ANSWER_KEY_CACHE_SIZE)
+
+    @classmethod
+    def get_for_stage(cls, stage):
+        """
+        Return quiz of the stage with the last update time of its correct
+        responses in one query, or None. Absent quiz cached on the stage
+        (see ChainGraph) doesn't hit the database.
+        """
+        relation = stage._meta.get_field("quiz")
+        if relation.is_cached(stage) and \
+                relation.get_cached_value(stage) is None:
+            return None
+        quiz = cls.objects.filter(task_stage_id=stage.id).annotate(
+            correct_responses_updated_at=F(
+                "correct_responses_task__updated_at")
+        ).first()
+        if quiz is not None:
+            cls.task_stage.field.set_cached_value(quiz, stage)
+        relation.set_cached_value(stage, quiz)
+        return quiz
+
     def is_ready(self):
-        return bool(self.correct_responses_task)
+        return self.correct_responses_task_id is not None
+
+    def get_answer_key_version(self):
+        correct_responses_updated_at = getattr(
+            self, "correct_responses_updated_at", None)
+        if correct_responses_updated_at is None:
+            Task = apps.get_model("api.task")
+            correct_responses_updated_at = Task.objects.filter(
+                id=self.correct_responses_task_id
+            ).values_list("updated_at", flat=True).first()
+        return (self.updated_at, self.task_stage.updated_at,
+                self.correct_responses_task_id, correct_responses_updated_at)
+
+    def get_answer_key(self):
+        """
+        Return compiled answer key. It is rebuilt only when the quiz, its
+        stage or the task with correct responses were updated.
+        """
+        version = self.get_answer_key_version()
+        answer_key = self._answer_keys.get(self.pk)
+        if answer_key is None or answer_key.version != version:
+            answer_key = self.compile_answer_key(version)
+            self._answer_keys.set(self.pk, answer_key)
+        return answer_key
+
+    def compile_answer_key(self, version=None):
+        correct_answers = self.correct_responses_task.responses or {}
+        schema = json.loads(self.task_stage.get_json_schema())
+        questions = schema.get('properties') or {}
+        entries = []
+        for key, answer in correct_answers.items():
+            if key in (Quiz.SCORE, Quiz.INCORRECT_QUESTIONS):
+                continue
+            title = (questions.get(key) or {}).get('title', key)
+            if self.provide_answers:
+                text = f"{title}: {answer}"
+            else:
+                text = title
+            entries.append((key, str(answer), text))
+        return QuizAnswerKey(version, entries)
 
     def check_score(self, responses):
         score, incorrect_questions = self.compare_with_correct_answers(responses)
@@ -68,25 +160,34 @@ class Quiz(BaseDatesModel):
         return score, []
 
     def compare_with_correct_answers(self, responses):
-        correct_answers = self.correct_responses_task.responses
-        correct = 0
-        questions = eval(self.task_stage.json_schema).get('properties')
-        incorrect_questions = []
-        for key, answer in correct_answers.items():
-            if str(responses.get(key)) == str(answer):
-                correct += 1
-            else:
-                title = questions.get(key).get('title')
-                if self.provide_answers:
-                    incorrect_questions.append(f"{title}: {answer}")
-                else:
-                    incorrect_questions.append(title)
-
-        len_correct_answers = len(correct_answers)
-        unnecessary_keys = [Quiz.SCORE, Quiz.INCORRECT_QUESTIONS]
-        for k in unnecessary_keys:
-            if correct_answers.get(k):
-                len_correct_answers -= 1
-
-        correct_ratio = int(correct * 100 / len_correct_answers)
-        return correct_ratio, "\n".join(incorrect_questions)
+        return self.get_answer_key().score(responses)
+
+    def rescore_tasks(self, tasks, batch_size=1000):
+        """
+        Apply the current answer key to the completed tasks, e.g. after
+        correct responses were fixed. Tasks aren't reopened. Return number
+        of tasks whose score or incorrect questions were changed.
+        """
+        Task = apps.get_model("api.task")
+        changed = []
+        count = 0
+        tasks = tasks.filter(complete=True) \
+            .exclude(id=self.correct_responses_task_id) \
+            .only("id", "responses")
+        for task in tasks.iterator(chunk_size=batch_size):
+            responses = task.responses or {}
+            score, incorrect_questions = self.check_score(responses)
+            if responses.get(Quiz.SCORE) == score and \
+                    responses.get(Quiz.INCORRECT_QUESTIONS) \
+                    == incorrect_questions:
+                continue
+            responses[Quiz.SCORE] = score
+            responses[Quiz.INCORRECT_QUESTIONS] = incorrect_questions
+            task.responses = responses
+            changed.append(task)
+            if len(changed) >= batch_size:
+                Task.objects.bulk_update(changed, ["responses"])
+                count += len(changed)
+                changed = []
+        Task.objects.bulk_update(changed, ["responses"])
+        return count + len(changed)
@@ -1,9 +1,13 @@
 from django.db import models
 
-from api.models import BaseDatesModel, CampaignInterface
+from api.models import BaseDatesModel, CampaignInterface, TrackedFieldsMixin
 
 
-class RankLimit(BaseDatesModel, CampaignInterface):
+class RankLimit(TrackedFieldsMixin, BaseDatesModel, CampaignInterface):
+    # Fields which change tasks of the selectable pool.
+    tracked_fields = ("stage_id", "rank_id", "is_selection_open",
+                      "is_listing_allowed")
+
     rank = models.ForeignKey(
         "Rank",
         on_delete=models.CASCADE,
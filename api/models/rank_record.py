@@ -1,9 +1,12 @@
 from django.db import models
 
-from api.models import BaseDatesModel, CampaignInterface
+from api.models import BaseDatesModel, CampaignInterface, TrackedFieldsMixin
 
 
-class RankRecord(BaseDatesModel, CampaignInterface):
+class RankRecord(TrackedFieldsMixin, BaseDatesModel, CampaignInterface):
+    # Fields which change notifications of the user.
+    tracked_fields = ("user_id", "rank_id")
+
     user = models.ForeignKey(
         "CustomUser",
         on_delete=models.CASCADE,
@@ -1,10 +1,10 @@
 import json
-import re
 
 from django.apps import apps
 from django.db import models
 
 from api.models import BaseDatesModel, CampaignInterface
+from api.utils.column_plan import ColumnPlan
 
 
 class ResponseFlattener(BaseDatesModel, CampaignInterface):
@@ -43,53 +43,76 @@ class ResponseFlattener(BaseDatesModel, CampaignInterface):
                   'For example: ["title", "oik__(i)uik", "oik__(r)question[\d]{1,2}"]'
     )
 
+    def get_system_fields(self):
+        Task = apps.get_model("api.task")
+        return [field.attname for field in Task._meta.concrete_fields]
+
+    def get_plan_key(self):
+        return (self.task_stage_id, self.task_stage.updated_at,
+                self.copy_first_level, self.flatten_all,
+                self.copy_system_fields, json.dumps(self.exclude_list),
+                json.dumps(self.columns))
+
+    def compile_plan(self):
+        """
+        Return column plan of the flattener. Plan is kept on the instance
+        and compiled again only when the settings or the stage change.
+        """
+        key = self.get_plan_key()
+        plan = getattr(self, "_plan", None)
+        if plan is None or plan[0] != key:
+            plan = self._plan = (key, ColumnPlan(self,
+                                                 self.get_system_fields()))
+        return plan[1]
+
     def flatten_response(self, task):
-        result = {"id": task.id}
-        ui = json.loads(self.task_stage.get_ui_schema())
-        if task.responses and not self.flatten_all:
-            if self.copy_first_level:
-                for key, value in task.responses.items():
-                    if key not in self.exclude_list and \
-                            not isinstance(value, dict) and \
-                            not isinstance(value, list):
-                        result[key] = value
-            for path in list(self.columns):
-                value = self.follow_path(task.responses, path, ui)
-                if value:
-                    result[path] = value
-        elif self.flatten_all and task.responses:
-            result = self.flatten_all_response(task, result, ui)
+        return self.compile_plan().flatten(task)
+
+    def flatten_many(self, tasks):
+        """
+        Flatten task instances or dicts of task values with one compiled
+        plan.
+        """
+        return list(self.compile_plan().flatten_many(tasks))
+
+    def iter_flattened(self, tasks, chunk_size=2000):
+        """
+        Flatten tasks one by one without keeping them in memory. Yields
+        ordered columns first, then rows. Columns missing in the schema
+        are dropped from a row and listed in its description column.
+        """
+        columns = self.ordered_columns()
+        known_columns = set(columns)
+        yield columns + ["description"]
+
+        plan = self.compile_plan()
+        rows = plan.flatten_many(
+            tasks.values(*self.get_export_fields())
+            .iterator(chunk_size=chunk_size)
+        )
+        for row in rows:
+            yield self.describe_extra_columns(row, known_columns)
+
+    def get_export_fields(self):
+        """
+        Task fields fetched for flattening.
+        """
         if self.copy_system_fields:
-            result.update(task.__dict__)
-            list_of_unnecessary_keys = ['_state', 'responses']
-            for unnecessary_key in list_of_unnecessary_keys:
-                del result[unnecessary_key]
-
-        return result
-
-    def flatten_all_response(self, task, result, ui):
-        all_keyses = []
-        for key, value in task.responses.items():
-            all_keyses += self.get_all_pathes(key, value)
-
-        for path in all_keyses:
-            value = self.follow_path(task.responses, path, ui)
-            if value:
-                result[path] = value
-        return result
-
-    def get_all_pathes(self, k, value):
-        keys = []
-        if isinstance(value, dict):
-            for key, values in value.items():
-                keys += self.get_all_pathes(k + "__" + key, values)
-        # elif isinstance(value, list):
-        # for i, item in value:
-        #     keys += self.get_all_pathes(k + f"__" + i, item)
-        elif isinstance(value, str) or isinstance(value, int) or isinstance(value, list):
-            keys.append(k)
-
-        return keys
+            return self.get_system_fields()
+        return ["id", "responses"]
+
+    @staticmethod
+    def describe_extra_columns(row, known_columns):
+        """
+        Drop columns missing in the schema from the row and list them in
+        its description column.
+        """
+        extra_columns = [key for key in row if key not in known_columns]
+        for column in extra_columns:
+            del row[column]
+        if extra_columns:
+            row["description"] = ", ".join(extra_columns)
+        return row
 
     def is_list_of_ints(self, arr):
         res = []
@@ -108,57 +131,6 @@ class ResponseFlattener(BaseDatesModel, CampaignInterface):
     def __str__(self):
         return f"ID: {self.id}; TaskStage ID: {self.task_stage.id}"
 
-    def follow_path(self, responses, path, ui=None):
-        paths = path.split("__", 1)
-        current_key = paths[0]
-        next_key = paths[1] if len(paths) > 1 else None
-        current_ui = ui.get(current_key) if ui else None
-
-        if "(i)" in current_key or "(r)" in current_key:
-            if not path.startswith("("):
-                result = responses.get(path, None)
-                if isinstance(result, dict) or isinstance(result, list):
-                    return None
-                return result
-            elif path.startswith("("):
-                return self.find_partial_key(responses, path)
-        result = responses.get(current_key, None)
-        if isinstance(result, dict):
-            return self.follow_path(result, next_key, current_ui)
-        elif not isinstance(result, dict):
-            if current_ui and current_ui.get("ui:widget") == 'customfile':
-                try:
-                    file_path = json.loads(result)
-                    files = []
-                    for key, val in file_path.items():
-                        result = "https://storage.cloud.google.com/gigaturnip-b6b5b.appspot.com/" + val + '?authuser=1'
-                        files.append(result)
-                    result = ", \n".join(files)
-                except:
-                    result = "CAN'T_PARSE_JSON_ERROR"+result
-            return result
-        return None
-
-    def find_partial_key(self, responses, path):
-        for key, value in responses.items():
-            search_type = path[path.find("(") + 1: path.find(")")]
-            keys = path.split(")", 1)[1].split("__", 1)
-            key_to_find = keys[0]
-
-            condition = False
-            if search_type == 'i':
-                condition = key_to_find in key and key_to_find != key
-            elif search_type == 'r':
-                condition = re.findall(rf"{key_to_find}", key)
-
-            if condition:
-                if not isinstance(value, dict) and not isinstance(value, list):
-                    return value
-                else:
-                    return self.follow_path(value, keys[1])
-
-        return None
-
     def ordered_columns(self):
         ordered_columns = self.task_stage.make_columns_ordered()
 
@@ -0,0 +1,122 @@
+from collections import defaultdict
+
+from django.apps import apps
+from django.db import models
+
+from api.constans import TaskStageConstants
+
+
+class SelectableTask(models.Model):
+    """
+    Pool of tasks which users of the rank may select: not assigned and not
+    complete tasks of stages with rank limits open for selection and
+    listing. Rows are keyed by rank, so changes of rank records don't
+    touch the pool. The pool is kept in sync by signals (see
+    api/signals.py).
+    """
+    BATCH_SIZE = 1000
+
+    rank = models.ForeignKey(
+        "Rank",
+        on_delete=models.CASCADE,
+        related_name="selectable_tasks",
+        help_text="Rank id"
+    )
+    stage = models.ForeignKey(
+        "TaskStage",
+        on_delete=models.CASCADE,
+        related_name="selectable_tasks",
+        help_text="Stage id"
+    )
+    task = models.ForeignKey(
+        "Task",
+        on_delete=models.CASCADE,
+        related_name="selectable_entries",
+        help_text="Task id"
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["rank", "task"],
+                name="unique_selectable_task"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["rank", "stage", "task"],
+                         name="selectable_rank_stage_task"),
+        ]
+
+    @staticmethod
+    def get_stage_ranks(stage_ids):
+        """
+        Return dict of stage id to ids of ranks which see its tasks.
+        Stages without rank limits open for selection and listing and
+        stages assigned by integrator are skipped.
+        """
+        RankLimit = apps.get_model("api.ranklimit")
+        limits = RankLimit.objects.filter(stage_id__in=stage_ids).exclude(
+            stage__assign_user_by=TaskStageConstants.INTEGRATOR
+        ).values_list("stage_id", "rank_id", "is_selection_open",
+                      "is_listing_allowed")
+        ranks = defaultdict(set)
+        listed = set()
+        for stage_id, rank_id, is_selection_open, is_listing_allowed \
+                in limits:
+            ranks[stage_id].add(rank_id)
+            if is_selection_open and is_listing_allowed:
+                listed.add(stage_id)
+        return {stage_id: ranks[stage_id] for stage_id in listed}
+
+    @staticmethod
+    def is_eligible(task):
+        return not task.complete and task.assignee_id is None
+
+    @classmethod
+    def add_tasks(cls, tasks):
+        tasks = [task for task in tasks if cls.is_eligible(task)]
+        if not tasks:
+            return
+        stage_ranks = cls.get_stage_ranks({task.stage_id for task in tasks})
+        cls.objects.bulk_create([
+            cls(rank_id=rank_id, stage_id=task.stage_id, task_id=task.id)
+            for task in tasks
+            for rank_id in stage_ranks.get(task.stage_id, ())
+        ], batch_size=cls.BATCH_SIZE, ignore_conflicts=True)
+
+    @classmethod
+    def remove_tasks(cls, task_ids):
+        cls.objects.filter(task_id__in=task_ids).delete()
+
+    @classmethod
+    def refresh_tasks(cls, task_ids):
+        task_ids = list(task_ids)
+        Task = apps.get_model("api.task")
+        cls.remove_tasks(task_ids)
+        cls.add_tasks(Task.objects.filter(id__in=task_ids)
+                      .only("id", "stage_id", "assignee_id", "complete"))
+
+    @classmethod
+    def refresh_stages(cls, stage_ids):
+        stage_ids = [i for i in stage_ids if i is not None]
+        if not stage_ids:
+            return
+        Task = apps.get_model("api.task")
+        cls.objects.filter(stage_id__in=stage_ids).delete()
+        stage_ranks = cls.get_stage_ranks(stage_ids)
+        tasks = Task.objects.filter(
+            stage_id__in=list(stage_ranks), complete=False,
+            assignee__isnull=True
+        ).values_list("id", "stage_id")
+        batch = []
+        for task_id, stage_id in tasks.iterator(chunk_size=cls.BATCH_SIZE):
+            batch += [cls(rank_id=rank_id, stage_id=stage_id,
+                          task_id=task_id)
+                      for rank_id in stage_ranks[stage_id]]
+            if len(batch) >= cls.BATCH_SIZE:
+                cls.objects.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+        cls.objects.bulk_create(batch, ignore_conflicts=True)
+
+    def __str__(self):
+        return f"Rank {self.rank_id} task {self.task_id}"
@@ -1,6 +1,7 @@
 from django.db import models
 
 from . import Stage
+from ...utils.conditions import compile_conditions
 
 
 class ConditionalStage(Stage):
@@ -17,3 +18,13 @@ class ConditionalStage(Stage):
         help_text='If true prevents duplicate task creation'
     )
 
+    def get_compiled_conditions(self):
+        """
+        Return compiled conditions of the stage. Compiled form is kept on
+        the instance while conditions stay the same.
+        """
+        compiled = self.__dict__.get("_compiled_conditions")
+        if compiled is None or compiled.source != (self.conditions or []):
+            compiled = compile_conditions(self.conditions)
+            self._compiled_conditions = compiled
+        return compiled
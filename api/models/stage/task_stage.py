@@ -1,13 +1,16 @@
+import hashlib
 import json
 
+from django.core.cache import cache
 from django.db import models
 
 from . import Stage
 from . import SchemaProvider
+from ..base import TrackedFieldsMixin
 from ...constans import TaskStageSchemaSourceConstants, TaskStageConstants
 
 
-class TaskStage(Stage, SchemaProvider):
+class TaskStage(TrackedFieldsMixin, Stage, SchemaProvider):
     rich_text = models.TextField(
         null=True,
         blank=True,
@@ -124,6 +127,15 @@ class TaskStage(Stage, SchemaProvider):
             "webhook_address field is empty."
         )
     )
+
+    webhook_outbox = models.BooleanField(
+        default=False,
+        help_text=(
+            "Call webhook_address in the background. The call is recorded "
+            "with the completed task and the task of this stage is created "
+            "when the webhook answers. Failed calls are retried."
+        )
+    )
     card_json_schema = models.TextField(
         null=True,
         blank=True,
@@ -245,7 +257,9 @@ class TaskStage(Stage, SchemaProvider):
         ordered = {}
         ui = json.loads(self.get_ui_schema())
         schema = json.loads(self.get_json_schema())
-        for i, section_name in enumerate(ui.get("ui:order")):
+        # Stages without ui order keep order of schema properties.
+        ui_order = ui.get("ui:order") or list(schema.get('properties', {}))
+        for i, section_name in enumerate(ui_order):
             property = schema['properties'].get(section_name)
             if property:
                 root_dependencies = schema.get('dependencies')
@@ -254,26 +268,25 @@ class TaskStage(Stage, SchemaProvider):
                 else:
                     section_dependencies = None
                 js = self.__get_all_columns_and_priority(property, section_dependencies,
-                                                         section_name, ordered,
+                                                         section_name, ordered, ui_order,
                                                          extra_dependencies=root_dependencies)
                 ordered.update(js)
         return ordered
 
-    def __get_all_columns_and_priority(self, properties, dependencies, key, js, extra_dependencies={}):
+    def __get_all_columns_and_priority(self, properties, dependencies, key, js, ui_order, extra_dependencies={}):
         last_key = key.split("__")[-1]
 
-        ui = json.loads(self.ui_schema)
-        if last_key in ui.get("ui:order"):
-            priority = ui.get("ui:order").index(last_key) + 1
+        if last_key in ui_order:
+            priority = ui_order.index(last_key) + 1
         else:
             priority = -1
         js[last_key] = {"priority": priority}
 
         if dependencies and dependencies.get("oneOf"):
             for i in dependencies.get("oneOf"):
-                js = self.__parse_dependencies(key, i, extra_dependencies, js)
+                js = self.__parse_dependencies(key, i, extra_dependencies, js, ui_order)
         elif dependencies:
-            js = self.__parse_dependencies(key, dependencies, extra_dependencies, js)
+            js = self.__parse_dependencies(key, dependencies, extra_dependencies, js, ui_order)
         if properties:
             sup_props = properties.get("properties")
             if sup_props:
@@ -284,23 +297,23 @@ class TaskStage(Stage, SchemaProvider):
                     else:
                         current_deps = None
                     d = self.__get_all_columns_and_priority(v, current_deps, f"{key}__{k}", js[last_key],
-                                                            extra_dependencies=all_dependencies)
+                                                            ui_order, extra_dependencies=all_dependencies)
                     js[last_key].update(d)
 
         return js
 
-    def __parse_dependencies(self, key, dependency, extra_dependencies, js):
+    def __parse_dependencies(self, key, dependency, extra_dependencies, js, ui_order):
         last_key = key.split("__")[-1]
         sub_columns = dependency.get("properties")
         if last_key in sub_columns.keys():
             del sub_columns[last_key]
         for k, v in sub_columns.items():
-            d = self.__get_all_columns_and_priority(v, extra_dependencies.get(k), f"{key}__{k}", js)
+            d = self.__get_all_columns_and_priority(v, extra_dependencies.get(k), f"{key}__{k}", js, ui_order)
             js.update(d)
             if v.get("properties"):
                 for sub_k, sub_v in v.get("properties").items():
                     c = self.__get_all_columns_and_priority(sub_v, v.get("dependencies").get(sub_k),
-                                                            f"{key}__{k}__{sub_k}", {})
+                                                            f"{key}__{k}__{sub_k}", {}, ui_order)
                     for j in c[sub_k].items():
                         if j[0] != 'priority':
                             js[last_key][k][j[0]] = j[1]
@@ -345,7 +358,23 @@ class TaskStage(Stage, SchemaProvider):
                 arr.append(key)
             return arr
 
+    def get_columns_cache_key(self):
+        schemas = f"{self.get_json_schema()}\n{self.get_ui_schema()}"
+        return "stage_columns:" + hashlib.sha256(schemas.encode()).hexdigest()
+
     def make_columns_ordered(self):
+        """
+        Columns are cached by hash of json and ui schemas, so changed
+        schemas get new columns without explicit invalidation.
+        """
+        cache_key = self.get_columns_cache_key()
+        ordered_columns = cache.get(cache_key)
+        if ordered_columns is None:
+            ordered_columns = self.compute_columns_ordered()
+            cache.set(cache_key, ordered_columns, timeout=None)
+        return list(ordered_columns)
+
+    def compute_columns_ordered(self):
         prioritized_js = self.get_columns_from_js_schema()
 
         all_columns = []
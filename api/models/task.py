@@ -1,11 +1,14 @@
+from django.apps import apps
 from django.db import models, transaction, OperationalError
 from django.db.models import UniqueConstraint, Q
 
 from api.constans import TaskStageConstants
-from api.models import BaseDatesModel, CampaignInterface
+from api.models import BaseDatesModel, CampaignInterface, TrackedFieldsMixin
 
 
-class Task(BaseDatesModel, CampaignInterface):
+class Task(TrackedFieldsMixin, BaseDatesModel, CampaignInterface):
+    tracked_fields = ("responses", "assignee_id", "stage_id", "complete")
+
     assignee = models.ForeignKey(
         "CustomUser",
         on_delete=models.CASCADE,  # TODO Change deletion
@@ -152,6 +155,58 @@ class Task(BaseDatesModel, CampaignInterface):
             task.save()
             return task
 
+    @classmethod
+    def claim_next(cls, user, count=1, stage=None):
+        """
+        Assign up to count selectable tasks to the user in one transaction.
+        Rows locked by concurrent claims are skipped instead of waited for,
+        so simultaneous claims get different tasks. Open and total limits
+        of rank limits open for selection are honored: counters of the
+        user are locked, so concurrent claims of the same user can't
+        exceed them.
+        Returns list of assigned tasks.
+        """
+        from api.utils.utils import (
+            filter_for_user_selectable_tasks, filter_for_datetime
+        )
+        UserStageCounter = apps.get_model("api.userstagecounter")
+
+        candidates = filter_for_datetime(
+            filter_for_user_selectable_tasks(cls.objects.all(), user)
+        )
+        if stage is not None:
+            candidates = candidates.filter(stage=stage)
+
+        claimed = []
+        with transaction.atomic():
+            stage_ids = set(candidates.values_list("stage_id", flat=True)
+                            .order_by().distinct())
+            capacities = UserStageCounter.get_capacities(
+                user, stage_ids, lock=True, is_selection_open=True
+            )
+            while len(claimed) < count:
+                closed = [stage_id for stage_id, capacity
+                          in capacities.items() if capacity == 0]
+                tasks = list(
+                    candidates.exclude(stage_id__in=closed)
+                    .filter(complete=False, assignee__isnull=True)
+                    .order_by("id")
+                    .select_for_update(skip_locked=True, of=("self",))
+                    [:count - len(claimed)]
+                )
+                if not tasks:
+                    break
+                for task in tasks:
+                    capacity = capacities.get(task.stage_id)
+                    if capacity is not None:
+                        if capacity == 0:
+                            continue
+                        capacities[task.stage_id] = capacity - 1
+                    task.assignee = user
+                    task.save()
+                    claimed.append(task)
+        return claimed
+
     def get_direct_previous(self):
         in_tasks = self.in_tasks.all()
         if len(in_tasks) == 1:
@@ -213,17 +268,22 @@ class Task(BaseDatesModel, CampaignInterface):
 
     @staticmethod
     def are_directly_connected(task1, task2):
+        from api.utils.chain_graph import ChainGraph
+
         in_tasks = task2.in_tasks.all()
         if in_tasks and len(in_tasks) == 1 and task1 == in_tasks[0]:
-            if len(task2.stage.in_stages.all()) == 1 and \
-                    task2.stage.in_stages.all()[0] == task1.stage:
-                if len(task1.stage.out_stages.all()) == 1:
+            graph = ChainGraph.for_stage(task2.stage)
+            if graph.in_ids(task2.stage_id) == [task1.stage_id]:
+                if task1.stage.chain_id != graph.chain_id:
+                    graph = ChainGraph.for_stage(task1.stage)
+                if len(graph.out_ids(task1.stage_id)) == 1:
                     if task1.out_tasks.all().count() == 1:
                         return True
         return False
 
     def evaluate_quiz(self):
-        quiz = self.stage.get_quiz()
+        Quiz = apps.get_model("api.quiz")
+        quiz = Quiz.get_for_stage(self.stage)
         is_reopened = False
         if quiz and quiz.is_ready():
             score, incorrect_questions = quiz.check_score(self.responses)
@@ -0,0 +1,147 @@
+from collections import defaultdict
+
+from django.apps import apps
+from django.db import models, transaction, IntegrityError
+from django.db.models import Count, F, Q
+
+
+class UserStageCounter(models.Model):
+    """
+    Number of tasks of the stage assigned to the user. Counters are kept
+    in sync by task signals (see api/signals.py), so rank limits are
+    checked without counting the whole task history of the user.
+    """
+    user = models.ForeignKey(
+        "CustomUser",
+        on_delete=models.CASCADE,
+        related_name="stage_counters",
+        help_text="User id"
+    )
+    stage = models.ForeignKey(
+        "TaskStage",
+        on_delete=models.CASCADE,
+        related_name="user_counters",
+        help_text="Stage id"
+    )
+    total = models.IntegerField(
+        default=0,
+        help_text="Number of tasks assigned to the user"
+    )
+    incomplete = models.IntegerField(
+        default=0,
+        help_text="Number of incomplete tasks assigned to the user"
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "stage"],
+                name="unique_user_stage_counter"
+            )
+        ]
+
+    @staticmethod
+    def get_pairs(tasks):
+        """
+        Return set of (user id, stage id) of assigned tasks of queryset.
+        """
+        return set(
+            tasks.filter(assignee__isnull=False)
+            .values_list("assignee_id", "stage_id")
+            .distinct()
+        )
+
+    @classmethod
+    def add(cls, user_id, stage_id, total=0, incomplete=0):
+        if not total and not incomplete:
+            return
+        counters = cls.objects.filter(user_id=user_id, stage_id=stage_id)
+        updated = counters.update(total=F("total") + total,
+                                  incomplete=F("incomplete") + incomplete)
+        if not updated:
+            # Counter is created from tasks, which already include the
+            # change.
+            try:
+                with transaction.atomic():
+                    cls.recount([(user_id, stage_id)])
+            except IntegrityError:
+                counters.update(total=F("total") + total,
+                                incomplete=F("incomplete") + incomplete)
+
+    @classmethod
+    def add_tasks(cls, tasks, sign=1):
+        """
+        Count tasks written without save signals, e.g. by bulk_create.
+        """
+        deltas = defaultdict(lambda: [0, 0])
+        for task in tasks:
+            if task.assignee_id is None:
+                continue
+            delta = deltas[(task.assignee_id, task.stage_id)]
+            delta[0] += sign
+            delta[1] += sign * (not task.complete)
+        for (user_id, stage_id), (total, incomplete) in deltas.items():
+            cls.add(user_id, stage_id, total, incomplete)
+
+    @classmethod
+    def recount(cls, pairs):
+        """
+        Recalculate counters of (user id, stage id) pairs from tasks.
+        """
+        Task = apps.get_model("api.task")
+        for user_id, stage_id in pairs:
+            counts = Task.objects.filter(
+                assignee_id=user_id, stage_id=stage_id
+            ).aggregate(
+                total=Count("id"),
+                incomplete=Count("id", filter=Q(complete=False))
+            )
+            cls.objects.update_or_create(user_id=user_id, stage_id=stage_id,
+                                         defaults=counts)
+
+    @classmethod
+    def get_capacities(cls, user, stage_ids, lock=False,
+                       **rank_limit_filters):
+        """
+        Return dict of stage id to number of tasks the user may still
+        obtain by rank limits (None means no limit). Stages without rank
+        limits of the user are skipped. With lock counters of the limited
+        stages are created if missing and locked until the end of the
+        transaction, so concurrent assignments of the user wait for each
+        other.
+        """
+        RankLimit = apps.get_model("api.ranklimit")
+        limits = list(RankLimit.objects.filter(
+            stage_id__in=stage_ids, rank__rankrecord__user=user,
+            **rank_limit_filters
+        ).values_list("stage_id", "open_limit", "total_limit"))
+        counters = cls.objects.filter(user=user, stage_id__in=stage_ids)
+        if lock:
+            limited = {stage_id for stage_id, _, _ in limits}
+            existing = set(counters.filter(stage_id__in=limited)
+                           .values_list("stage_id", flat=True))
+            cls.recount([(user.id, stage_id)
+                         for stage_id in limited - existing])
+            counters = counters.filter(stage_id__in=limited) \
+                .select_for_update().order_by("stage_id")
+        counters = {counter.stage_id: counter for counter in counters}
+        capacities = defaultdict(list)
+        for stage_id, open_limit, total_limit in limits:
+            counter = counters.get(stage_id, cls())
+            remaining = [limit - count for limit, count in (
+                (open_limit, counter.incomplete),
+                (total_limit, counter.total),
+            ) if limit]
+            capacities[stage_id].append(
+                max(min(remaining), 0) if remaining else None
+            )
+        # The most permissive rank limit of the user is used.
+        capacities = {
+            stage_id: None if None in values else max(values)
+            for stage_id, values in capacities.items()
+        }
+        return capacities
+
+    def __str__(self):
+        return f"User {self.user_id} stage {self.stage_id}: " \
+               f"{self.incomplete}/{self.total}"
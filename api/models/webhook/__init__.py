@@ -1,2 +1,3 @@
 from .webhook import Webhook
 from .test_webhook import TestWebhook
+from .webhook_delivery import WebhookDelivery
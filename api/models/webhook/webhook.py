@@ -1,11 +1,16 @@
+import json
 import traceback
+from hashlib import sha256
 from json import JSONDecodeError
 
-import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 
 from api.constans import WebhookConstants, RequestMethodConstants
 from api.models import BaseDatesModel, TaskStage
+from api.utils import webhook_client
 from api.utils.injector import inject
 
 
@@ -139,14 +144,69 @@ class Webhook(BaseDatesModel):
         help_text="Data that will be sent to webhook if such option is chosen."
     )
 
+    connect_timeout = models.FloatField(
+        null=True,
+        blank=True,
+        help_text="Seconds to wait for connection to the webhook. "
+                  "WEBHOOK_CONNECT_TIMEOUT setting is used if empty."
+    )
+
+    read_timeout = models.FloatField(
+        null=True,
+        blank=True,
+        help_text="Seconds to wait for the webhook response. "
+                  "WEBHOOK_READ_TIMEOUT setting is used if empty."
+    )
+
+    max_retries = models.PositiveSmallIntegerField(
+        null=True,
+        blank=True,
+        help_text="Number of retries of failed connections and 502, 503, "
+                  "504 responses. WEBHOOK_MAX_RETRIES setting is used if "
+                  "empty."
+    )
+
+    cache_responses = models.BooleanField(
+        default=False,
+        help_text="Keep successful responses in the cache and reuse them "
+                  "for requests with the same method, url and data. Only "
+                  "for webhooks which response depends on the request "
+                  "alone, like dictionaries or geocoders."
+    )
+
+    cache_timeout = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Seconds cached response is reused. "
+                  "WEBHOOK_CACHE_TIMEOUT setting is used if empty."
+    )
+
+    cache_max_size = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Largest size of cached response body in bytes. "
+                  "WEBHOOK_CACHE_MAX_SIZE setting is used if empty."
+    )
+
     def trigger(self, task):
+        url, data = self.prepare(task)
+        return self.apply(task, self.request(url, data), data)
+
+    def prepare(self, task):
+        """
+        Return url and data of the request. Requests are made apart, so
+        webhooks of several tasks can be called at once.
+        """
         if self.which_responses == WebhookConstants.MODIFIER_FIELD:
             data = inject(self.data, task)
         else:
             data = self.get_responses(task)
+        return inject(self.url, task), data
 
-        response = self.request(inject(self.url, task), data)
-
+    def apply(self, task, response, data):
+        """
+        Copy webhook response into the task.
+        """
         if not response:
             task.generate_error(
                 type(KeyError),
@@ -193,15 +253,51 @@ class Webhook(BaseDatesModel):
             data = {field: data}
         return data
 
+    def get_timeout(self):
+        return (
+            self.connect_timeout or settings.WEBHOOK_CONNECT_TIMEOUT,
+            self.read_timeout or settings.WEBHOOK_READ_TIMEOUT,
+        )
+
     def request(self, url, data):
-        if self.request_method == RequestMethodConstants.PATCH:
-            return requests.patch(url, json=data, headers=self.headers)
-        if self.request_method == RequestMethodConstants.PUT:
-            return requests.put(url, json=data, headers=self.headers)
-        return requests.post(url, json=data, headers=self.headers)
-
-    def post(self, data):
-        response = requests.post(self.url, json=data, headers=self.headers)
+        return self.send(self.request_method, url, data, self.headers)
+
+    def post(self, data, url=None, headers=None):
+        return self.send(RequestMethodConstants.POST, url or self.url, data,
+                         self.headers if headers is None else headers)
+
+    def get_cache_key(self, method, url, data, headers):
+        """
+        Key of the cached response. Webhook and headers are a part of it,
+        so responses aren't shared between webhooks with different
+        credentials.
+        """
+        request = json.dumps([self.pk, method, url, headers, data],
+                             sort_keys=True, separators=(",", ":"),
+                             cls=DjangoJSONEncoder)
+        return "webhook_response:" + sha256(request.encode()).hexdigest()
+
+    def send(self, method, url, data, headers):
+        """
+        Make request to the webhook. Responses of cached webhooks are taken
+        from the cache first.
+        """
+        if not self.cache_responses:
+            return webhook_client.send(
+                method, url, json=data, headers=headers,
+                timeout=self.get_timeout(), retries=self.max_retries)
+
+        cache_key = self.get_cache_key(method, url, data, headers)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return webhook_client.load_response(cached)
+        response = webhook_client.send(
+            method, url, json=data, headers=headers,
+            timeout=self.get_timeout(), retries=self.max_retries)
+        max_size = self.cache_max_size or settings.WEBHOOK_CACHE_MAX_SIZE
+        if response.ok and len(response.content) <= max_size:
+            cache.set(cache_key, webhook_client.dump_response(response),
+                      self.cache_timeout or settings.WEBHOOK_CACHE_TIMEOUT)
         return response
 
     def get_responses(self, task):
@@ -0,0 +1,214 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
+
+from api.models import BaseDatesModel, CampaignInterface
+from api.utils.webhook_client import get_host
+
+
+class WebhookDelivery(BaseDatesModel, CampaignInterface):
+    """
+    Outbox record of the webhook call of a stage with webhook_outbox. It
+    is written in the transaction of the completed in task and delivered
+    by the django_q cluster. The out task is created when the webhook
+    answers. Failed calls are retried with backoff and, after
+    WEBHOOK_OUTBOX_MAX_ATTEMPTS attempts, left dead for the managers.
+    """
+    stage = models.ForeignKey(
+        "TaskStage",
+        on_delete=models.CASCADE,
+        related_name="webhook_deliveries",
+        help_text="Stage calling the webhook"
+    )
+    in_task = models.ForeignKey(
+        "Task",
+        on_delete=models.CASCADE,
+        related_name="webhook_deliveries",
+        help_text="Task which data is sent to the webhook"
+    )
+    target = models.CharField(
+        max_length=300,
+        db_index=True,
+        help_text="Scheme and host of the webhook. Deliveries of the same "
+                  "target are sent together and limited by "
+                  "WEBHOOK_OUTBOX_CONCURRENCY."
+    )
+    url = models.URLField(
+        max_length=1000,
+        help_text="Webhook URL address"
+    )
+    params = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Get parameters sent to webhook"
+    )
+
+    class Status(models.TextChoices):
+        PENDING = 'PE', 'Pending'
+        RUNNING = 'RU', 'Running'
+        DONE = 'DO', 'Done'
+        DEAD = 'DE', 'Dead'
+
+    status = models.CharField(
+        max_length=2,
+        choices=Status.choices,
+        default=Status.PENDING,
+        db_index=True,
+        help_text="Current state of the delivery"
+    )
+    attempts = models.PositiveIntegerField(
+        default=0,
+        help_text="How many times the webhook has been called"
+    )
+    next_attempt_at = models.DateTimeField(
+        default=timezone.now,
+        help_text="Delivery isn't sent before this time"
+    )
+    error = models.TextField(
+        blank=True,
+        help_text="Error of the last failed attempt"
+    )
+    result_task = models.ForeignKey(
+        "Task",
+        on_delete=models.SET_NULL,
+        related_name="+",
+        blank=True,
+        null=True,
+        help_text="Task created from the webhook response"
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["target", "status", "next_attempt_at"]),
+        ]
+
+    @classmethod
+    def record(cls, stage, in_task, params):
+        """
+        Write the delivery and push its target to the django_q cluster
+        once the current transaction is committed.
+        """
+        delivery = cls.objects.create(
+            stage=stage, in_task=in_task, url=stage.webhook_address,
+            target=get_host(stage.webhook_address), params=params)
+        transaction.on_commit(lambda: cls.enqueue(delivery.target))
+        return delivery
+
+    @staticmethod
+    def enqueue(target, next_run=None):
+        """
+        Push delivery of the target to the cluster, at next_run if it is
+        given.
+        """
+        if next_run is not None:
+            from django_q.models import Schedule
+            from django_q.tasks import schedule
+            schedule("api.asyncstuff.deliver_webhooks", target,
+                     schedule_type=Schedule.ONCE, next_run=next_run,
+                     repeats=1)
+            return
+        from django_q.tasks import async_task
+        async_task("api.asyncstuff.deliver_webhooks", target,
+                   task_name=f"webhooks-{target}"[:100], group="webhooks")
+
+    @classmethod
+    def claim(cls, target):
+        """
+        Lock due deliveries of the target and mark them running. Running
+        deliveries not finished in WEBHOOK_OUTBOX_STALE seconds are taken
+        again, their worker is considered dead.
+        """
+        now = timezone.now()
+        stale = now - timedelta(seconds=settings.WEBHOOK_OUTBOX_STALE)
+        deliveries = cls.objects.filter(target=target)
+        running = deliveries.filter(status=cls.Status.RUNNING,
+                                    updated_at__gte=stale).count()
+        limit = settings.WEBHOOK_OUTBOX_CONCURRENCY - running
+        if limit <= 0:
+            return []
+        claimed = list(
+            deliveries.select_for_update(skip_locked=True, of=("self",))
+            .filter(models.Q(status=cls.Status.PENDING,
+                             next_attempt_at__lte=now)
+                    | models.Q(status=cls.Status.RUNNING,
+                               updated_at__lt=stale))
+            .select_related("stage__chain", "in_task__case")
+            .order_by("next_attempt_at", "id")[:limit]
+        )
+        for delivery in claimed:
+            delivery.status = cls.Status.RUNNING
+            delivery.attempts += 1
+            delivery.updated_at = now
+        cls.objects.bulk_update(claimed,
+                                ["status", "attempts", "updated_at"])
+        return claimed
+
+    @classmethod
+    def sweep(cls):
+        """
+        Push targets with deliveries lost by the cluster to it again:
+        running deliveries whose worker died and pending ones overdue by
+        WEBHOOK_OUTBOX_STALE seconds. Running deliveries which have spent
+        their attempts are left dead. Returns pushed targets.
+        """
+        stale = timezone.now() - timedelta(
+            seconds=settings.WEBHOOK_OUTBOX_STALE)
+        lost = cls.objects.filter(status=cls.Status.RUNNING,
+                                  updated_at__lt=stale)
+        lost.filter(attempts__gte=settings.WEBHOOK_OUTBOX_MAX_ATTEMPTS) \
+            .update(status=cls.Status.DEAD,
+                    error="Worker of the delivery was lost.")
+        targets = sorted(set(
+            cls.objects.filter(
+                models.Q(status=cls.Status.RUNNING, updated_at__lt=stale)
+                | models.Q(status=cls.Status.PENDING,
+                           next_attempt_at__lt=stale))
+            .values_list("target", flat=True).distinct()))
+        for target in targets:
+            cls.enqueue(target)
+        return targets
+
+    def has_due(self):
+        return WebhookDelivery.objects.filter(
+            target=self.target, status=self.Status.PENDING,
+            next_attempt_at__lte=timezone.now()
+        ).exists()
+
+    def fail(self, error):
+        """
+        Schedule the next attempt or leave the delivery dead. Returns True
+        if the delivery is dead.
+        """
+        self.error = error
+        if self.attempts >= settings.WEBHOOK_OUTBOX_MAX_ATTEMPTS:
+            self.status = self.Status.DEAD
+        else:
+            self.status = self.Status.PENDING
+            self.next_attempt_at = timezone.now() + timedelta(
+                seconds=settings.WEBHOOK_OUTBOX_BACKOFF
+                * 2 ** (self.attempts - 1))
+        self.save()
+        if self.status == self.Status.PENDING:
+            transaction.on_commit(
+                lambda: self.enqueue(self.target, self.next_attempt_at))
+        return self.status == self.Status.DEAD
+
+    def retry(self):
+        """
+        Send dead delivery again.
+        """
+        self.status = self.Status.PENDING
+        self.attempts = 0
+        self.next_attempt_at = timezone.now()
+        self.error = ""
+        self.save()
+        transaction.on_commit(lambda: self.enqueue(self.target))
+
+    def get_campaign(self):
+        return self.stage.get_campaign()
+
+    def __str__(self):
+        return f"Webhook of stage {self.stage_id} for task " \
+               f"{self.in_task_id}: {self.get_status_display()}"
@@ -317,6 +317,11 @@ class TaskAccessPolicy(AccessPolicy):
             "effect": "allow",
             "condition_expression": "is_assignee and is_not_complete"
         },
+        {
+            "action": ["claim_next"],
+            "principal": "authenticated",
+            "effect": "allow",
+        },
         {
             "action": ["request_assignment"],
             "principal": "authenticated",
@@ -329,6 +334,12 @@ class TaskAccessPolicy(AccessPolicy):
             "effect": "allow",
             "condition_expression": "is_superuser or (is_assignee and ( is_not_complete or is_task_from_individual_chain ) )"
         },
+        {
+            "action": ["propagation"],
+            "principal": "authenticated",
+            "effect": "allow",
+            "condition_expression": "is_assignee or is_manager"
+        },
         {
             "action": ["uncomplete"],
             "principal": "authenticated",
@@ -497,7 +508,8 @@ class NotificationAccessPolicy(ManagersOnlyAccessPolicy):
         {
             "action": ["list",
                        "last_task_notifications",
-                       "read_all_notifications"],
+                       "read_all_notifications",
+                       "inbox"],
             "principal": "authenticated",
             "effect": "allow",
         },
@@ -615,6 +627,36 @@ class ResponseFlattenerAccessPolicy(AccessPolicy):
         return bool(request.user.managed_campaigns.all())
 
 
+class ExportJobAccessPolicy(AccessPolicy):
+    statements = [
+        {
+            "action": ["list", "create"],
+            "principal": "authenticated",
+            "effect": "allow",
+            "condition": "is_campaign_manager",
+        },
+        {
+            "action": ["retrieve", "download", "resume"],
+            "principal": "authenticated",
+            "effect": "allow",
+            "condition": "is_manager",
+        },
+    ]
+
+    @classmethod
+    def scope_queryset(cls, request, queryset):
+        return queryset \
+            .filter(campaign__campaign_managements__user=request.user) \
+            .distinct()
+
+    def is_manager(self, request, view, action) -> bool:
+        managers = view.get_object().get_campaign().managers.all()
+        return request.user in managers
+
+    def is_campaign_manager(self, request, view, action):
+        return bool(request.user.managed_campaigns.all())
+
+
 class TaskAwardAccessPolicy(ManagersOnlyAccessPolicy):
     @classmethod
     def scope_queryset(cls, request, queryset):
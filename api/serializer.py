@@ -4,7 +4,6 @@ from datetime import datetime
 
 from django.contrib.postgres.aggregates import ArrayAgg
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import Q
 from jsonschema import validate
 from okutool.models import Test
 from okutool.serializers import TestSerializer
@@ -23,8 +22,10 @@ from api.models import Campaign, Chain, TaskStage, \
     Task, Rank, RankLimit, Track, RankRecord, CampaignManagement, Notification, \
     NotificationStatus, ResponseFlattener, \
     TaskAward, DynamicJson, TestWebhook, Category, Language, Country, \
-    TranslateKey, CustomUser, Volume
+    TranslateKey, CustomUser, Volume, PropagationJob, ExportJob, \
+    NotificationInbox
 from api.permissions import ManagersOnlyAccessPolicy
+from api.utils.conditions import compile_conditions, InvalidCondition
 
 
 base_model_fields = ['id', 'name', 'description']
@@ -48,40 +49,37 @@ class CampaignSerializer(serializers.ModelSerializer):
     def get_managers(self, obj):
         if self.context['request'].user.is_anonymous:
             return
-        return obj.managers.values_list(flat=True)
+        return [manager.id for manager in obj.managers.all()]
 
-    def get_notifications_count(self, obj):
-        user = self.context['request'].user
-        if user.is_anonymous:
-            return 0
-        return obj.notifications.filter(
-            Q(rank__id__in=user.ranks.values('id'))
-            | Q(target_user=user)).count()
-
-    def get_unread_notifications_count(self, obj):
+    def get_notification_counters(self, obj):
+        """
+        Return (total, unread) notifications of the user in the campaign.
+        Counters of all campaigns are read at once for the whole list.
+        """
         user = self.context['request'].user
-
         if user.is_anonymous:
-            return 0
+            return 0, 0
+        if "notification_counters" not in self.context:
+            self.context["notification_counters"] = \
+                NotificationInbox.get_counters(user)
+        return self.context["notification_counters"].get(obj.id, (0, 0))
 
-        total_notifications_count = obj.notifications.filter(
-            Q(rank__id__in=user.ranks.values('id')) | Q(target_user=user)
-        ).count()
-
-        read_notifications_count = obj.notifications.filter(
-            notification_statuses__user=user
-        ).count()
-
-        unread_notifications_count = total_notifications_count - read_notifications_count
+    def get_notifications_count(self, obj):
+        return self.get_notification_counters(obj)[0]
 
-        return unread_notifications_count
+    def get_unread_notifications_count(self, obj):
+        return self.get_notification_counters(obj)[1]
 
     def get_is_manager(self, obj):
+        if hasattr(obj, "user_is_manager"):
+            return obj.user_is_manager
         user = self.context['request'].user
         managers = obj.get_campaign().managers.all()
         return user in managers
 
     def get_is_joined(self, obj):
+        if hasattr(obj, "user_is_joined"):
+            return obj.user_is_joined
         user = self.context['request'].user
         if user.is_anonymous:
             return False
@@ -92,10 +90,14 @@ class CampaignSerializer(serializers.ModelSerializer):
         return user_has_rank_record
 
     def get_is_completed(self, obj):
+        if hasattr(obj, "user_is_completed"):
+            return obj.user_is_completed
         request = self.context['request']
         return obj.is_course_completed(request)
 
     def get_registration_stage(self, obj):
+        if hasattr(obj, "registration_stage_id"):
+            return obj.registration_stage_id
         registration_stage = obj.default_track.registration_stage
         return registration_stage.id if registration_stage else None
 
@@ -125,7 +127,7 @@ class ChainSerializer(serializers.ModelSerializer,
                       CampaignValidationCheck):
     class Meta:
         model = Chain
-        fields = base_model_fields + ['campaign']
+        fields = base_model_fields + ['campaign', 'deferred_propagation']
 
     def validate_campaign(self, value):
         """
@@ -303,64 +305,18 @@ class ConditionalStageSerializer(serializers.ModelSerializer,
         return super(ConditionalStageSerializer, self).is_valid(raise_exception=raise_exception)
 
     def validate_conditions(self, value):
-        TYPES_TO_CONVERT = {
-            'boolean': bool,
-            'string': str,
-            'number': float,
-            'integer': int
-        }
-        AVAILABLE_CONDITIONS = ['==', '!=', '>', '<', '>=', '<=', 'ARRAY-CONTAINS', 'ARRAY-CONTAINS-NOT']
-        VALIDATION_SCHEMA = {
-            "type": "object",
-            "properties": {
-                "field": {"type": "string"},
-                "value": {"type": "string"},
-                "condition": {"type": "string", "enum": AVAILABLE_CONDITIONS},
-                "type": {"type": "string", "enum": list(TYPES_TO_CONVERT.keys())},
-                "system": {"type": "boolean", "default": False }
-            },
-            "required": ["field", "value", "condition", "type"]
-        }
-        for cond_id, condition in enumerate(value):
-            try:
-                current_schema = VALIDATION_SCHEMA
-
-
-                if not condition.get('type'):
-                    raise Exception('type is absent')
-                elif condition.get('type') and condition['type'] not in list(TYPES_TO_CONVERT.keys()):
-                    raise Exception('type is undefined')
-
-                if not condition.get('value'):
-                    raise Exception('value is absent')
-
-                if condition['type'] == 'boolean':
-                    val = condition['value'].lower()
-                    condition['value'] = True if val in ['1', 'true'] else False
-                else:
-                    try:
-                        condition['value'] = TYPES_TO_CONVERT[condition['type']](condition['value'])
-                        current_schema['properties']['value']['type'] = condition['type']
-                    except ValueError:
-                        raise ValueError(
-                            f'\'{condition["value"]}\' is not of type \'{condition["type"]}\''
-                        )
-
-                validate(instance=condition, schema=current_schema)
-                return value
-            except ValueError as exc:
-                msg = f"Invalid data in {cond_id + 1} index. " + str(exc)
-                raise CustomApiException(400, msg)
-            except Exception as exc:
-                if exc.args and exc.args[0] == 'type is absent':
-                    msg = f"Invalid data in {cond_id + 1} index. Please, provide 'type' field"
-                elif exc.args and exc.args[0] == 'type is undefined':
-                    msg = f"Invalid data in {cond_id + 1} index. Please, provide valid type"
-                elif exc.args and exc.args[0] == 'value is absent':
-                    msg = f"Invalid data in {cond_id + 1} index. Please, provide 'value' field"
-                else:
-                    msg = f"Invalid data in {cond_id + 1} index. " + exc.message
-                raise CustomApiException(400, msg)
+        """
+        Compile conditions the same way as they are compiled on evaluation,
+        so stage with invalid rules can't be saved.
+        """
+        try:
+            compiled = compile_conditions(value, strict=True)
+        except InvalidCondition as exc:
+            msg = f"Invalid data in {exc.index + 1} index. {exc}"
+            raise CustomApiException(400, msg)
+        for condition, rule in zip(value, compiled.rules):
+            condition['value'] = rule.value
+        return value
 
     def get_in_stages(self, obj):
         return obj.in_stages.values_list(flat=True)
@@ -398,7 +354,7 @@ class TaskStageReadSerializer(serializers.ModelSerializer):
             "displayed_prev_stages", "assign_user_by", "ranks", "campaign", "stage_type",
             "assign_user_from_stage", "rich_text", "webhook_address", "rank_limit",
             "webhook_payload_field", "webhook_params", "dynamic_jsons_source", "dynamic_jsons_target",
-            "webhook_response_field", "allow_go_back", "allow_release",
+            "webhook_response_field", "webhook_outbox", "allow_go_back", "allow_release",
             "available_from", "available_to", "quiz_answers", "take_task_button_text", "external_renderer_url"
             ]
 
@@ -441,7 +397,7 @@ class TaskStageSerializer(serializers.ModelSerializer,
                   "available_from", "available_to",
                   "assign_user_from_stage", "rich_text", "webhook_address",
                   "webhook_payload_field", "webhook_params", "stage_type",
-                  "webhook_response_field", "allow_go_back", "allow_release", "take_task_button_text", "external_renderer_url"]
+                  "webhook_response_field", "webhook_outbox", "allow_go_back", "allow_release", "take_task_button_text", "external_renderer_url"]
 
     def validate_chain(self, value):
         """
@@ -621,6 +577,67 @@ class TaskUserActivitySerializer(serializers.Serializer):
     count_tasks = serializers.IntegerField()
 
 
+class PropagationJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PropagationJob
+        fields = ['id', 'task', 'status', 'next_direct_task', 'attempts',
+                  'error', 'created_at', 'updated_at']
+        read_only_fields = fields
+
+
+class ExportJobSerializer(serializers.ModelSerializer):
+    progress = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = ExportJob
+        fields = ['id', 'campaign', 'kind', 'response_flattener', 'filters',
+                  'status', 'progress', 'rows_written', 'total_rows',
+                  'attempts', 'error', 'created_by', 'created_at',
+                  'updated_at']
+        read_only_fields = ['status', 'progress', 'rows_written',
+                            'total_rows', 'attempts', 'error', 'created_by',
+                            'created_at', 'updated_at']
+
+    def validate_campaign(self, value):
+        request = self.context['request']
+        if not value.managers.filter(id=request.user.id).exists():
+            raise CustomApiException(
+                400, "User is not a manager of the campaign.")
+        return value
+
+    def validate_filters(self, value):
+        if not isinstance(value, dict):
+            raise CustomApiException(400, "Filters must be an object.")
+        unknown = set(value) - set(ExportJob.FILTER_FIELDS)
+        if unknown:
+            raise CustomApiException(
+                400, f"Unknown filters: {', '.join(sorted(unknown))}.")
+        return value
+
+    def validate(self, data):
+        response_flattener = data.get('response_flattener')
+        if data['kind'] == ExportJob.Kind.FLATTENER_CSV:
+            if response_flattener is None:
+                raise CustomApiException(
+                    400, "Response flattener is required for the flattener csv.")
+            if response_flattener.get_campaign() != data['campaign']:
+                raise CustomApiException(
+                    400, "Response flattener belongs to another campaign.")
+        elif response_flattener is not None:
+            if data['kind'] != ExportJob.Kind.PARQUET:
+                raise CustomApiException(
+                    400, "Response flattener is used only by the flattener "
+                         "csv and parquet exports.")
+            if response_flattener.get_campaign() != data['campaign']:
+                raise CustomApiException(
+                    400, "Response flattener belongs to another campaign.")
+        return data
+
+    def create(self, validated_data):
+        return ExportJob.schedule(created_by=self.context['request'].user,
+                                  **validated_data)
+
+
 class PostJSONFilterSerializer(serializers.Serializer):
     items_conditions = serializers.ListField(child=serializers.JSONField()) # filters
 
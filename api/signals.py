@@ -1,8 +1,19 @@
-from django.db.models.signals import pre_save, post_save
+import copy
+
+from django.core.cache import cache
+from django.db.models.signals import (
+    pre_save, post_save, pre_delete, post_delete, m2m_changed
+)
 from django.dispatch import receiver
 from rest_framework import serializers
 
-from api.models import Task, Log, TaskStage, Notification
+from api.models import (
+    Task, Log, TaskStage, Notification, Chain, Stage, ConditionalStage,
+    ConditionalLimit, CopyField, Integration, Quiz, TranslationAdapter,
+    Webhook, UserStageCounter, SelectableTask, RankLimit, TranslateKey,
+    Translation, NotificationInbox, NotificationStatus, RankRecord, CustomUser
+)
+from api.utils.chain_graph import ChainGraph
 
 
 class TaskDebugSerializer(serializers.ModelSerializer):
@@ -17,69 +28,328 @@ class TaskStageDebugSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+def get_previous_instance(instance, changed_fields):
+    """
+    Build previous state of the instance from its loaded values,
+    so no SELECT is needed.
+    """
+    previous = copy.copy(instance)
+    previous.__dict__.update(
+        {attname: old for attname, (old, new) in changed_fields.items()}
+    )
+    for field in previous._meta.concrete_fields:
+        if field.is_relation and field.attname in changed_fields \
+                and field.is_cached(previous):
+            field.delete_cached_value(previous)
+    return previous
+
+
 @receiver(pre_save, sender=Task)
 def log_empty_task_response(sender, instance, **kwargs):
-    # print(f"Signal received, INSTANCE RESPONSES: {instance.responses}")
-    if instance.id is None:
-        pass
+    if instance.id is None or instance.responses:
+        return
+
+    # Responses went empty only if they weren't empty before, so the
+    # database is queried only for instances without loaded values.
+    if instance.has_loaded_value("responses"):
+        previous_responses = instance.get_loaded_value("responses")
+        if not previous_responses:
+            return
+        previous = get_previous_instance(
+            instance, {"responses": (previous_responses, instance.responses)}
+        )
     else:
-        previous = Task.objects.get(id=instance.id)
-        data = {"previous": TaskDebugSerializer(previous).data,
-                "current": TaskDebugSerializer(instance).data}
-        # log = Log(
-        #     name="Task edited",
-        #     description="Overwritten responses are inside JSON field",
-        #     json=data,
-        #     task=instance,
-        #     campaign=instance.get_campaign(),
-        #     stage=instance.stage,
-        #     chain=instance.stage.chain,
-        #     user=instance.assignee,
-        # )
-        # log.save()
-        if previous.responses and not instance.responses:
-            reason = "wrong"
-            if instance.responses is None:
-                reason = "null"
-            elif not instance.responses:
-                reason = "empty"
-            name = f"Task responses seem {reason}."
-            # print(f"Signal received, EMPTY DETECTED")
-            log = Log(
-                name=name,
-                description="Overwritten responses are inside JSON field",
-                json=data,
-                task=instance,
-                campaign=instance.get_campaign(),
-                stage=instance.stage,
-                chain=instance.stage.chain,
-                user=instance.assignee,
-            )
-            log.save()
+        previous = Task.objects.filter(id=instance.id).first()
+        if previous is None or not previous.responses:
+            return
+
+    if not instance.get_campaign().should_audit():
+        return
+
+    data = {"previous": TaskDebugSerializer(previous).data,
+            "current": TaskDebugSerializer(instance).data}
+    reason = "wrong"
+    if instance.responses is None:
+        reason = "null"
+    elif not instance.responses:
+        reason = "empty"
+    name = f"Task responses seem {reason}."
+    log = Log(
+        name=name,
+        description="Overwritten responses are inside JSON field",
+        json=data,
+        task=instance,
+        campaign=instance.get_campaign(),
+        stage=instance.stage,
+        chain=instance.stage.chain,
+        user=instance.assignee,
+    )
+    log.save()
 
 
 @receiver(pre_save, sender=TaskStage)
 def log_task_stage_changing(sender, instance, **kwargs):
     if instance.id is None:
-        pass
-    else:
+        return
+
+    changed_fields = instance.get_changed_fields()
+    if changed_fields is None:
         previous = TaskStage.objects.get(id=instance.id)
-        data = {"previous": TaskStageDebugSerializer(previous).data,
-                "current": TaskStageDebugSerializer(instance).data, }
-        differences = []
-        for key, value in data['current'].items():
-            current_value = data.get('previous').get(key)
-            if value != current_value:
-                difference = f"{key}: {current_value} -> {value}"
-                differences.append(difference)
-        if differences:
-            name = "Task Stage was changed"
-            description = "\n".join(differences)
-            log = Log(
-                name=name,
-                description=description,
-                json=data,
-                campaign=previous.get_campaign(),
-                stage=previous,
-            )
-            log.save()
\ No newline at end of file
+    elif changed_fields:
+        previous = get_previous_instance(instance, changed_fields)
+    else:
+        return
+
+    if not instance.get_campaign().should_audit():
+        return
+
+    data = {"previous": TaskStageDebugSerializer(previous).data,
+            "current": TaskStageDebugSerializer(instance).data, }
+    differences = []
+    for key, value in data['current'].items():
+        current_value = data.get('previous').get(key)
+        if value != current_value:
+            difference = f"{key}: {current_value} -> {value}"
+            differences.append(difference)
+    if differences:
+        name = "Task Stage was changed"
+        description = "\n".join(differences)
+        log = Log(
+            name=name,
+            description=description,
+            json=data,
+            campaign=previous.get_campaign(),
+            stage=previous,
+        )
+        log.save()
+
+
+def get_counted_values(values):
+    """
+    Return (user id, stage id, complete) of task values which are counted
+    by UserStageCounter or None.
+    """
+    if values.get("assignee_id") is None:
+        return None
+    return values["assignee_id"], values.get("stage_id"), \
+        values.get("complete")
+
+
+def update_user_stage_counters(previous, current):
+    deltas = {}
+    for values, sign in ((previous, -1), (current, 1)):
+        if values is None:
+            continue
+        user_id, stage_id, complete = values
+        total, incomplete = deltas.get((user_id, stage_id), (0, 0))
+        deltas[(user_id, stage_id)] = (total + sign,
+                                       incomplete + sign * (not complete))
+    for (user_id, stage_id), (total, incomplete) in deltas.items():
+        UserStageCounter.add(user_id, stage_id, total, incomplete)
+
+
+@receiver(pre_save, sender=Task)
+def load_counted_task_values(sender, instance, **kwargs):
+    if instance.id is not None:
+        instance.load_tracked_values()
+
+
+@receiver(post_save, sender=Task)
+def count_saved_task(sender, instance, created, update_fields=None,
+                     **kwargs):
+    loaded_values = getattr(instance, "_loaded_values", {})
+    current = instance.__dict__
+    if update_fields is not None:
+        attnames = {Task._meta.get_field(name).attname
+                    for name in update_fields}
+        current = {**loaded_values, **{
+            attname: instance.__dict__[attname] for attname in attnames
+        }}
+    previous = None if created else get_counted_values(loaded_values)
+    update_user_stage_counters(previous, get_counted_values(current))
+
+
+@receiver(post_delete, sender=Task)
+def count_deleted_task(sender, instance, **kwargs):
+    values = getattr(instance, "_loaded_values", None) or instance.__dict__
+    update_user_stage_counters(get_counted_values(values), None)
+
+
+@receiver(post_save, sender=Task)
+def update_selectable_pool(sender, instance, created, **kwargs):
+    if created:
+        SelectableTask.add_tasks([instance])
+        return
+    loaded_values = instance._loaded_values
+    if loaded_values.get("stage_id") != instance.stage_id:
+        SelectableTask.refresh_tasks([instance.id])
+        return
+    was_eligible = not loaded_values.get("complete") \
+        and loaded_values.get("assignee_id") is None
+    is_eligible = SelectableTask.is_eligible(instance)
+    if is_eligible and not was_eligible:
+        SelectableTask.add_tasks([instance])
+    elif was_eligible and not is_eligible:
+        SelectableTask.remove_tasks([instance.id])
+
+
+@receiver(post_save, sender=RankLimit)
+@receiver(post_delete, sender=RankLimit)
+def refresh_selectable_pool_of_rank_limit(sender, instance, created=False,
+                                          **kwargs):
+    if kwargs["signal"] is post_save and not created \
+            and instance.get_changed_fields() == {}:
+        return
+    stage_ids = {instance.stage_id}
+    if instance.has_loaded_value("stage_id"):
+        stage_ids.add(instance.get_loaded_value("stage_id"))
+    SelectableTask.refresh_stages(stage_ids)
+
+
+@receiver(post_save, sender=TaskStage)
+def refresh_selectable_pool_of_stage(sender, instance, created, **kwargs):
+    if created:
+        return
+    changed_fields = instance.get_changed_fields()
+    if changed_fields is None or "assign_user_by" in changed_fields:
+        SelectableTask.refresh_stages([instance.id])
+
+
+@receiver(pre_save, sender=Chain)
+@receiver(pre_save, sender=TaskStage)
+@receiver(pre_save, sender=ConditionalStage)
+@receiver(post_delete, sender=Chain)
+def invalidate_chain_graph(sender, instance, **kwargs):
+    if instance.id is not None:
+        chain_id = instance.id if sender is Chain else instance.chain_id
+        ChainGraph.invalidate(chain_id)
+
+
+@receiver(post_save, sender=Chain)
+def invalidate_chain_campaign(sender, instance, created, **kwargs):
+    if not created:
+        cache.delete(f"chain_campaign:{instance.id}")
+
+
+@receiver(post_save, sender=Translation)
+@receiver(post_delete, sender=Translation)
+def touch_translations_of_campaign(sender, instance, **kwargs):
+    Translation.touch_campaigns(
+        TranslateKey.objects.filter(id=instance.key_id)
+        .values_list("campaign_id", flat=True)
+    )
+
+
+@receiver(post_save, sender=Notification)
+def count_saved_notification(sender, instance, created, **kwargs):
+    if created:
+        NotificationInbox.add(instance.get_recipient_ids(),
+                              instance.campaign_id, total=1, unread=1)
+        return
+    changed_fields = instance.get_changed_fields()
+    if changed_fields is None or changed_fields:
+        previous = instance._loaded_values if changed_fields is not None \
+            else {}
+        for values in (previous, instance.__dict__):
+            campaign_id = values.get("campaign_id")
+            NotificationInbox.recount(NotificationInbox.get_recipient_ids(
+                campaign_id, values.get("rank_id"),
+                values.get("target_user_id")
+            ), campaign_id)
+
+
+@receiver(pre_delete, sender=Notification)
+def load_notification_recipients(sender, instance, **kwargs):
+    instance._recipient_ids = instance.get_recipient_ids()
+
+
+@receiver(post_delete, sender=Notification)
+def count_deleted_notification(sender, instance, **kwargs):
+    # Statuses are deleted before the notification, so it is unread by
+    # all recipients at this point.
+    NotificationInbox.add(getattr(instance, "_recipient_ids", set()),
+                          instance.campaign_id, total=-1, unread=-1)
+
+
+@receiver(post_save, sender=NotificationStatus)
+@receiver(post_delete, sender=NotificationStatus)
+def count_read_notification(sender, instance, signal, created=False,
+                            **kwargs):
+    if signal is post_save and not created:
+        return
+    notification = Notification.objects.filter(id=instance.notification_id) \
+        .only("campaign_id", "rank_id", "target_user_id").first()
+    if notification is None or not notification.is_recipient(instance.user_id):
+        return
+    NotificationInbox.add([instance.user_id], notification.campaign_id,
+                          unread=-1 if signal is post_save else 1)
+
+
+@receiver(post_save, sender=RankRecord)
+@receiver(post_delete, sender=RankRecord)
+def recount_rank_notifications(sender, instance, created=False, **kwargs):
+    changed_fields = None if created else instance.get_changed_fields()
+    if kwargs["signal"] is post_save and changed_fields == {}:
+        return
+    NotificationInbox.recount_ranks(instance.user_id, [instance.rank_id])
+    if changed_fields:
+        # Record was moved, its old user loses the old rank
+        old = {attname: value[0] for attname, value in changed_fields.items()}
+        NotificationInbox.recount_ranks(old.get("user_id", instance.user_id),
+                                        [old.get("rank_id", instance.rank_id)])
+
+
+@receiver(m2m_changed, sender=CustomUser.ranks.through)
+def recount_added_rank_notifications(sender, instance, action, reverse,
+                                     pk_set, **kwargs):
+    """
+    ranks.add() creates records in bulk without post_save. Records removed
+    by ranks.remove() and ranks.clear() are recounted by post_delete.
+    """
+    if action != "post_add":
+        return
+    if reverse:
+        for user_id in pk_set:
+            NotificationInbox.recount_ranks(user_id, [instance.id])
+    else:
+        NotificationInbox.recount_ranks(instance.id, pk_set)
+
+
+@receiver(m2m_changed, sender=Stage.in_stages.through)
+def touch_connected_stages(sender, instance, action, reverse, pk_set,
+                           **kwargs):
+    if action in ("post_add", "post_remove"):
+        ChainGraph.touch_stages([instance.id, *pk_set])
+    elif action == "pre_clear":
+        related = instance.out_stages if reverse else instance.in_stages
+        ChainGraph.touch_stages(
+            [instance.id, *related.values_list("id", flat=True)]
+        )
+
+
+# Stage settings which are compiled into the chain graph and field
+# pointing to their stage.
+CHAIN_GRAPH_STAGE_SETTINGS = {
+    ConditionalLimit: "conditional_stage_id",
+    CopyField: "task_stage_id",
+    Integration: "task_stage_id",
+    Quiz: "task_stage_id",
+    TranslationAdapter: "stage_id",
+    Webhook: "task_stage_id",
+}
+
+
+def touch_stage_of_setting(sender, instance, **kwargs):
+    ChainGraph.touch_stages(
+        [getattr(instance, CHAIN_GRAPH_STAGE_SETTINGS[sender])]
+    )
+
+
+for model in CHAIN_GRAPH_STAGE_SETTINGS:
+    post_save.connect(touch_stage_of_setting, sender=model)
+    post_delete.connect(touch_stage_of_setting, sender=model)
+
+
+@receiver(post_delete, sender=Quiz)
+def forget_quiz_answer_key(sender, instance, **kwargs):
+    Quiz._answer_keys.pop(instance.pk)
@@ -39,6 +39,19 @@ def get_schema():
 
 class GigaTurnipTestHelper(APITestCase):
 
+    def assertQueryBudget(self, response):
+        """
+        Check the request made no more queries than query_budgets of its
+        viewset allow for the action.
+        """
+        stats = response.query_stats
+        self.assertIsNotNone(stats.budget,
+                             f"{stats.action} has no query budget.")
+        self.assertLessEqual(
+            stats.count, stats.budget,
+            f"{stats.action} made {stats.count} queries, budget is "
+            f"{stats.budget}. Repeated: {stats.get_duplicates()}")
+
     def create_client(self, u):
         client = APIClient()
         client.force_authenticate(u)
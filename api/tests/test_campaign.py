@@ -1,5 +1,7 @@
 import json
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from rest_framework.reverse import reverse
 from rest_framework.test import APIClient
@@ -419,3 +421,53 @@ class CampaignTest(GigaTurnipTestHelper):
                                     client=new_user_client,
                                     pk=self.campaign.id)
         self.assertEqual(response.data["is_joined"], True)
+
+    def test_campaign_list_query_count(self):
+        def list_campaigns():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.get_objects("campaign-list",
+                                            client=self.employee_client)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return {i["id"]: i for i in to_json(response.content)["results"]}, \
+                len(queries)
+
+        def add_campaigns(count):
+            campaigns = []
+            for i in range(count):
+                data = self.generate_new_basic_campaign(f"Campaign {i}")
+                data["campaign"].open = True
+                data["campaign"].save()
+                campaigns.append(data)
+            return campaigns
+
+        add_campaigns(2)
+        list_campaigns()
+        results, queries = list_campaigns()
+        self.assertEqual(len(results), 2)
+
+        joined, managed, completed = add_campaigns(3)
+        RankRecord.objects.create(user=self.employee, rank=joined["rank"])
+        self.employee.managed_campaigns.add(managed["campaign"])
+        completed["default_track"].registration_stage = TaskStage.objects \
+            .create(name="Registration", chain=completed["chain"],
+                    x_pos=1, y_pos=1)
+        completed["default_track"].save()
+        completed["campaign"].course_completetion_rank = completed["rank"]
+        completed["campaign"].save()
+        RankRecord.objects.create(user=self.employee, rank=completed["rank"])
+
+        results, more_queries = list_campaigns()
+        self.assertEqual(len(results), 5)
+        self.assertEqual(more_queries, queries)
+        flags = {
+            campaign_id: (i["is_joined"], i["is_manager"], i["is_completed"])
+            for campaign_id, i in results.items()
+        }
+        self.assertEqual(flags[joined["campaign"].id], (True, False, False))
+        self.assertEqual(flags[managed["campaign"].id], (False, True, False))
+        self.assertEqual(flags[completed["campaign"].id], (True, False, True))
+        self.assertEqual(results[managed["campaign"].id]["managers"],
+                         [self.employee.id])
+        self.assertEqual(results[completed["campaign"].id]
+                         ["registration_stage"],
+                         completed["default_track"].registration_stage.id)
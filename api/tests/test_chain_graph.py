@@ -0,0 +1,104 @@
+from unittest import mock
+
+from api.models import *
+from api.tests import GigaTurnipTestHelper
+from api.utils.chain_graph import ChainGraph
+from api.utils.lru import LRUCache
+
+
+class ChainGraphTest(GigaTurnipTestHelper):
+
+    def test_graph_is_cached_until_chain_changes(self):
+        second_stage = self.initial_stage.add_stage(TaskStage(name="Second"))
+        graph = ChainGraph.for_stage(self.initial_stage)
+        self.assertEqual(graph.out_ids(self.initial_stage.id),
+                         [second_stage.id])
+        self.assertEqual(graph.in_ids(second_stage.id),
+                         [self.initial_stage.id])
+
+        with self.assertNumQueries(1):
+            self.assertIs(ChainGraph.for_stage(self.initial_stage), graph)
+            stages = graph.out_task_stages(self.initial_stage.id)
+            self.assertEqual(stages, [second_stage])
+            self.assertIsNone(stages[0].get_webhook())
+            self.assertIsNone(stages[0].get_quiz())
+
+        third_stage = self.initial_stage.add_stage(TaskStage(name="Third"))
+        graph = ChainGraph.for_stage(self.initial_stage)
+        self.assertEqual(graph.out_ids(self.initial_stage.id),
+                         [second_stage.id, third_stage.id])
+
+        third_stage.in_stages.remove(self.initial_stage)
+        graph = ChainGraph.for_stage(self.initial_stage)
+        self.assertEqual(graph.out_ids(self.initial_stage.id),
+                         [second_stage.id])
+
+    def test_graph_cache_is_bounded(self):
+        chain = Chain.objects.create(name="Other", campaign=self.campaign)
+        with mock.patch.object(ChainGraph, "_cache", LRUCache(1)):
+            graph = ChainGraph.get(self.chain.id)
+            self.assertIs(ChainGraph.get(self.chain.id), graph)
+            ChainGraph.get(chain.id)
+            self.assertNotIn(self.chain.id, ChainGraph._cache)
+            self.assertIsNot(ChainGraph.get(self.chain.id), graph)
+
+            chain_id = self.chain.id
+            self.chain.delete()
+            self.assertNotIn(chain_id, ChainGraph._cache)
+
+    def test_graph_stages_do_not_share_campaign(self):
+        second_stage = self.initial_stage.add_stage(TaskStage(name="Second"))
+        graph = ChainGraph.for_stage(self.initial_stage)
+        stage = graph.out_task_stages(self.initial_stage.id)[0]
+        self.assertEqual(stage.chain.campaign.audit_sample_rate, 1.0)
+
+        Campaign.objects.filter(id=self.campaign.id) \
+            .update(audit_sample_rate=0.5)
+        stage = graph.out_task_stages(self.initial_stage.id)[0]
+        self.assertIsNot(stage.chain,
+                         graph.nodes[second_stage.id].stage.chain)
+        self.assertEqual(stage.chain.campaign.audit_sample_rate, 0.5)
+
+    def test_graph_settings_change_version(self):
+        second_stage = self.initial_stage.add_stage(TaskStage(name="Second"))
+        graph = ChainGraph.for_stage(second_stage)
+        self.assertFalse(graph.nodes[second_stage.id].has_webhook)
+
+        Webhook.objects.create(task_stage=second_stage, url="https://a.b")
+        graph = ChainGraph.for_stage(second_stage)
+        self.assertTrue(graph.nodes[second_stage.id].has_webhook)
+        stage = graph.out_task_stages(self.initial_stage.id)[0]
+        self.assertIsNotNone(stage.get_webhook())
+
+    def test_graph_conditional_stages(self):
+        pingpong = self.initial_stage.add_stage(ConditionalStage(
+            name="Pingpong",
+            conditions=[{"field": "a", "type": "string",
+                         "value": "b", "condition": "=="}],
+            pingpong=True
+        ))
+        first_limited = self.initial_stage.add_stage(
+            ConditionalStage(name="First limited"))
+        second_limited = self.initial_stage.add_stage(
+            ConditionalStage(name="Second limited"))
+        ConditionalLimit.objects.create(conditional_stage=second_limited,
+                                        order=2)
+        ConditionalLimit.objects.create(conditional_stage=first_limited,
+                                        order=1)
+        last_stage = pingpong.add_stage(TaskStage(name="Last"))
+
+        graph = ChainGraph.for_stage(self.initial_stage)
+        self.assertEqual(graph.out_conditional_stages(self.initial_stage.id),
+                         [pingpong])
+        self.assertEqual(
+            graph.out_conditional_limit_stages(self.initial_stage.id),
+            [first_limited, second_limited]
+        )
+        self.assertEqual(graph.in_pingpong_stages(last_stage.id), [pingpong])
+        self.assertEqual(graph.nodes[pingpong.id].conditions,
+                         pingpong.conditions)
+
+        pingpong.pingpong = False
+        pingpong.save()
+        graph = ChainGraph.for_stage(self.initial_stage)
+        self.assertEqual(graph.in_pingpong_stages(last_stage.id), [])
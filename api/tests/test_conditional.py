@@ -1,8 +1,11 @@
 import json
+from io import StringIO
 
+from django.core.management import call_command
 from rest_framework import status
 from rest_framework.reverse import reverse
 
+from api.asyncstuff import reroute_conditional_stage
 from api.constans import AutoNotificationConstants, TaskStageConstants, \
     CopyFieldConstants
 from api.models import *
@@ -844,3 +847,201 @@ class ConditionalTest(GigaTurnipTestHelper):
         self.assertEqual(Task.objects.count(), 3)
         self.assertEqual(self.user.tasks.filter(case=task.case).count(), 2)
         self.assertEqual(self.user.tasks.count(), 3)
+
+    def test_conditional_stage_validates_all_rules(self):
+        self.user.managed_campaigns.add(self.campaign)
+        conditions = [
+            {"type": "string", "field": "a", "value": "b", "condition": "=="},
+            {"type": "integer", "field": "c.d", "value": "5",
+             "condition": "like"},
+        ]
+        conditional_stage = {
+            "name": "Checker", "chain": self.chain.id, "x_pos": 1, "y_pos": 1,
+            "conditions": json.dumps(conditions),
+        }
+        response = self.client.post(reverse('conditionalstage-list'),
+                                    data=conditional_stage)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['message'],
+                         "Invalid data in 2 index. "
+                         "Please, provide valid condition")
+
+        conditions[1]["condition"] = ">="
+        conditional_stage["conditions"] = json.dumps(conditions)
+        response = self.client.post(reverse('conditionalstage-list'),
+                                    data=conditional_stage)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        stage = ConditionalStage.objects.get(id=response.data["id"])
+        self.assertEqual(stage.conditions[1]["value"], 5)
+
+    def test_compiled_conditions(self):
+        stage = self.initial_stage.add_stage(ConditionalStage(
+            name="Compiled",
+            conditions=[
+                {"field": "a.b", "value": "10", "condition": ">=",
+                 "type": "integer"},
+                {"field": "c", "value": "yes", "condition": "=="},
+            ]
+        ))
+        compiled = stage.get_compiled_conditions()
+        self.assertIs(stage.get_compiled_conditions(), compiled)
+        self.assertEqual(compiled.rules[0].path, ("a", "b"))
+        self.assertEqual(compiled.rules[0].value, 10)
+
+        results = compiled.evaluate_many([
+            {"a": {"b": 3}, "c": "yes"},
+            {"a": {"b": 11}, "c": "yes"},
+            {"a": {"b": 3}, "c": "no"},
+            None,
+        ])
+        self.assertEqual(results, [True, False, False, False])
+
+        stage.conditions[1]["value"] = "no"
+        self.assertIsNot(stage.get_compiled_conditions(), compiled)
+        self.assertTrue(stage.get_compiled_conditions().evaluate(
+            {"a": {"b": 3}, "c": "no"}))
+
+    def test_conditions_sql_filter_matches_python(self):
+        responses_list = [
+            {"1": "a", "n": 5, "d": {"e": "hello"}},
+            {"1": "b", "n": 10.5, "d": {"e": "hello world"}},
+            {"1": "a", "n": "5", "d": {}},
+            {"n": None, "d": "text"},
+            {"1": True, "n": [1]},
+            {},
+        ]
+        for responses in responses_list:
+            Task.objects.create(stage=self.initial_stage, responses=responses,
+                                complete=True)
+        Task.objects.create(stage=self.initial_stage, complete=True)
+
+        rule_sets = [
+            [{"field": "1", "type": "string", "value": "a", "condition": "=="}],
+            [{"field": "1", "type": "string", "value": "a", "condition": "!="}],
+            [{"field": "n", "type": "integer", "value": 5, "condition": "=="}],
+            [{"field": "n", "type": "number", "value": 7, "condition": ">"}],
+            [{"field": "n", "type": "integer", "value": 5, "condition": "<="}],
+            [{"field": "d.e", "type": "string", "value": "hello world!",
+              "condition": "in"}],
+            [{"field": "d.e", "type": "string", "value": "hello",
+              "condition": "nin"}],
+            [{"field": "1", "type": "string", "value": "a", "condition": "=="},
+             {"field": "n", "type": "integer", "value": 5, "condition": "=="}],
+        ]
+        tasks = Task.objects.filter(stage=self.initial_stage)
+        for rules in rule_sets:
+            stage = ConditionalStage(conditions=rules)
+            aliases, q = stage.get_compiled_conditions().to_filter()
+            sql_ids = set(tasks.alias(**aliases).filter(q)
+                          .values_list("id", flat=True))
+            python_ids = set()
+            for task in tasks:
+                try:
+                    if stage.get_compiled_conditions().evaluate(task.responses):
+                        python_ids.add(task.id)
+                except Exception:
+                    pass
+            self.assertEqual(sql_ids, python_ids, rules)
+
+    def test_reroute_conditional_stage(self):
+        conditional = self.initial_stage.add_stage(ConditionalStage(
+            name="Is big",
+            conditions=[{"field": "size", "type": "integer", "value": 10,
+                         "condition": "<"}]
+        ))
+        next_stage = conditional.add_stage(TaskStage(
+            name="Big",
+            assign_user_by=TaskStageConstants.STAGE,
+            assign_user_from_stage=self.initial_stage,
+            copy_input=True
+        ))
+        sizes = [1, 20, 30, 11, 5]
+        in_tasks = [
+            Task.objects.create(stage=self.initial_stage, case=Case.objects.create(),
+                                assignee=self.user, complete=True,
+                                responses={"size": size})
+            for size in sizes
+        ]
+        Task.objects.create(stage=self.initial_stage, case=Case.objects.create(),
+                            complete=False, responses={"size": 40})
+
+        call_command("reroute_conditional_stages", conditional.id,
+                     stdout=StringIO())
+        new_tasks = Task.objects.filter(stage=next_stage)
+        self.assertEqual(new_tasks.count(), 3)
+        for task in new_tasks:
+            in_task = task.in_tasks.get()
+            self.assertGreater(in_task.responses["size"], 10)
+            self.assertEqual(task.case, in_task.case)
+            self.assertEqual(task.assignee, self.user)
+            self.assertEqual(task.responses, in_task.responses)
+
+        self.assertEqual(reroute_conditional_stage(conditional), 0)
+        in_tasks[0].responses = {"size": 100}
+        in_tasks[0].save()
+        self.assertEqual(reroute_conditional_stage(conditional), 1)
+        self.assertEqual(in_tasks[0].out_tasks.get().stage, next_stage)
+
+    def test_reroute_skips_limited_stages(self):
+        conditional = self.initial_stage.add_stage(ConditionalStage(
+            name="Is big",
+            conditions=[{"field": "size", "type": "integer", "value": 10,
+                         "condition": ">"}]
+        ))
+        ConditionalLimit.objects.create(conditional_stage=conditional,
+                                        order=1)
+        next_stage = conditional.add_stage(TaskStage(name="Big"))
+        nested = self.initial_stage.add_stage(ConditionalStage(
+            name="Not limited",
+            conditions=[{"field": "size", "type": "integer", "value": 10,
+                         "condition": ">"}]
+        ))
+        nested_limited = nested.add_stage(ConditionalStage(
+            name="Nested limited",
+            conditions=[{"field": "size", "type": "integer", "value": 10,
+                         "condition": ">"}]
+        ))
+        ConditionalLimit.objects.create(conditional_stage=nested_limited,
+                                        order=2)
+        nested_next_stage = nested_limited.add_stage(TaskStage(name="Nested"))
+        Task.objects.create(stage=self.initial_stage, assignee=self.user,
+                            case=Case.objects.create(), complete=True,
+                            responses={"size": 20})
+
+        self.assertEqual(reroute_conditional_stage(conditional), 0)
+        self.assertEqual(reroute_conditional_stage(nested), 0)
+        out = StringIO()
+        call_command("reroute_conditional_stages", conditional.id,
+                     stdout=out)
+        self.assertIn(f"Skip pingpong or limited stage {conditional.id}",
+                      out.getvalue())
+        self.assertFalse(Task.objects.filter(
+            stage__in=[next_stage, nested_next_stage]).exists())
+
+    def test_reroute_prevent_duplicate(self):
+        conditional = self.initial_stage.add_stage(ConditionalStage(
+            name="Once per case",
+            conditions=[{"field": "size", "type": "integer", "value": 10,
+                         "condition": ">"}],
+            prevent_duplicate=True
+        ))
+        next_stage = conditional.add_stage(TaskStage(name="Next"))
+        done_case, new_case, other_case = [Case.objects.create()
+                                           for i in range(3)]
+        Task.objects.create(stage=next_stage, case=done_case,
+                            assignee=self.user)
+        in_tasks = [
+            Task.objects.create(stage=self.initial_stage, case=case,
+                                assignee=self.user, complete=True,
+                                responses={"size": size})
+            for case, size in [(done_case, 20), (new_case, 20),
+                               (new_case, 30), (other_case, 1)]
+        ]
+
+        # Conditions are not checked, as on completion
+        self.assertEqual(reroute_conditional_stage(conditional), 2)
+        self.assertFalse(in_tasks[0].out_tasks.exists())
+        self.assertEqual(in_tasks[1].out_tasks.get().stage, next_stage)
+        self.assertFalse(in_tasks[2].out_tasks.exists())
+        self.assertEqual(in_tasks[3].out_tasks.get().stage, next_stage)
+        self.assertEqual(reroute_conditional_stage(conditional), 0)
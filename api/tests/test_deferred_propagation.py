@@ -0,0 +1,158 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.test import override_settings
+from django.utils import timezone
+from django_q.conf import Conf
+from django_q.models import Schedule
+from rest_framework import status
+from rest_framework.reverse import reverse
+
+from api.asyncstuff import run_propagation_job, sweep_propagation_jobs
+from api.constans import TaskStageConstants
+from api.models import *
+from api.tests import GigaTurnipTestHelper
+
+
+class DeferredPropagationTest(GigaTurnipTestHelper):
+
+    def setUp(self):
+        super().setUp()
+        self.chain.deferred_propagation = True
+        self.chain.save()
+        self.second_stage = self.initial_stage.add_stage(TaskStage(
+            name="Second",
+            assign_user_by=TaskStageConstants.STAGE,
+            assign_user_from_stage=self.initial_stage
+        ))
+
+    def test_completion_schedules_job(self):
+        task = self.create_initial_task()
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.complete_task(task, whole_response=True)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(callbacks), 1)
+        self.assertNotIn("next_direct_id", response.data)
+        self.assertEqual(response.data["propagation"]["status"],
+                         PropagationJob.Status.PENDING)
+        task.refresh_from_db()
+        self.assertTrue(task.complete)
+        self.assertFalse(task.out_tasks.exists())
+
+        job = PropagationJob.objects.get(task=task)
+        next_task = run_propagation_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, PropagationJob.Status.DONE)
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(job.next_direct_task, next_task)
+        self.assertEqual(task.out_tasks.get(), next_task)
+        self.assertEqual(next_task.assignee, self.user)
+
+        # Repeated delivery of the job doesn't propagate chain twice
+        self.assertIsNone(run_propagation_job(job.id))
+        self.assertEqual(Task.objects.filter(stage=self.second_stage).count(), 1)
+
+    def test_propagation_endpoint(self):
+        task = self.create_initial_task()
+        with mock.patch.object(Conf, "SYNC", True), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.complete_task(task)
+
+        url = reverse("task-propagation", kwargs={"pk": task.pk})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["status"], PropagationJob.Status.DONE)
+        self.assertEqual(response.data["next_direct_task"],
+                         task.out_tasks.get().id)
+
+        response = self.employee_client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_propagation_endpoint_without_job(self):
+        self.chain.deferred_propagation = False
+        self.chain.save()
+        task = self.create_initial_task()
+        response = self.complete_task(task, whole_response=True)
+        self.assertEqual(response.data["next_direct_id"],
+                         task.out_tasks.get().id)
+
+        url = reverse("task-propagation", kwargs={"pk": task.pk})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_failed_propagation(self):
+        task = self.create_initial_task()
+        with self.captureOnCommitCallbacks():
+            self.complete_task(task)
+        job = PropagationJob.objects.get(task=task)
+
+        with mock.patch("api.asyncstuff.process_completed_task",
+                        side_effect=ValueError("broken chain")), \
+                override_settings(PROPAGATION_MAX_ATTEMPTS=2):
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.assertIsNone(run_propagation_job(job.id))
+            job.refresh_from_db()
+            # First failure is retried later
+            self.assertEqual(job.status, PropagationJob.Status.PENDING)
+            self.assertEqual(len(callbacks), 1)
+
+            self.assertIsNone(run_propagation_job(job.id))
+        job.refresh_from_db()
+        self.assertEqual(job.status, PropagationJob.Status.FAILED)
+        self.assertEqual(job.attempts, 2)
+        self.assertIn("broken chain", job.error)
+        self.assertFalse(task.out_tasks.exists())
+
+        job.retry()
+        next_task = run_propagation_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, PropagationJob.Status.DONE)
+        self.assertEqual(task.out_tasks.get(), next_task)
+
+    def test_stale_running_job_is_taken_again(self):
+        task = self.create_initial_task()
+        with self.captureOnCommitCallbacks():
+            self.complete_task(task)
+        job = PropagationJob.objects.get(task=task)
+        PropagationJob.claim(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, PropagationJob.Status.RUNNING)
+
+        # Running job is skipped until its worker is considered dead
+        self.assertIsNone(run_propagation_job(job.id))
+        PropagationJob.objects.filter(pk=job.pk).update(
+            updated_at=timezone.now() - timedelta(
+                seconds=settings.PROPAGATION_STALE + 1))
+        self.assertIsNotNone(run_propagation_job(job.id))
+        job.refresh_from_db()
+        self.assertEqual(job.status, PropagationJob.Status.DONE)
+        self.assertEqual(job.attempts, 2)
+
+    def test_lost_jobs_are_swept(self):
+        self.assertTrue(Schedule.objects.filter(
+            func="api.asyncstuff.sweep_propagation_jobs").exists())
+        tasks = self.create_initial_tasks(2)
+        with self.captureOnCommitCallbacks():
+            for task in tasks:
+                self.complete_task(task)
+        lost, failed = PropagationJob.objects.order_by("id")
+        for job in [lost, failed]:
+            PropagationJob.claim(job.id)
+        PropagationJob.objects.filter(pk=failed.pk).update(
+            attempts=settings.PROPAGATION_MAX_ATTEMPTS)
+
+        # Recently claimed jobs may still be running
+        self.assertEqual(sweep_propagation_jobs(), 0)
+
+        PropagationJob.objects.update(updated_at=timezone.now() - timedelta(
+            seconds=settings.PROPAGATION_STALE + 1))
+        with mock.patch.object(Conf, "SYNC", True):
+            self.assertEqual(sweep_propagation_jobs(), 1)
+        lost.refresh_from_db()
+        failed.refresh_from_db()
+        self.assertEqual(lost.status, PropagationJob.Status.DONE)
+        self.assertEqual(tasks[0].out_tasks.count(), 1)
+        self.assertEqual(failed.status, PropagationJob.Status.FAILED)
+        self.assertFalse(tasks[1].out_tasks.exists())
@@ -0,0 +1,187 @@
+import io
+import json
+import shutil
+import tempfile
+import zipfile
+from unittest import mock
+
+import pyarrow.parquet as pq
+from django.test import override_settings
+from django_q.conf import Conf
+from rest_framework import status
+from rest_framework.reverse import reverse
+
+from api.asyncstuff import run_export_job
+from api.models import *
+from api.tests import GigaTurnipTestHelper
+
+
+class ExportJobTest(GigaTurnipTestHelper):
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+
+        self.employee.managed_campaigns.add(self.campaign)
+        self.manager_client = self.create_client(self.employee)
+        self.initial_stage.json_schema = '{"properties":{"column1":{"column1":{}},"column2":{"column2":{}}}}'
+        self.initial_stage.ui_schema = '{"ui:order": ["column2", "column1"]}'
+        self.initial_stage.save()
+        self.response_flattener = ResponseFlattener.objects.create(
+            task_stage=self.initial_stage, flatten_all=True)
+
+    def submit(self, data, client=None):
+        return (client or self.manager_client).post(
+            reverse("exportjob-list"), data, format="json")
+
+    def download(self, job):
+        response = self.get_objects("exportjob-download", pk=job.id,
+                                    client=self.manager_client)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b"".join(response.streaming_content)
+
+    def test_flattener_csv_export(self):
+        tasks = self.create_initial_tasks(3)
+        self.complete_task(tasks[0], {"column2": "Second"})
+        self.complete_task(tasks[1], {"column1": "First", "another": "a"})
+
+        with mock.patch.object(Conf, "SYNC", True), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.submit({
+                "campaign": self.campaign.id,
+                "kind": ExportJob.Kind.FLATTENER_CSV,
+                "response_flattener": self.response_flattener.id
+            })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response = self.get_objects("exportjob-detail",
+                                    pk=response.data["id"],
+                                    client=self.manager_client)
+        self.assertEqual(response.data["status"], ExportJob.Status.DONE)
+        self.assertEqual(response.data["progress"], 1.0)
+        self.assertEqual(response.data["rows_written"], 3)
+
+        job = ExportJob.objects.get(id=response.data["id"])
+        self.assertEqual(self.download(job).decode().split("\r\n"), [
+            'id,column2,column1,description',
+            f'{tasks[0].id},Second,,',
+            f'{tasks[1].id},,First,another',
+            f'{tasks[2].id},,,',
+            '',
+        ])
+
+    @override_settings(EXPORT_JOB_CHUNK_SIZE=2, EXPORT_JOB_TIME_BUDGET=0)
+    def test_export_is_resumed_from_checkpoint(self):
+        tasks = self.create_initial_tasks(5)
+        job = ExportJob.objects.create(
+            campaign=self.campaign, kind=ExportJob.Kind.TASK_DUMP,
+            filters={"stage": self.initial_stage.id})
+
+        # Each run writes one chunk and queues the job again
+        with mock.patch.object(ExportJob, "enqueue") as enqueue:
+            run_export_job(job.id)
+        enqueue.assert_called_once()
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExportJob.Status.RUNNING)
+        self.assertEqual((job.parts, job.last_id, job.total_rows),
+                         (1, tasks[1].id, 5))
+
+        with mock.patch.object(ExportJob, "write_chunk",
+                               side_effect=ValueError("disk is full")):
+            run_export_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExportJob.Status.FAILED)
+        self.assertEqual(job.error, "ValueError: disk is full")
+        self.assertEqual(job.last_id, tasks[1].id)
+
+        with mock.patch.object(Conf, "SYNC", True), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.manager_client.post(
+                reverse("exportjob-resume", kwargs={"pk": job.id}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExportJob.Status.DONE)
+        self.assertEqual(job.attempts, 4)
+
+        rows = [json.loads(line)
+                for line in self.download(job).decode().splitlines()]
+        self.assertEqual([row["id"] for row in rows],
+                         [task.id for task in tasks])
+
+    def test_user_activity_csv_export(self):
+        self.create_initial_tasks(2)
+        job = ExportJob.objects.create(
+            campaign=self.campaign, kind=ExportJob.Kind.USER_ACTIVITY_CSV)
+        run_export_job(job.id)
+        lines = self.download(job).decode().split("\r\n")
+        self.assertEqual(lines[0].split(","),
+                         ExportJob.objects.get(id=job.id).columns)
+        self.assertIn(f"{self.initial_stage.id},Initial,", lines[1])
+        self.assertEqual(len(lines), 3)
+
+    def test_parquet_export(self):
+        self.initial_stage.json_schema = json.dumps({"properties": {
+            "name": {"type": "string"},
+            "age": {"type": "integer"},
+            "address": {"properties": {"score": {"type": "number"}}}
+        }})
+        self.initial_stage.ui_schema = '{"ui:order": ["name", "age", "address"]}'
+        self.initial_stage.save()
+        second_stage = self.initial_stage.add_stage(TaskStage(name="Second"))
+        tasks = [
+            Task.objects.create(stage=self.initial_stage, responses={
+                "name": "Ann", "age": "31", "address": {"score": 4.5}}),
+            Task.objects.create(stage=self.initial_stage, responses={
+                "name": "Bob", "age": "unknown", "extra": 1}),
+            Task.objects.create(stage=second_stage, responses={"a": "b"}),
+        ]
+        job = ExportJob.objects.create(campaign=self.campaign,
+                                       kind=ExportJob.Kind.PARQUET)
+        run_export_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExportJob.Status.DONE)
+
+        archive = zipfile.ZipFile(io.BytesIO(self.download(job)))
+        date = tasks[0].created_at.date()
+        self.assertEqual(archive.namelist(), [
+            f"stage={self.initial_stage.id}/date={date}/part-00000.parquet",
+            f"stage={second_stage.id}/date={date}/part-00000.parquet",
+        ])
+        table = pq.read_table(io.BytesIO(archive.read(archive.namelist()[0])))
+        self.assertEqual(str(table.schema.field("age").type), "int64")
+        self.assertEqual(str(table.schema.field("address__score").type),
+                         "double")
+        self.assertEqual(table.to_pydict()["name"], ["Ann", "Bob"])
+        self.assertEqual(table.to_pydict()["age"], [31, None])
+        self.assertEqual(table.to_pydict()["description"], [None, "extra"])
+
+        # Stage without response flattener has all responses flattened
+        table = pq.read_table(io.BytesIO(archive.read(archive.namelist()[1])))
+        self.assertEqual(table.column_names, ["id", "description"])
+        self.assertEqual(table.to_pydict()["description"], ["a"])
+
+    def test_export_validation_and_access(self):
+        data = {"campaign": self.campaign.id,
+                "kind": ExportJob.Kind.TASK_DUMP}
+        response = self.submit(dict(data, filters={"responses": "a"}))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.submit(dict(data, kind=ExportJob.Kind.FLATTENER_CSV))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        with self.captureOnCommitCallbacks():
+            response = self.submit(data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        job = ExportJob.objects.get(id=response.data["id"])
+        self.assertEqual(job.created_by, self.employee)
+
+        response = self.get_objects("exportjob-download", pk=job.id,
+                                    client=self.manager_client)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.get_objects("exportjob-detail", pk=job.id)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.submit(data, client=self.client)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
@@ -1,6 +1,8 @@
 import hashlib
 import json
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 
 from api.constans import AutoNotificationConstants, TaskStageConstants, \
@@ -398,4 +400,48 @@ class LocalizationTest(GigaTurnipTestHelper):
                 status=Translation.Status.ANSWERED).count(), 4)
         translated_texts = [i[0].split()[1] == i[1].split()[1] for i in
                             all_translations.values_list("key__text", "text")]
-        self.assertTrue(all(translated_texts))
\ No newline at end of file
+        self.assertTrue(all(translated_texts))
+
+    def test_translated_schema_is_cached(self):
+        self.initial_stage.json_schema = json.dumps(get_schema())
+        self.initial_stage.save()
+        objects = TranslateKey.generate_keys_from_stage(self.initial_stage)
+        local_lang = Language.objects.create(name="Russia", code="ru")
+        with self.captureOnCommitCallbacks(execute=True):
+            Translation.objects.bulk_create([
+                Translation(key=i, language=local_lang, text=i.text)
+                for i in objects
+            ])
+
+        def get_titles():
+            with CaptureQueriesContext(connection) as context:
+                response = self.get_objects("taskstage-list",
+                                            params={"lang": "ru"})
+            schema = to_json(response.data["results"][0]["json_schema"])
+            queries = [q for q in context.captured_queries
+                       if '"api_translation"' in q["sql"]]
+            return [i["title"] for i in schema["properties"].values()], \
+                len(queries)
+
+        self.assertEqual(get_titles(), (["Question 1", "Question 2",
+                                         "Question 3", "Question 4"], 1))
+        self.assertEqual(get_titles()[1], 0)
+
+        translations = {hashlib.sha256(i.text.encode()).hexdigest():
+                        i.text.replace("Question", "Вопрос")
+                        for i in objects}
+        with self.captureOnCommitCallbacks(execute=True):
+            Translation.update_from_dict(self.campaign, local_lang,
+                                         translations)
+        self.assertEqual(get_titles(), (["Вопрос 1", "Вопрос 2",
+                                         "Вопрос 3", "Вопрос 4"], 1))
+
+        # Unknown languages aren't translated
+        with CaptureQueriesContext(connection) as context:
+            response = self.get_objects("taskstage-list",
+                                        params={"lang": "xx"})
+        schema = to_json(response.data["results"][0]["json_schema"])
+        self.assertEqual(schema["properties"]["answer"]["title"],
+                         "Question 1")
+        self.assertFalse([q for q in context.captured_queries
+                          if '"api_translation"' in q["sql"]])
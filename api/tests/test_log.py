@@ -20,3 +20,48 @@ class LogTest(GigaTurnipTestHelper):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(old_count, 0)
         self.assertEqual(Log.objects.count(), 1)
+
+    def test_empty_responses_log_without_select(self):
+        task = self.create_initial_task()
+        task.responses = {"answer": "a"}
+        task.save()
+
+        task = Task.objects.get(id=task.id)
+        task.responses = {"answer": "b"}
+        with self.assertNumQueries(1):
+            task.save()
+        self.assertEqual(Log.objects.count(), 0)
+
+        task.responses = {}
+        task.save()
+        log = Log.objects.get()
+        self.assertEqual(log.name, "Task responses seem empty.")
+        self.assertEqual(log.json["previous"]["responses"], {"answer": "b"})
+        self.assertEqual(log.json["current"]["responses"], {})
+
+    def test_audit_sample_rate(self):
+        self.campaign.audit_sample_rate = 0
+        self.campaign.save()
+
+        self.initial_stage.name = "Rename stage"
+        self.initial_stage.save()
+
+        task = self.create_initial_task()
+        task.responses = {"answer": "a"}
+        task.save()
+        task.responses = None
+        task.save()
+        self.assertEqual(Log.objects.count(), 0)
+
+    def test_task_stage_log_uses_loaded_values(self):
+        stage = TaskStage.objects.get(id=self.initial_stage.id)
+        # Updates of stage and task stage tables only
+        with self.assertNumQueries(2):
+            stage.save()
+        self.assertEqual(Log.objects.count(), 0)
+
+        stage.name = "Rename stage"
+        stage.save()
+        log = Log.objects.get()
+        self.assertIn(f"name: {self.initial_stage.name} -> Rename stage",
+                      log.description)
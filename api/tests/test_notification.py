@@ -1,5 +1,11 @@
 import json
+from unittest import mock
 
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django_q.conf import Conf
 from rest_framework import status
 
 from api.constans import AutoNotificationConstants, TaskStageConstants, \
@@ -9,7 +15,9 @@ from api.tests import GigaTurnipTestHelper, to_json
 
 from firebase_admin import credentials, messaging
 
-from api.utils.push_notifications import send_push_notification
+from api.utils.push_notifications import send_push_notification, \
+    get_sender, deliver_push_notifications, queue_push_notification, \
+    PendingPushes
 
 
 class NotificationTest(GigaTurnipTestHelper):
@@ -150,3 +158,208 @@ class NotificationTest(GigaTurnipTestHelper):
     #     token = 'far0LXGJRHW6cMR7_FD6Nt:APA91bEK2eOy3Yp959sjWqtZ8uzmoTnWr_wQxDcdMOfZttN4ClIyo9_U3koPp6weImaJ9u6yHLvZePEBOP7AlozVeooCyzatLF8FQ1V4fFCfzmUpaC4FZSGXhxp_t2uK2zxh7oxyYWuq'
     #
     #     send_push_notification(token, 'Hello', 'Body')
+
+    @override_settings(
+        PUSH_NOTIFICATION_SENDER="api.utils.push_notifications.LocalSender")
+    def test_auto_notification_push_is_queued(self):
+        sender = get_sender()
+        sender.messages.clear()
+        self.user.fcm_token = "user-token"
+        self.user.save()
+        self.initial_stage.json_schema = json.dumps(
+            {"type": "object", "properties": {"foo": {"type": "string"}}})
+        self.initial_stage.save()
+        self.initial_stage.add_stage(TaskStage(
+            name='Second stage',
+            json_schema=self.initial_stage.json_schema,
+            assign_user_by=TaskStageConstants.STAGE
+        ))
+        notification = Notification.objects.create(
+            title='Congrats you have completed your first task!',
+            campaign=self.campaign
+        )
+        AutoNotification.objects.create(
+            trigger_stage=self.initial_stage,
+            recipient_stage=self.initial_stage,
+            notification=notification
+        )
+
+        task = self.create_initial_task()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.complete_task(task, {"foo": "hello world!"})
+        # Nothing is sent within the request
+        self.assertEqual(sender.messages, [])
+
+        with mock.patch.object(Conf, "SYNC", True):
+            for callback in callbacks:
+                callback()
+        [message] = sender.messages
+        created = self.user.notifications.get()
+        self.assertEqual(message.tokens, ["user-token"])
+        self.assertEqual(message.title, notification.title)
+        self.assertEqual(message.data, {
+            "campaign_id": str(self.campaign.id),
+            "notification_id": str(created.id),
+        })
+
+    @override_settings(PUSH_NOTIFICATION_BATCH_SIZE=2)
+    def test_rank_notification_is_sent_to_each_token(self):
+        users = [self.user, self.employee, CustomUser.objects.create_user(
+            username="third", email="third@email.com", password="third")]
+        for i, user in enumerate(users):
+            user.fcm_token = f"token-{i}"
+            user.save()
+            RankRecord.objects.get_or_create(user=user,
+                                             rank=self.default_rank)
+        notification = Notification.objects.create(
+            title="New chain", text="There is new chain for you",
+            campaign=self.campaign, rank=self.default_rank)
+
+        def send(message):
+            if message.token == "token-1":
+                raise messaging.UnregisteredError("Not registered")
+            return "message-id"
+
+        with mock.patch.object(messaging, "send",
+                               side_effect=send) as send_mock:
+            result = deliver_push_notifications([notification.id])
+        self.assertEqual(
+            sorted(call.args[0].token for call in send_mock.call_args_list),
+            ["token-0", "token-1", "token-2"])
+        self.assertEqual(result, {"messages": 1, "tokens": 3,
+                                  "invalid_tokens": 1})
+        self.employee.refresh_from_db()
+        self.assertIsNone(self.employee.fcm_token)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.fcm_token, "token-0")
+
+    def test_queued_push_notifications_of_transaction(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            with transaction.atomic():
+                queue_push_notification(1)
+                queue_push_notification(2)
+                try:
+                    with transaction.atomic():
+                        queue_push_notification(3)
+                        raise ValueError()
+                except ValueError:
+                    pass
+        self.assertEqual([i.ids for i in callbacks
+                          if isinstance(i, PendingPushes)], [[1, 2]])
+
+    def test_notification_inbox_counters(self):
+        def counters(user):
+            inbox = NotificationInbox.objects.filter(
+                user=user, campaign=self.campaign).first()
+            return (inbox.total, inbox.unread) if inbox else (0, 0)
+
+        RankRecord.objects.create(user=self.employee, rank=self.default_rank)
+        rank_notifications = [Notification.objects.create(
+            title=f"Rank {i}", campaign=self.campaign,
+            rank=self.default_rank) for i in range(3)]
+        Notification.objects.create(title="Personal", campaign=self.campaign,
+                                    target_user=self.user)
+        self.assertEqual(counters(self.employee), (3, 3))
+        self.assertEqual(counters(self.user), (1, 1))
+
+        # Rank given later brings its notifications
+        self.user.ranks.add(self.default_rank)
+        self.assertEqual(counters(self.user), (4, 4))
+
+        response = self.get_objects("notification-detail",
+                                    pk=rank_notifications[0].id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rank_notifications[0].open(self.user)
+        self.assertEqual(counters(self.user), (4, 3))
+        self.assertEqual(counters(self.employee), (3, 3))
+
+        rank_notifications[0].delete()
+        self.assertEqual(counters(self.user), (3, 3))
+        self.assertEqual(counters(self.employee), (2, 2))
+
+        with mock.patch.object(NotificationInbox, "recount_ranks",
+                               wraps=NotificationInbox.recount_ranks) as recount:
+            record = RankRecord.objects.get(user=self.employee)
+            record.save()
+            self.assertEqual(recount.call_count, 0)
+            self.user.ranks.remove(self.default_rank)
+            self.assertEqual(recount.call_count, 1)
+        self.assertEqual(counters(self.user), (1, 1))
+
+        # Record moved to another user takes its notifications
+        record.user = self.user
+        record.save()
+        self.assertEqual(counters(self.user), (3, 3))
+        self.assertEqual(counters(self.employee), (0, 0))
+        record.user = self.employee
+        record.save()
+        self.assertEqual(counters(self.user), (1, 1))
+
+        response = self.get_objects("notification-inbox")
+        self.assertEqual(to_json(response.content), [
+            {"campaign": self.campaign.id, "total": 1, "unread": 1}])
+        response = self.get_objects("notification-inbox",
+                                    params={"campaign": "abc"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.get_objects("campaign-list")
+        campaign = to_json(response.content)["results"][0]
+        self.assertEqual((campaign["notifications_count"],
+                          campaign["unread_notifications_count"]), (1, 1))
+
+    def test_read_all_notifications_in_bulk(self):
+        def read_all(**params):
+            return self.get_objects("notification-read-all-notifications",
+                                    params=params)
+
+        RankRecord.objects.create(user=self.user, rank=self.default_rank)
+        for i in range(3):
+            Notification.objects.create(title=f"Rank {i}",
+                                        campaign=self.campaign,
+                                        rank=self.default_rank)
+        opened = Notification.objects.create(
+            title="Personal", campaign=self.campaign, target_user=self.user)
+        opened.open(self.user)
+        cutoff = timezone.now()
+        later = Notification.objects.create(
+            title="Later", campaign=self.campaign, target_user=self.user)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = read_all(campaign=self.campaign.id,
+                                cutoff=cutoff.isoformat())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(to_json(response.content)["marked"], 3)
+        self.assertEqual(to_json(response.content)["already_read"], 1)
+        self.assertFalse(later.notification_statuses.exists())
+        inbox = NotificationInbox.objects.get(user=self.user,
+                                              campaign=self.campaign)
+        self.assertEqual((inbox.total, inbox.unread), (5, 1))
+
+        for i in range(5):
+            Notification.objects.create(title=f"More {i}",
+                                        campaign=self.campaign,
+                                        target_user=self.user)
+        with self.assertNumQueries(len(queries)):
+            response = read_all(campaign=self.campaign.id)
+        self.assertEqual(to_json(response.content)["marked"], 6)
+        inbox.refresh_from_db()
+        self.assertEqual((inbox.total, inbox.unread), (10, 0))
+
+        response = read_all(cutoff="yesterday")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # Notification opened while marking is counted once
+        concurrent = Notification.objects.create(
+            title="Concurrent", campaign=self.campaign, target_user=self.user)
+        insert_missing = NotificationStatus.insert_missing
+
+        def open_and_insert(user, notification_ids):
+            concurrent.open(user)
+            return insert_missing(user, notification_ids)
+
+        with mock.patch.object(NotificationStatus, "insert_missing",
+                               side_effect=open_and_insert):
+            response = read_all(campaign=self.campaign.id)
+        self.assertEqual(to_json(response.content)["marked"], 0)
+        self.assertEqual(to_json(response.content)["already_read"], 11)
+        inbox.refresh_from_db()
+        self.assertEqual((inbox.total, inbox.unread), (11, 0))
@@ -0,0 +1,134 @@
+import json
+from unittest import mock
+
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.signals import request_finished
+from django.db import close_old_connections
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory, override_settings
+from rest_framework import status
+
+from api.middleware import QueryStats, QueryStatsMiddleware
+from api.models import *
+from api.tests import GigaTurnipTestHelper, to_json
+from api.views import CampaignViewSet
+
+
+@override_settings(QUERY_STATS_ENABLED=True)
+class QueryStatsTest(GigaTurnipTestHelper):
+
+    def add_campaigns(self, count):
+        for i in range(count):
+            data = self.generate_new_basic_campaign(f"Campaign {i}")
+            data["campaign"].open = True
+            data["campaign"].save()
+            RankRecord.objects.create(user=self.employee, rank=data["rank"])
+            Notification.objects.create(title=f"Notification {i}",
+                                        campaign=data["campaign"],
+                                        rank=data["rank"])
+            Chain.objects.create(name=f"Individual {i}",
+                                 campaign=self.campaign, is_individual=True)
+
+    def test_query_budgets(self):
+        endpoints = [
+            "campaign-list",
+            "campaign-detail",
+            "campaign-list-user-campaigns",
+            "campaign-list-user-selectable",
+            "notification-list-user-notifications",
+            "notification-inbox",
+            "chain-individuals",
+        ]
+        for count in [1, 5]:
+            self.add_campaigns(count)
+            for endpoint in endpoints:
+                with self.subTest(endpoint=endpoint, campaigns=count):
+                    pk = Campaign.objects.last().id \
+                        if endpoint.endswith("detail") else None
+                    response = self.get_objects(endpoint, pk=pk,
+                                                client=self.employee_client)
+                    self.assertEqual(response.status_code,
+                                     status.HTTP_200_OK)
+                    self.assertQueryBudget(response)
+
+    @override_settings(QUERY_STATS_HEADERS=True)
+    def test_query_stats_headers_and_logs(self):
+        self.add_campaigns(2)
+        with self.assertLogs("api.queries", "DEBUG") as logs:
+            response = self.get_objects("campaign-list",
+                                        client=self.employee_client)
+        self.assertEqual(response["X-Query-Action"], "CampaignViewSet.list")
+        self.assertEqual(int(response["X-Query-Count"]),
+                         response.query_stats.count)
+        self.assertIn("X-Query-Time", response)
+        self.assertEqual(response["X-Query-Duplicates"], "0")
+        record = logs.records[-1]
+        self.assertEqual(record.levelname, "DEBUG")
+        self.assertEqual(json.loads(record.getMessage()),
+                         record.query_stats)
+        self.assertEqual(record.query_stats["action"], "CampaignViewSet.list")
+        self.assertEqual(record.query_stats["budget"], 10)
+
+        with mock.patch.object(CampaignViewSet, "query_budgets",
+                               {"list": 1}), \
+                self.assertLogs("api.queries", "WARNING") as logs:
+            response = self.get_objects("campaign-list",
+                                        client=self.employee_client)
+        self.assertTrue(response.query_stats.over_budget)
+        self.assertEqual(logs.records[0].query_stats["queries"],
+                         response.query_stats.count)
+
+        with override_settings(QUERY_STATS_HEADERS=False):
+            response = self.get_objects("campaign-list",
+                                        client=self.employee_client)
+        self.assertNotIn("X-Query-Count", response)
+
+    def test_repeated_queries(self):
+        self.add_campaigns(3)
+        ids = list(Campaign.objects.values_list("id", flat=True))
+        with QueryStats() as stats:
+            for i in ids:
+                Campaign.objects.get(id=i)
+            list(Campaign.objects.filter(id__in=ids))
+            list(Campaign.objects.filter(id__in=ids[:1]))
+        self.assertEqual(stats.count, len(ids) + 2)
+        self.assertEqual(sorted(stats.get_duplicates().values()),
+                         [2, len(ids)])
+        self.assertEqual(stats.duplicate_count, len(ids))
+
+        Campaign.objects.count()
+        self.assertEqual(stats.count, len(ids) + 2)
+
+    def test_streaming_response_queries(self):
+        def stream():
+            yield "a"
+            Campaign.objects.count()
+            yield "b"
+
+        middleware = QueryStatsMiddleware(
+            lambda request: StreamingHttpResponse(stream()))
+        with self.assertLogs("api.queries", "DEBUG") as logs:
+            response = middleware(RequestFactory().get("/export"))
+            self.assertEqual(response.query_stats.count, 0)
+            self.assertEqual(b"".join(response.streaming_content), b"ab")
+            # As the test client, keep the connection of the test case
+            request_finished.disconnect(close_old_connections)
+            try:
+                response.close()
+            finally:
+                request_finished.connect(close_old_connections)
+        self.assertEqual(response.query_stats.count, 1)
+        self.assertEqual(logs.records[-1].query_stats["queries"], 1)
+
+        Campaign.objects.count()
+        self.assertEqual(response.query_stats.count, 1)
+
+    @override_settings(QUERY_STATS_ENABLED=False, QUERY_STATS_HEADERS=True)
+    def test_query_stats_disabled(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            QueryStatsMiddleware(lambda request: None)
+        response = self.get_objects("campaign-list",
+                                    client=self.employee_client)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(hasattr(response, "query_stats"))
+        self.assertNotIn("X-Query-Count", response)
@@ -1,5 +1,7 @@
+import io
 import json
 
+from django.core.management import CommandError, call_command
 from rest_framework import status
 
 from api.constans import AutoNotificationConstants, TaskStageConstants, \
@@ -564,3 +566,59 @@ class QuizTest(GigaTurnipTestHelper):
         # self.assertEqual(task.responses[Quiz.SCORE], 80)
         # self.assertEqual(Task.objects.count(), 2)
         # self.assertTrue(task.complete)
+
+    def test_quiz_answer_key_is_compiled_once(self):
+        self.initial_stage.json_schema = json.dumps({"properties": {
+            "1": {"title": "Question 1", "type": "string"},
+            "2": {"title": "Question 2", "type": "boolean"},
+        }})
+        self.initial_stage.save()
+        correct_task = self.complete_task(self.create_initial_task(),
+                                          responses={"1": "a", "2": True})
+        quiz = Quiz.objects.create(task_stage=self.initial_stage,
+                                   correct_responses_task=correct_task,
+                                   show_answer=Quiz.ShowAnswers.ALWAYS)
+        task = self.complete_task(self.create_initial_task(),
+                                  responses={"1": "a", "2": False})
+        self.assertEqual(task.responses[Quiz.SCORE], 50)
+        self.assertEqual(task.responses[Quiz.INCORRECT_QUESTIONS],
+                         "Question 2")
+
+        quiz = Quiz.get_for_stage(TaskStage.objects.get(id=quiz.pk))
+        with self.assertNumQueries(0):
+            self.assertEqual(quiz.compare_with_correct_answers(
+                {"1": "a", "2": True}), (100, ""))
+
+        # Changed correct responses produce new answer key
+        correct_task.responses["2"] = False
+        correct_task.save()
+        quiz = Quiz.get_for_stage(TaskStage.objects.get(id=quiz.pk))
+        self.assertEqual(quiz.compare_with_correct_answers(
+            {"1": "a", "2": False}), (100, ""))
+
+    def test_rescore_quizzes_command(self):
+        self.initial_stage.json_schema = json.dumps({"properties": {
+            "1": {"title": "Question 1"}, "2": {"title": "Question 2"},
+        }})
+        self.initial_stage.save()
+        correct_task = self.complete_task(self.create_initial_task(),
+                                          responses={"1": "a", "2": "b"})
+        Quiz.objects.create(task_stage=self.initial_stage,
+                            correct_responses_task=correct_task,
+                            show_answer=Quiz.ShowAnswers.ALWAYS)
+        task = self.complete_task(self.create_initial_task(),
+                                  responses={"1": "a", "2": "c"})
+        self.assertEqual(task.responses[Quiz.SCORE], 50)
+
+        correct_task.responses["2"] = "c"
+        correct_task.save()
+        out = io.StringIO()
+        call_command("rescore_quizzes", self.initial_stage.id, stdout=out)
+        self.assertIn("1 tasks rescored", out.getvalue())
+        task.refresh_from_db()
+        self.assertEqual(task.responses[Quiz.SCORE], 100)
+        self.assertEqual(task.responses[Quiz.INCORRECT_QUESTIONS], "")
+        self.assertTrue(task.complete)
+
+        with self.assertRaises(CommandError):
+            call_command("rescore_quizzes", self.initial_stage.id + 100)
@@ -33,3 +33,37 @@ class RankLimitTest(GigaTurnipTestHelper):
         response = client.patch(task_update_url, {"complete": True}, format='json')
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
+
+    def test_user_stage_counters(self):
+        counter = lambda: UserStageCounter.objects.get(
+            user=self.employee, stage=self.initial_stage)
+        client = self.prepare_client(
+            self.initial_stage,
+            self.employee,
+            RankLimit(is_creation_open=True, open_limit=2, total_limit=3))
+        url = reverse("taskstage-user-relevant")
+
+        first = self.create_task(self.initial_stage, client)
+        self.create_task(self.initial_stage, client)
+        self.assertEqual((counter().total, counter().incomplete), (2, 2))
+        # Open limit is reached
+        response = client.get(url)
+        self.assertEqual(response.data["results"], [])
+
+        self.complete_task(first, client=client)
+        self.assertEqual((counter().total, counter().incomplete), (2, 1))
+        response = client.get(url)
+        self.assertEqual([i["id"] for i in response.data["results"]],
+                         [self.initial_stage.id])
+
+        self.create_task(self.initial_stage, client)
+        # Total limit is reached
+        response = client.get(url)
+        self.assertEqual(response.data["results"], [])
+
+        Task.objects.filter(assignee=self.employee).first().delete()
+        counts = Task.objects.filter(assignee=self.employee,
+                                     stage=self.initial_stage)
+        self.assertEqual(counter().total, counts.count())
+        self.assertEqual(counter().incomplete,
+                         counts.filter(complete=False).count())
@@ -1,4 +1,5 @@
 import json
+from unittest import mock
 
 from rest_framework import status
 from rest_framework.reverse import reverse
@@ -7,6 +8,7 @@ from api.constans import AutoNotificationConstants, TaskStageConstants, \
     CopyFieldConstants
 from api.models import *
 from api.tests import GigaTurnipTestHelper, to_json
+from api.utils.column_plan import ColumnPlan
 
 
 class ResponseFlattenerTest(GigaTurnipTestHelper):
@@ -343,3 +345,74 @@ class ResponseFlattenerTest(GigaTurnipTestHelper):
         response = self.get_objects("responseflattener-csv", pk=response_flattener.id + 111)
 
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_response_flattener_stream_csv(self):
+        tasks = self.create_initial_tasks(3)
+        self.initial_stage.json_schema = '{"properties":{"column1":{"column1":{}},"column2":{"column2":{}},"oik":{"properties":{"uik1":{}}}}}'
+        self.initial_stage.ui_schema = '{"ui:order": ["column2", "column1", "oik"]}'
+        self.initial_stage.save()
+        response_flattener = ResponseFlattener.objects.create(task_stage=self.initial_stage, flatten_all=True)
+
+        responses = {"column2": "SecondColumn", "oik": {"uik1": "SecondLayer"}}
+        self.complete_task(tasks[0], responses, self.client)
+        responses['another'] = "field not in schema"
+        self.complete_task(tasks[1], responses, self.client)
+
+        self.employee.managed_campaigns.add(self.campaign)
+        new_client = self.create_client(self.employee)
+        response = self.get_objects("responseflattener-csv", params={"stream": "true"},
+                                    client=new_client, pk=response_flattener.id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().split("\r\n")
+        self.assertEqual(lines, [
+            'id,column2,column1,oik__uik1,description',
+            f'{tasks[0].id},SecondColumn,,SecondLayer,',
+            f'{tasks[1].id},SecondColumn,,SecondLayer,another',
+            f'{tasks[2].id},,,,',
+            '',
+        ])
+
+    def test_response_flattener_flatten_many(self):
+        self.initial_stage.ui_schema = '{"files": {"ui:widget": "customfile"}}'
+        self.initial_stage.save()
+        response_flattener = ResponseFlattener.objects.create(
+            task_stage=self.initial_stage,
+            columns=["oik__(i)uik", "(r)^q[0-9]$", "files"])
+        responses = [
+            {"oik": {"uik1": "First"}, "q1": "answer",
+             "files": '{"a": "path/a.png"}'},
+            {"oik": {"other": 1}, "question": "not matched", "name": "Bob"},
+        ]
+        tasks = [Task.objects.create(stage=self.initial_stage, responses=r)
+                 for r in responses]
+        rows = response_flattener.flatten_many(
+            Task.objects.filter(id__in=[t.id for t in tasks])
+            .order_by("id").values("id", "responses"))
+        self.assertEqual(rows, [
+            {"id": tasks[0].id, "q1": "answer",
+             "files": "https://storage.cloud.google.com/"
+                      "gigaturnip-b6b5b.appspot.com/path/a.png?authuser=1",
+             "oik__(i)uik": "First", "(r)^q[0-9]$": "answer"},
+            {"id": tasks[1].id, "question": "not matched", "name": "Bob"},
+        ])
+        self.assertEqual(rows[0], response_flattener.flatten_response(tasks[0]))
+
+    def test_response_flattener_reuses_plan(self):
+        task = self.create_initial_task()
+        task.responses = {"column1": "First", "oik": {"uik1": "Second"}}
+        task.save()
+        response_flattener = ResponseFlattener.objects.create(
+            task_stage=self.initial_stage, columns=["oik__(i)uik"])
+
+        with mock.patch("api.models.response_flattener.ColumnPlan",
+                        wraps=ColumnPlan) as plan:
+            for _ in range(3):
+                row = response_flattener.flatten_response(task)
+            self.assertEqual(plan.call_count, 1)
+            self.assertEqual(row["oik__(i)uik"], "Second")
+
+            response_flattener.columns = []
+            row = response_flattener.flatten_response(task)
+            self.assertEqual(plan.call_count, 2)
+            self.assertNotIn("oik__(i)uik", row)
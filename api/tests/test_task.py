@@ -1,6 +1,9 @@
 import json
+from unittest import mock
 
+from django.db import connection
 from django.http import QueryDict
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from rest_framework.reverse import reverse
 
@@ -756,3 +759,138 @@ class TaskTest(GigaTurnipTestHelper):
 
         response = self.update_task_responses(task, responses, self.client)
         self.assertIsInstance(response, Task)
+
+    def test_selectable_pool(self):
+        second_stage = self.initial_stage.add_stage(TaskStage(name="Second"))
+        tasks = [Task.objects.create(stage=second_stage, case=Case.objects.create())
+                 for _ in range(3)]
+        self.assertFalse(SelectableTask.objects.exists())
+
+        employee_client = self.prepare_client(
+            second_stage,
+            self.employee,
+            RankLimit(is_listing_allowed=True, is_selection_open=True))
+        rank = self.employee.ranks.get(name=second_stage.name)
+        self.assertEqual(
+            set(SelectableTask.objects.values_list("rank_id", "task_id")),
+            {(rank.id, task.id) for task in tasks}
+        )
+
+        response = self.get_objects("task-user-selectable",
+                                    params={"after": tasks[0].id},
+                                    client=employee_client)
+        self.assertEqual([i["id"] for i in response.data["results"]],
+                         [tasks[1].id, tasks[2].id])
+
+        self.request_assignment(tasks[0], employee_client)
+        tasks[1].complete = True
+        tasks[1].save()
+        self.assertEqual(
+            list(SelectableTask.objects.values_list("task_id", flat=True)),
+            [tasks[2].id]
+        )
+
+        task_0 = Task.objects.get(id=tasks[0].id)
+        task_0.assignee = None
+        task_0.save()
+        response = self.get_objects("task-user-selectable",
+                                    client=employee_client)
+        self.assertEqual({i["id"] for i in response.data["results"]},
+                         {tasks[0].id, tasks[2].id})
+
+        response = self.get_objects("task-user-selectable",
+                                    params={"after": "first"},
+                                    client=employee_client)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # Only fields of the pool rebuild it
+        rank_limit = RankLimit.objects.get(stage=second_stage)
+        rank_limit.open_limit = 5
+        with mock.patch.object(SelectableTask, "refresh_stages") as refresh:
+            rank_limit.save()
+            refresh.assert_not_called()
+            rank_limit.is_selection_open = False
+            rank_limit.save()
+            refresh.assert_called_once_with({second_stage.id})
+
+        RankLimit.objects.filter(stage=second_stage).get().delete()
+        self.assertFalse(SelectableTask.objects.exists())
+
+    def test_claim_next(self):
+        second_stage = self.initial_stage.add_stage(TaskStage(name="Second"))
+        tasks = [Task.objects.create(stage=second_stage, case=Case.objects.create())
+                 for _ in range(4)]
+        employee_client = self.prepare_client(
+            second_stage,
+            self.employee,
+            RankLimit(is_listing_allowed=True, is_selection_open=True,
+                      open_limit=3))
+        url = reverse("task-claim-next")
+
+        response = employee_client.post(url, {"count": 2,
+                                              "stage": second_stage.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([i["id"] for i in response.data["tasks"]],
+                         [tasks[0].id, tasks[1].id])
+        self.assertEqual(
+            Task.objects.filter(assignee=self.employee).count(), 2)
+
+        # Open limit leaves one more task
+        response = employee_client.post(url, {"count": 2})
+        self.assertEqual([i["id"] for i in response.data["tasks"]],
+                         [tasks[2].id])
+        response = employee_client.post(url)
+        self.assertEqual(response.data["tasks"], [])
+
+        # Other users can't claim tasks of the stage
+        response = self.client.post(url)
+        self.assertEqual(response.data["tasks"], [])
+
+        response = employee_client.post(url, {"count": 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_claim_next_skips_closed_stages(self):
+        limited_stage = self.initial_stage.add_stage(
+            TaskStage(name="Limited"))
+        free_stage = self.initial_stage.add_stage(TaskStage(name="Free"))
+        limited = [Task.objects.create(stage=limited_stage,
+                                       case=Case.objects.create())
+                   for _ in range(3)]
+        free = [Task.objects.create(stage=free_stage,
+                                    case=Case.objects.create())
+                for _ in range(2)]
+        employee_client = self.prepare_client(
+            limited_stage, self.employee,
+            RankLimit(is_listing_allowed=True, is_selection_open=True,
+                      open_limit=1))
+        self.prepare_client(
+            free_stage, self.employee,
+            RankLimit(is_listing_allowed=True, is_selection_open=True))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = employee_client.post(reverse("task-claim-next"),
+                                            {"count": 3})
+        self.assertEqual([i["id"] for i in response.data["tasks"]],
+                         [limited[0].id, free[0].id, free[1].id])
+        # Counters of the user are locked by the claim
+        self.assertTrue(any(
+            'FROM "api_userstagecounter"' in q["sql"]
+            and "FOR UPDATE" in q["sql"] for q in queries.captured_queries))
+        self.assertEqual(UserStageCounter.objects.get(
+            user=self.employee, stage=limited_stage).incomplete, 1)
+
+    def test_loaded_responses_track_changes_in_place(self):
+        task = self.create_initial_task()
+        task.responses = {"answer": "a", "nested": {"list": [1]}}
+        task.save()
+
+        task = Task.objects.get(id=task.id)
+        self.assertEqual(task.get_changed_fields(), {})
+        task.responses["nested"]["list"].append(2)
+        self.assertEqual(task.get_changed_fields(), {"responses": (
+            {"answer": "a", "nested": {"list": [1]}}, task.responses)})
+        self.assertEqual(task.get_loaded_value("responses"),
+                         {"answer": "a", "nested": {"list": [1]}})
+
+        task.save()
+        self.assertEqual(task.get_changed_fields(), {})
@@ -0,0 +1,83 @@
+from unittest import mock
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from api.asyncstuff import TaskMaterializer, create_new_tasks
+from api.constans import TaskStageConstants
+from api.models import *
+from api.models.modifiers import CountTasksModifier
+from api.tests import GigaTurnipTestHelper
+
+
+class TaskMaterializerTest(GigaTurnipTestHelper):
+
+    def test_fan_out_is_inserted_at_once(self):
+        assigned_stage = self.initial_stage.add_stage(TaskStage(
+            name="Assigned",
+            assign_user_by=TaskStageConstants.STAGE,
+            assign_user_from_stage=self.initial_stage
+        ))
+        copy_stage = self.initial_stage.add_stage(TaskStage(
+            name="Copy", copy_input=True
+        ))
+        counter_stage = self.initial_stage.add_stage(TaskStage(
+            name="Counter"
+        ))
+        CountTasksModifier.objects.create(
+            task_stage=counter_stage,
+            stage_to_count_tasks_from=assigned_stage,
+            field_to_write_count_to="assigned_count",
+            count_unique_users=True
+        )
+
+        task = self.create_initial_task()
+        with CaptureQueriesContext(connection) as context:
+            self.complete_task(task, {"answer": "a"})
+        task_inserts = [q for q in context.captured_queries
+                        if q["sql"].startswith('INSERT INTO "api_task" ')]
+        self.assertEqual(len(task_inserts), 1)
+
+        out_tasks = {t.stage_id: t for t in task.out_tasks.all()}
+        self.assertEqual(len(out_tasks), 3)
+        self.assertEqual(out_tasks[assigned_stage.id].assignee, self.user)
+        self.assertEqual(out_tasks[copy_stage.id].responses, {"answer": "a"})
+        self.assertIsNone(out_tasks[copy_stage.id].assignee)
+        # Pending task of the assigned stage is counted
+        self.assertEqual(
+            out_tasks[counter_stage.id].responses["assigned_count"], 1)
+
+    def test_external_stages_are_not_materialized(self):
+        webhook_stage = self.initial_stage.add_stage(TaskStage(
+            name="Webhook", webhook_address="https://example.com"
+        ))
+        task = self.create_initial_task()
+        self.assertFalse(
+            TaskMaterializer.is_materializable(webhook_stage, task))
+
+        self.chain.is_individual = True
+        self.chain.save()
+        plain_stage = self.initial_stage.add_stage(TaskStage(name="Plain"))
+        plain_stage = TaskStage.objects.get(id=plain_stage.id)
+        self.assertTrue(TaskMaterializer.is_materializable(plain_stage, task))
+        Task.objects.create(stage=plain_stage, case=task.case) \
+            .in_tasks.add(task)
+        self.assertFalse(
+            TaskMaterializer.is_materializable(plain_stage, task))
+
+    def test_failed_step_writes_no_buffered_tasks(self):
+        plain_stage = self.initial_stage.add_stage(TaskStage(name="Plain"))
+        webhook_stage = self.initial_stage.add_stage(TaskStage(
+            name="Webhook", webhook_address="https://example.com"
+        ))
+        task = self.create_initial_task()
+        task.complete = True
+        task.save()
+
+        with mock.patch("api.asyncstuff.WebhookBatch.flush",
+                        side_effect=ValueError("webhook failed")), \
+                mock.patch.object(TaskMaterializer, "flush") as flush:
+            with self.assertRaisesMessage(ValueError, "webhook failed"):
+                create_new_tasks([plain_stage, webhook_stage], task)
+        flush.assert_not_called()
+        self.assertFalse(task.out_tasks.exists())
@@ -1,4 +1,5 @@
 import json
+from unittest import mock
 
 from rest_framework import status
 
@@ -317,6 +318,37 @@ class TaskStageTest(GigaTurnipTestHelper):
         self.assertEqual(response.data['fields'],
                          ['column2', 'column1', 'oik__uik1'])
 
+    def test_task_stage_columns_are_cached_by_schema(self):
+        schema = {"properties": {"column1": {"column1": {}},
+                                 "column2": {"column2": {}}}}
+        self.initial_stage.json_schema = json.dumps(schema)
+        self.initial_stage.ui_schema = json.dumps(
+            {"ui:order": ["column2", "column1"]})
+        self.initial_stage.save()
+        columns = self.initial_stage.make_columns_ordered()
+        self.assertEqual([i.split("__", 1)[1] for i in columns],
+                         ['column2', 'column1'])
+
+        with mock.patch.object(TaskStage, "compute_columns_ordered") as compute:
+            self.assertEqual(self.initial_stage.make_columns_ordered(), columns)
+            compute.assert_not_called()
+
+        self.initial_stage.ui_schema = json.dumps(
+            {"ui:order": ["column1", "column2"]})
+        columns = self.initial_stage.make_columns_ordered()
+        self.assertEqual([i.split("__", 1)[1] for i in columns],
+                         ['column1', 'column2'])
+
+    def test_task_stage_columns_without_ui_order(self):
+        schema = {"properties": {"column2": {"column2": {}},
+                                 "column1": {"column1": {}}}}
+        self.initial_stage.json_schema = json.dumps(schema)
+        self.initial_stage.ui_schema = json.dumps({})
+        self.initial_stage.save()
+        columns = self.initial_stage.make_columns_ordered()
+        self.assertEqual([i.split("__", 1)[1] for i in columns],
+                         ['column2', 'column1'])
+
     def test_stage_max_limits(self):
         [i.delete() for i in RankLimit.objects.all()]
         rank_1 = self.user.ranks.first()
@@ -1,5 +1,7 @@
 import json
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 
 from api.constans import TaskStageConstants
@@ -217,3 +219,44 @@ class TranslationAdapterTest(GigaTurnipTestHelper):
             len(Translation.objects.filter(
                 status=Translation.Status.ANSWERED)),
             len(translate_phrases))
+
+    def test_translation_tasks_are_generated_in_bulk(self):
+        ru_lang = Language.objects.create(name="Russia", code="ru")
+        adapter_stage = self.initial_stage.add_stage(
+            TaskStage(name="Translate adapter RU"))
+        adapter = TranslationAdapter.objects.create(
+            stage=adapter_stage, source=self.lang, target=ru_lang)
+        in_task = self.create_initial_task()
+
+        def add_stages(start, count):
+            for i in range(start, start + count):
+                schema = {"title": f"Stage {i}", "properties": {
+                    f"q{j}": {"title": f"Question {i} {j}"} for j in range(5)
+                }}
+                TaskStage.objects.create(name=f"Stage {i}", chain=self.chain,
+                                         x_pos=1, y_pos=1,
+                                         json_schema=json.dumps(schema))
+
+        def generate():
+            with CaptureQueriesContext(connection) as context:
+                adapter.generate_translation_tasks([in_task])
+            return len(context.captured_queries)
+
+        add_stages(0, 2)
+        queries = generate()
+        self.assertEqual(adapter_stage.tasks.count(), 2)
+        self.assertEqual(Translation.objects.filter(
+            status=Translation.Status.PENDING).count(), 12)
+
+        add_stages(2, 8)
+        self.assertEqual(generate(), queries)
+        self.assertEqual(adapter_stage.tasks.count(), 10)
+        self.assertEqual(Translation.objects.filter(
+            status=Translation.Status.PENDING).count(), 60)
+        self.assertEqual(
+            set(in_task.out_tasks.values_list("id", flat=True)),
+            set(adapter_stage.tasks.values_list("id", flat=True)))
+
+        # Phrases given out already aren't sent again
+        self.assertLess(generate(), queries)
+        self.assertEqual(adapter_stage.tasks.count(), 10)
@@ -1,11 +1,32 @@
 import json
-
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+
+import requests
+from django.core.cache import cache
+from django.conf import settings
+from django.test import override_settings
+from django.utils import timezone
+from django_q.conf import Conf
+from django_q.models import Schedule
 from rest_framework import status
 
 from api.constans import AutoNotificationConstants, TaskStageConstants, \
     CopyFieldConstants, WebhookConstants, ErrorConstants
+from api.asyncstuff import deliver_webhooks as run_deliveries, \
+    sweep_webhook_deliveries
 from api.models import *
 from api.tests import GigaTurnipTestHelper, to_json
+from api.utils import webhook_client
+
+
+def make_response(status_code, data=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(data or {}).encode()
+    return response
 
 
 class WebhookTest(GigaTurnipTestHelper):
@@ -273,3 +294,225 @@ class WebhookTest(GigaTurnipTestHelper):
 
         response = self.get_objects('task-trigger-webhook', pk=next_task.pk)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(WEBHOOK_RETRY_BACKOFF=0, WEBHOOK_CIRCUIT_THRESHOLD=2)
+    def test_webhook_client_retries_and_circuit_breaker(self):
+        url = "https://partner.example.com/hook"
+        webhook_client._breakers.clear()
+        webhook = Webhook.objects.create(task_stage=self.initial_stage,
+                                         url=url, max_retries=2,
+                                         read_timeout=3)
+        with mock.patch.object(requests.Session, "request", side_effect=[
+            requests.ConnectionError(), make_response(503),
+            make_response(200, {"a": 1}),
+        ]) as request:
+            self.assertEqual(webhook.send("GET", url, {}, {}).json(),
+                             {"a": 1})
+        self.assertEqual(request.call_count, 3)
+        self.assertEqual(request.call_args.kwargs["timeout"], (5, 3))
+
+        # POST is retried only when the connection wasn't established
+        with mock.patch.object(requests.Session, "request", side_effect=[
+            requests.ConnectTimeout(), make_response(503),
+        ]) as request:
+            self.assertEqual(webhook.post({}).status_code, 503)
+        self.assertEqual(request.call_count, 2)
+        with mock.patch.object(requests.Session, "request",
+                               side_effect=requests.ConnectionError(
+                                   "Connection aborted.")) as request:
+            with self.assertRaises(requests.ConnectionError):
+                webhook.post({})
+        self.assertEqual(request.call_count, 1)
+
+        # Unexpected errors are recorded too, so the breaker isn't stuck
+        webhook_client._breakers.clear()
+        with mock.patch.object(requests.Session, "request",
+                               side_effect=ValueError()):
+            for i in range(2):
+                with self.assertRaises(ValueError):
+                    webhook.post({})
+        self.assertIsNotNone(webhook_client.get_breaker(url).opened_at)
+        with override_settings(WEBHOOK_CIRCUIT_RESET=0), \
+                mock.patch.object(requests.Session, "request",
+                                  side_effect=ValueError()):
+            with self.assertRaises(ValueError):
+                webhook.post({})
+        self.assertFalse(webhook_client.get_breaker(url).trial)
+        webhook_client._breakers.clear()
+
+        with mock.patch.object(requests.Session, "request",
+                               side_effect=requests.ReadTimeout()) as request:
+            for i in range(2):
+                with self.assertRaises(requests.ReadTimeout):
+                    webhook.post({})
+            # Circuit is open, the url isn't called anymore
+            with self.assertRaises(webhook_client.CircuitOpenError):
+                webhook.post({}, url=url + "?page=2")
+        self.assertEqual(request.call_count, 2)
+
+        with override_settings(WEBHOOK_CIRCUIT_RESET=0), \
+                mock.patch.object(requests.Session, "request",
+                                  return_value=make_response(200)):
+            self.assertEqual(webhook.post({}).status_code, 200)
+        self.assertIsNone(webhook_client.get_breaker(url).opened_at)
+
+    def test_webhooks_of_task_are_called_concurrently(self):
+        webhook_client._breakers.clear()
+        stages = [
+            self.initial_stage.add_stage(TaskStage(name=f"Webhook {i}"))
+            for i in range(3)
+        ]
+        for i, stage in enumerate(stages):
+            Webhook.objects.create(
+                task_stage=stage,
+                url=f"https://partner.example.com/hook{i}",
+                which_responses=WebhookConstants.IN_RESPONSES)
+        threads = set()
+
+        def request(method, url, **kwargs):
+            threads.add(threading.get_ident())
+            time.sleep(0.3)
+            return make_response(200, {"url": url[-5:]})
+
+        task = self.create_initial_task()
+        with mock.patch.object(requests.Session, "request",
+                               side_effect=request):
+            started = time.monotonic()
+            task = self.complete_task(task, {"answer": "a"})
+            self.assertLess(time.monotonic() - started, 0.8)
+        self.assertEqual(len(threads), 3)
+        self.assertNotIn(threading.get_ident(), threads)
+        self.assertEqual(
+            sorted(task.out_tasks.values_list("responses__url", flat=True)),
+            ["hook0", "hook1", "hook2"])
+
+    def test_webhook_responses_are_cached(self):
+        cache.clear()
+        webhook = Webhook.objects.create(
+            task_stage=self.initial_stage,
+            url="https://dictionary.example.com/lookup",
+            which_responses=WebhookConstants.CURRENT_TASK_RESPONSES,
+            cache_responses=True, cache_max_size=20)
+        responses = [make_response(200, {"word": "hello"}),
+                     make_response(200, {"word": "world"}),
+                     make_response(200, {"word": "long" * 10}),
+                     make_response(200, {"word": "long"})]
+        with mock.patch.object(requests.Session, "request",
+                               side_effect=responses) as request:
+            task = Task.objects.create(stage=self.initial_stage,
+                                       responses={"a": 1, "b": 2})
+            webhook.trigger(task)
+            task = Task.objects.create(stage=self.initial_stage,
+                                       responses={"b": 2, "a": 1})
+            webhook.trigger(task)
+            self.assertEqual(task.responses["word"], "hello")
+            self.assertEqual(request.call_count, 1)
+
+            self.assertEqual(webhook.post({"a": 1}).json(), {"word": "world"})
+            self.assertEqual(webhook.post({"a": 1}).json(), {"word": "world"})
+            self.assertEqual(request.call_count, 2)
+
+            # Responses larger than the limit aren't cached
+            webhook.post({"a": 2})
+            self.assertEqual(webhook.post({"a": 2}).json(), {"word": "long"})
+            self.assertEqual(request.call_count, 4)
+
+        # Other credentials don't get the cached response
+        with mock.patch.object(requests.Session, "request",
+                               return_value=make_response(200)) as request:
+            webhook.post({"a": 1}, headers={"Authorization": "Token b"})
+            self.assertEqual(request.call_count, 1)
+
+    @override_settings(WEBHOOK_MAX_RETRIES=0, WEBHOOK_OUTBOX_MAX_ATTEMPTS=2)
+    def test_webhook_outbox_delivery(self):
+        webhook_client._breakers.clear()
+        webhook_stage = self.initial_stage.add_stage(TaskStage(
+            name="Webhook in background",
+            webhook_address="https://partner.example.com/create",
+            webhook_params={"action": "create"},
+            webhook_outbox=True,
+        ))
+        tasks = self.create_initial_tasks(2)
+
+        # The partner is down: tasks are completed, calls are kept
+        with mock.patch.object(requests.Session, "request",
+                               return_value=make_response(503)), \
+                mock.patch.object(Conf, "SYNC", True), \
+                self.captureOnCommitCallbacks(execute=True):
+            for task in tasks:
+                self.complete_task(task, {"answer": "a"})
+        self.assertFalse(Task.objects.filter(stage=webhook_stage).exists())
+        deliveries = WebhookDelivery.objects.order_by("id")
+        self.assertEqual(
+            [(i.status, i.attempts) for i in deliveries],
+            [(WebhookDelivery.Status.PENDING, 1)] * 2)
+        self.assertEqual(deliveries[0].params,
+                         {"answer": "a", "action": "create",
+                          "in_task_id": tasks[0].id})
+        self.assertEqual(deliveries[0].error, "HTTPError: 503 Server Error: "
+                                              "None for url: None")
+
+        WebhookDelivery.objects.update(next_attempt_at=timezone.now())
+        with mock.patch.object(requests.Session, "request", side_effect=[
+            make_response(200, {"exercise": "b a"}),
+            requests.ConnectionError("refused")
+        ]):
+            self.assertEqual(run_deliveries("https://partner.example.com"), 2)
+        done, dead = WebhookDelivery.objects.order_by("id")
+        self.assertEqual(done.status, WebhookDelivery.Status.DONE)
+        self.assertEqual(done.result_task.responses, {"exercise": "b a"})
+        self.assertTrue(done.result_task.complete)
+        self.assertEqual(list(done.result_task.in_tasks.all()), [tasks[0]])
+        self.assertEqual(dead.status, WebhookDelivery.Status.DEAD)
+        self.assertEqual(ErrorItem.objects.count(), 1)
+
+    @override_settings(WEBHOOK_OUTBOX_CONCURRENCY=2)
+    def test_webhook_outbox_concurrency_limit(self):
+        stage = self.initial_stage.add_stage(TaskStage(
+            name="Webhook in background",
+            webhook_address="https://partner.example.com/create",
+            webhook_outbox=True,
+        ))
+        for task in self.create_initial_tasks(3):
+            WebhookDelivery.record(stage, task, {})
+        WebhookDelivery.objects.filter(id=WebhookDelivery.objects.first().id) \
+            .update(status=WebhookDelivery.Status.RUNNING)
+
+        claimed = WebhookDelivery.claim("https://partner.example.com")
+        self.assertEqual(len(claimed), 1)
+        self.assertEqual(WebhookDelivery.claim("https://partner.example.com"),
+                         [])
+
+    def test_lost_webhook_deliveries_are_swept(self):
+        self.assertTrue(Schedule.objects.filter(
+            func="api.asyncstuff.sweep_webhook_deliveries").exists())
+        webhook_client._breakers.clear()
+        stage = self.initial_stage.add_stage(TaskStage(
+            name="Webhook in background",
+            webhook_address="https://partner.example.com/create",
+            webhook_outbox=True,
+        ))
+        tasks = self.create_initial_tasks(2)
+        with self.captureOnCommitCallbacks():
+            lost, exhausted = [WebhookDelivery.record(stage, task, {})
+                               for task in tasks]
+        WebhookDelivery.objects.update(status=WebhookDelivery.Status.RUNNING,
+                                       attempts=1)
+        WebhookDelivery.objects.filter(pk=exhausted.pk).update(
+            attempts=settings.WEBHOOK_OUTBOX_MAX_ATTEMPTS)
+
+        # Recently claimed deliveries may still be running
+        self.assertEqual(sweep_webhook_deliveries(), 0)
+
+        WebhookDelivery.objects.update(updated_at=timezone.now() - timedelta(
+            seconds=settings.WEBHOOK_OUTBOX_STALE + 1))
+        with mock.patch.object(requests.Session, "request",
+                               return_value=make_response(200, {"a": 1})), \
+                mock.patch.object(Conf, "SYNC", True):
+            self.assertEqual(sweep_webhook_deliveries(), 1)
+        lost.refresh_from_db()
+        exhausted.refresh_from_db()
+        self.assertEqual(lost.status, WebhookDelivery.Status.DONE)
+        self.assertEqual(lost.attempts, 2)
+        self.assertEqual(lost.result_task.responses, {"a": 1})
+        self.assertEqual(exhausted.status, WebhookDelivery.Status.DEAD)
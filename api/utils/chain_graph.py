@@ -0,0 +1,234 @@
+import copy
+
+from django.conf import settings
+from django.db.models import Max, Count, Q
+from django.utils import timezone
+
+from api.models import Chain, Stage, TaskStage, ConditionalStage, CopyField
+from api.utils.conditions import InvalidCondition
+from api.utils.lru import LRUCache
+
+
+class StageNode:
+    """
+    Routing information of a single stage of the compiled chain.
+    """
+    __slots__ = (
+        "id", "stage", "is_conditional", "in_ids", "out_ids", "conditions",
+        "pingpong", "limit_order", "has_copy_fields", "has_webhook",
+        "has_integration", "has_quiz", "has_translation_adapter",
+    )
+
+    def __init__(self, stage):
+        self.id = stage.id
+        self.stage = stage
+        self.is_conditional = isinstance(stage, ConditionalStage)
+        self.in_ids = []
+        self.out_ids = []
+        self.conditions = None
+        self.pingpong = False
+        self.limit_order = None
+        self.has_copy_fields = False
+        self.has_webhook = False
+        self.has_integration = False
+        self.has_quiz = False
+        self.has_translation_adapter = False
+
+
+class ChainGraph:
+    """
+    Compiled stage graph of the chain used to route completed tasks.
+
+    Graph is built with a constant number of queries and kept in the
+    process memory. Its version is built from updated_at of the chain and
+    its stages, so each lookup costs one aggregate query and the graph is
+    rebuilt only when the chain was edited. Changes of stage connections
+    and stage related settings touch updated_at of the stages (see
+    api/signals.py), so they also produce a new version. At most
+    CHAIN_GRAPH_CACHE_SIZE recently used graphs are kept.
+    """
+    _cache = LRUCache(settings.CHAIN_GRAPH_CACHE_SIZE)
+
+    # Reverse one to one relations which absence is cached on the stage
+    # instances, so stage.get_webhook() and others don't hit the database.
+    OPTIONAL_RELATIONS = {
+        "webhook": "has_webhook",
+        "integration": "has_integration",
+        "quiz": "has_quiz",
+        "translation_adapter": "has_translation_adapter",
+    }
+
+    def __init__(self, chain_id, version):
+        self.chain_id = chain_id
+        self.version = version
+        self.nodes = {}
+
+    @classmethod
+    def get(cls, chain_id):
+        version = cls.get_version(chain_id)
+        graph = cls._cache.get(chain_id)
+        if graph is None or graph.version != version:
+            graph = cls.build(chain_id, version)
+            cls._cache.set(chain_id, graph)
+        return graph
+
+    @classmethod
+    def for_stage(cls, stage):
+        return cls.get(stage.chain_id)
+
+    @classmethod
+    def invalidate(cls, chain_id=None):
+        if chain_id is None:
+            cls._cache.clear()
+        else:
+            cls._cache.pop(chain_id)
+
+    @staticmethod
+    def get_version(chain_id):
+        return Chain.objects.filter(id=chain_id).annotate(
+            stages_updated_at=Max("stages__updated_at"),
+            stages_count=Count("stages"),
+        ).values_list(
+            "updated_at", "stages_updated_at", "stages_count"
+        ).first()
+
+    @staticmethod
+    def touch_stages(stage_ids):
+        """
+        Mark stages as changed without firing save signals.
+        """
+        stage_ids = [i for i in stage_ids if i is not None]
+        if stage_ids:
+            Stage.objects.filter(id__in=stage_ids) \
+                .update(updated_at=timezone.now())
+
+    @classmethod
+    def build(cls, chain_id, version):
+        graph = cls(chain_id, version)
+
+        task_stages = TaskStage.objects.filter(chain_id=chain_id) \
+            .select_related("chain")
+        conditional_stages = ConditionalStage.objects \
+            .filter(chain_id=chain_id) \
+            .select_related("chain", "conditional_limit")
+        for stage in list(task_stages) + list(conditional_stages):
+            graph.nodes[stage.id] = StageNode(stage)
+
+        # Row of in_stages table links stage (from_stage) with one of its
+        # in stages (to_stage), i.e. it is an edge to_stage -> from_stage.
+        edges = Stage.in_stages.through.objects.filter(
+            Q(to_stage__chain_id=chain_id) | Q(from_stage__chain_id=chain_id)
+        ).values_list("to_stage_id", "from_stage_id").order_by("from_stage_id")
+        for source_id, target_id in edges:
+            if source_id in graph.nodes:
+                graph.nodes[source_id].out_ids.append(target_id)
+            if target_id in graph.nodes:
+                graph.nodes[target_id].in_ids.append(source_id)
+
+        copy_field_stages = set(
+            CopyField.objects.filter(task_stage__chain_id=chain_id)
+            .values_list("task_stage_id", flat=True)
+        )
+        present = {}
+        for relation in cls.OPTIONAL_RELATIONS:
+            field = TaskStage._meta.get_field(relation)
+            present[relation] = set(
+                field.related_model.objects
+                .filter(**{f"{field.field.name}__chain_id": chain_id})
+                .values_list(field.field.attname, flat=True)
+            )
+
+        for node in graph.nodes.values():
+            stage = node.stage
+            if node.is_conditional:
+                node.conditions = stage.conditions or []
+                node.pingpong = stage.pingpong
+                try:
+                    # Compiled form is copied with the stage instance.
+                    stage.get_compiled_conditions()
+                except InvalidCondition:
+                    pass
+                limit = getattr(stage, "conditional_limit", None)
+                if limit is not None:
+                    node.limit_order = (limit.order, limit.created_at)
+                continue
+            node.has_copy_fields = node.id in copy_field_stages
+            for relation, flag in cls.OPTIONAL_RELATIONS.items():
+                is_present = node.id in present[relation]
+                setattr(node, flag, is_present)
+                if not is_present:
+                    TaskStage._meta.get_field(relation) \
+                        .set_cached_value(stage, None)
+        return graph
+
+    def _copy(self, stage_id):
+        # Copies of the cached stages are returned, so callers may change
+        # them freely. The chain is copied too and loses its campaign:
+        # campaign changes don't change the graph version, so the campaign
+        # is loaded again by the callers needing it.
+        stage = copy.copy(self.nodes[stage_id].stage)
+        chain_field = Stage._meta.get_field("chain")
+        if chain_field.is_cached(stage):
+            chain = copy.copy(stage.chain)
+            campaign_field = Chain._meta.get_field("campaign")
+            if campaign_field.is_cached(chain):
+                campaign_field.delete_cached_value(chain)
+            chain_field.set_cached_value(stage, chain)
+        return stage
+
+    def _split(self, stage_ids):
+        local = [i for i in stage_ids if i in self.nodes]
+        foreign = [i for i in stage_ids if i not in self.nodes]
+        return local, foreign
+
+    def in_ids(self, stage_id):
+        return self.nodes[stage_id].in_ids
+
+    def out_ids(self, stage_id):
+        return self.nodes[stage_id].out_ids
+
+    def out_task_stages(self, stage_id):
+        local, foreign = self._split(self.out_ids(stage_id))
+        stages = [self._copy(i) for i in local
+                  if not self.nodes[i].is_conditional]
+        if foreign:
+            stages += list(TaskStage.objects.filter(id__in=foreign))
+        return stages
+
+    def out_conditional_stages(self, stage_id):
+        """
+        Out conditional stages without conditional limits.
+        """
+        local, foreign = self._split(self.out_ids(stage_id))
+        stages = [self._copy(i) for i in local
+                  if self.nodes[i].is_conditional
+                  and self.nodes[i].limit_order is None]
+        if foreign:
+            stages += list(ConditionalStage.objects.filter(
+                id__in=foreign, conditional_limit__isnull=True))
+        return stages
+
+    def out_conditional_limit_stages(self, stage_id):
+        """
+        Out conditional stages with conditional limits in order of limits.
+        """
+        local, foreign = self._split(self.out_ids(stage_id))
+        nodes = sorted(
+            [self.nodes[i] for i in local if self.nodes[i].limit_order],
+            key=lambda node: node.limit_order
+        )
+        stages = [self._copy(node.id) for node in nodes]
+        if foreign:
+            stages += list(ConditionalStage.objects.filter(
+                id__in=foreign, conditional_limit__isnull=False
+            ).order_by('conditional_limit__order',
+                       'conditional_limit__created_at'))
+        return stages
+
+    def in_pingpong_stages(self, stage_id):
+        local, foreign = self._split(self.in_ids(stage_id))
+        stages = [self._copy(i) for i in local if self.nodes[i].pingpong]
+        if foreign:
+            stages += list(ConditionalStage.objects.filter(
+                id__in=foreign, pingpong=True))
+        return stages
@@ -0,0 +1,180 @@
+import json
+import re
+
+FILE_URL = "https://storage.cloud.google.com/gigaturnip-b6b5b.appspot.com/" \
+           "{}?authuser=1"
+
+
+def parse_files(value):
+    try:
+        files = [FILE_URL.format(path) for path in json.loads(value).values()]
+        return ", \n".join(files)
+    except:
+        return "CAN'T_PARSE_JSON_ERROR" + value
+
+
+class KeyStep:
+    """
+    Take value by the key. Dictionaries are followed by the next steps,
+    other values are returned as is.
+    """
+    __slots__ = ("key", "is_file")
+
+    def __init__(self, key, ui):
+        self.key = key
+        self.is_file = isinstance(ui, dict) \
+            and ui.get("ui:widget") == "customfile"
+
+
+class LiteralStep:
+    """
+    Take value by the whole remaining path. Used for keys containing
+    search marks not at the start of the path.
+    """
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+
+class PartialStep:
+    """
+    Take value of the first key matching the (i) substring or (r) regular
+    expression. Matched dictionaries are followed by the rest of the path.
+    """
+    __slots__ = ("match", "rest")
+
+    def __init__(self, path):
+        search_type = path[path.find("(") + 1: path.find(")")]
+        keys = path.split(")", 1)[1].split("__", 1)
+        key_to_find = keys[0]
+        if search_type == "i":
+            self.match = lambda key: key_to_find in key and key_to_find != key
+        elif search_type == "r":
+            self.match = re.compile(key_to_find).search
+        else:
+            self.match = lambda key: False
+        self.rest = compile_path(keys[1]) if len(keys) > 1 else None
+
+
+def compile_path(path, ui=None):
+    """
+    Split column path into steps, so responses are followed without
+    parsing the path again.
+    """
+    steps = []
+    while path is not None:
+        paths = path.split("__", 1)
+        current_key = paths[0]
+        if "(i)" in current_key or "(r)" in current_key:
+            if path.startswith("("):
+                steps.append(PartialStep(path))
+            else:
+                steps.append(LiteralStep(path))
+            break
+        ui = ui.get(current_key) if isinstance(ui, dict) else None
+        steps.append(KeyStep(current_key, ui))
+        path = paths[1] if len(paths) > 1 else None
+    return tuple(steps)
+
+
+def follow_steps(steps, responses):
+    for step in steps:
+        if isinstance(step, KeyStep):
+            result = responses.get(step.key, None)
+            if isinstance(result, dict):
+                responses = result
+                continue
+            if step.is_file and result is not None:
+                result = parse_files(result)
+            return result
+        if isinstance(step, LiteralStep):
+            result = responses.get(step.key, None)
+            if isinstance(result, (dict, list)):
+                return None
+            return result
+        return find_partial_key(step, responses)
+    return None
+
+
+def find_partial_key(step, responses):
+    for key, value in responses.items():
+        if step.match(key):
+            if not isinstance(value, (dict, list)):
+                return value
+            if step.rest is None or not isinstance(value, dict):
+                return None
+            return follow_steps(step.rest, value)
+    return None
+
+
+def get_all_paths(key, value):
+    if isinstance(value, dict):
+        paths = []
+        for k, v in value.items():
+            paths += get_all_paths(key + "__" + k, v)
+        return paths
+    if isinstance(value, (str, int, list)):
+        return [key]
+    return []
+
+
+class ColumnPlan:
+    """
+    Settings of the response flattener compiled for the export: parsed ui
+    schema, split column paths, matchers of (i) and (r) columns, file
+    widget flags and system fields. The plan is applied to each task
+    without parsing anything again.
+    """
+
+    def __init__(self, response_flattener, system_fields=()):
+        self.copy_first_level = response_flattener.copy_first_level
+        self.flatten_all = response_flattener.flatten_all
+        self.exclude = set(response_flattener.exclude_list or [])
+        self.ui = json.loads(response_flattener.task_stage.get_ui_schema())
+        self.columns = [(path, compile_path(path, self.ui))
+                        for path in response_flattener.columns or []]
+        self.system_fields = [name for name in system_fields
+                              if name != "responses"] \
+            if response_flattener.copy_system_fields else []
+        self._all_paths = {}
+
+    def get_path(self, path):
+        steps = self._all_paths.get(path)
+        if steps is None:
+            steps = self._all_paths[path] = compile_path(path, self.ui)
+        return steps
+
+    def flatten(self, task):
+        """
+        Flatten task instance or dict of task values.
+        """
+        if isinstance(task, dict):
+            values, responses = task, task.get("responses")
+        else:
+            values, responses = task.__dict__, task.responses
+        result = {"id": values["id"]}
+        if responses and not self.flatten_all:
+            if self.copy_first_level:
+                for key, value in responses.items():
+                    if key not in self.exclude and \
+                            not isinstance(value, (dict, list)):
+                        result[key] = value
+            for path, steps in self.columns:
+                value = follow_steps(steps, responses)
+                if value:
+                    result[path] = value
+        elif self.flatten_all and responses:
+            for key, value in responses.items():
+                for path in get_all_paths(key, value):
+                    flat_value = follow_steps(self.get_path(path), responses)
+                    if flat_value:
+                        result[path] = flat_value
+        for name in self.system_fields:
+            if name in values:
+                result[name] = values[name]
+        return result
+
+    def flatten_many(self, tasks):
+        for task in tasks:
+            yield self.flatten(task)
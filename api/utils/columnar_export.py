@@ -0,0 +1,154 @@
+import json
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.apps import apps
+from django.db import models
+
+STRING = pa.string()
+JSON_SCHEMA_TYPES = {
+    "string": STRING,
+    "integer": pa.int64(),
+    "number": pa.float64(),
+    "boolean": pa.bool_(),
+}
+
+
+def get_field_type(field):
+    if isinstance(field, models.BooleanField):
+        return pa.bool_()
+    if isinstance(field, (models.AutoField, models.IntegerField,
+                          models.ForeignKey)):
+        return pa.int64()
+    if isinstance(field, models.DateTimeField):
+        return pa.timestamp("us", tz="UTC")
+    return STRING
+
+
+def find_property(schema, key):
+    """
+    Find property of the key in properties of the schema or in its
+    dependencies.
+    """
+    if not isinstance(schema, dict):
+        return None
+    properties = schema.get("properties") or {}
+    if key in properties:
+        return properties[key]
+    for dependency in (schema.get("dependencies") or {}).values():
+        if not isinstance(dependency, dict):
+            continue
+        for option in dependency.get("oneOf", []) + dependency.get("anyOf", []):
+            found = find_property(option, key)
+            if found is not None:
+                return found
+    return None
+
+
+def get_schema_type(json_schema, path):
+    """
+    Return arrow type of the column path (keys joined by "__") found in
+    the json schema. Columns missing in the schema and objects are
+    strings.
+    """
+    prop = json_schema
+    for key in path.split("__"):
+        prop = find_property(prop, key)
+        if prop is None:
+            return STRING
+    schema_type = prop.get("type") if isinstance(prop, dict) else None
+    if isinstance(schema_type, list):
+        schema_type = next((i for i in schema_type if i != "null"), None)
+    return JSON_SCHEMA_TYPES.get(schema_type, STRING)
+
+
+def coerce(value, arrow_type):
+    """
+    Convert the flattened value to the column type. Values which can't be
+    converted are written as nulls.
+    """
+    if value is None:
+        return None
+    if arrow_type == STRING:
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, ensure_ascii=False)
+        return str(value)
+    if pa.types.is_boolean(arrow_type):
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.lower() in ("true", "false"):
+            return value.lower() == "true"
+        return None
+    if isinstance(value, bool):
+        return None
+    if pa.types.is_integer(arrow_type):
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+    if pa.types.is_floating(arrow_type):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    if pa.types.is_timestamp(arrow_type):
+        return value if isinstance(value, datetime) else None
+    return None
+
+
+class StageTable:
+    """
+    Flattens tasks of the stage by the rules of its response flattener and
+    builds typed arrow tables of them. Types of response columns come
+    from the stage json schema, types of system fields from the task
+    model. Stages without response flattener flatten all responses.
+    """
+
+    def __init__(self, stage, response_flattener=None):
+        ResponseFlattener = apps.get_model("api.responseflattener")
+        Task = apps.get_model("api.task")
+        if response_flattener is None:
+            response_flattener = ResponseFlattener.objects.filter(
+                task_stage=stage).first() \
+                or ResponseFlattener(task_stage=stage, flatten_all=True)
+        self.response_flattener = response_flattener
+        self.plan = response_flattener.compile_plan()
+        self.columns = response_flattener.ordered_columns() \
+            + ["description"]
+        self.known_columns = set(self.columns)
+
+        json_schema = json.loads(stage.get_json_schema())
+        field_types = {field.attname: get_field_type(field)
+                       for field in Task._meta.concrete_fields}
+        self.schema = pa.schema([
+            (column, field_types[column] if column in field_types
+             else get_schema_type(json_schema, column))
+            for column in self.columns
+        ])
+
+    def get_fields(self):
+        return self.response_flattener.get_export_fields()
+
+    def to_table(self, tasks):
+        """
+        Build table of dicts of task values.
+        """
+        rows = [
+            self.response_flattener.describe_extra_columns(
+                row, self.known_columns)
+            for row in self.plan.flatten_many(tasks)
+        ]
+        return pa.Table.from_pydict({
+            field.name: [coerce(row.get(field.name), field.type)
+                         for row in rows]
+            for field in self.schema
+        }, schema=self.schema)
+
+
+def write_parquet(table):
+    output = pa.BufferOutputStream()
+    pq.write_table(table, output)
+    return output.getvalue().to_pybytes()
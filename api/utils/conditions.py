@@ -0,0 +1,236 @@
+import json
+from functools import lru_cache
+
+from django.db.models import Q, Value, Case, When, FloatField
+from django.db.models.functions import StrIndex, Cast
+
+from api.constans import ConditionalStageConstants, DjangoORMConstants
+from api.utils.django_expressions import (
+    JSONBTypeOf, JSONBExtractPath, JSONBExtractPathText
+)
+
+
+class InvalidCondition(ValueError):
+    """
+    Rule of the conditional stage can't be compiled.
+    """
+
+    def __init__(self, index, rule_type, message):
+        self.index = index
+        self.rule_type = rule_type
+        super().__init__(message)
+
+
+class ConditionEvaluationError(Exception):
+    """
+    Rule can't compare its control value with the actual one. Original
+    exception is kept as the cause.
+    """
+
+    def __init__(self, rule):
+        self.rule = rule
+        super().__init__(f"Can't evaluate rule on '{rule.field}'")
+
+
+class UntranslatableCondition(Exception):
+    """
+    Rule can't be expressed as SQL filter with the same result as the
+    python evaluation.
+    """
+
+
+class CompiledRule:
+    __slots__ = ("field", "path", "condition", "type", "value", "operator")
+
+    def __init__(self, field, condition, type_, value):
+        self.field = field
+        self.path = tuple(field.split(".")) if field else None
+        self.condition = condition
+        self.type = type_
+        self.value = value
+        self.operator = ConditionalStageConstants.OPERATORS[condition]
+
+    def get_actual_value(self, responses):
+        if self.path is None:
+            return None
+        result = responses
+        for key in self.path:
+            try:
+                result = result[key]
+            except KeyError:
+                return None
+        return result
+
+    def check(self, actual_value):
+        return self.operator(self.value, actual_value)
+
+    def to_filter(self, alias, prefix="responses"):
+        """
+        Return aliases and Q object selecting rows which responses fit the
+        rule. Operators are called as operator(control, actual), so
+        ordering operators are mirrored for the lookups.
+        """
+        if not self.path:
+            raise UntranslatableCondition("Rule has no field")
+
+        if self.condition in ("==", "!="):
+            contained = self.value
+            for key in reversed(self.path):
+                contained = {key: contained}
+            q = Q(**{f"{prefix}__contains": contained})
+            return {}, q if self.condition == "==" else ~q
+
+        keys = [Value(key) for key in self.path]
+        type_alias = f"{alias}_type"
+        value_alias = f"{alias}_value"
+        aliases = {
+            type_alias: JSONBTypeOf(JSONBExtractPath(prefix, *keys)),
+        }
+        if self.condition in ConditionalStageConstants.MIRRORED_OPERATORS:
+            if self.type not in ("integer", "number"):
+                raise UntranslatableCondition(
+                    f"Can't compare '{self.type}' values in SQL")
+            # Text is cast only for numbers, so other values can't break
+            # the query.
+            aliases[value_alias] = Case(
+                When(**{type_alias: "number"},
+                     then=Cast(JSONBExtractPathText(prefix, *keys),
+                               FloatField())),
+                output_field=FloatField()
+            )
+            mirrored = ConditionalStageConstants.MIRRORED_OPERATORS[
+                self.condition]
+            suffix = DjangoORMConstants.LOOKUP_PREFIXES[mirrored]
+            return aliases, Q(**{f"{value_alias}__{suffix}": self.value})
+        if self.condition in ("in", "nin") and self.type == "string":
+            aliases[value_alias] = StrIndex(
+                Value(self.value), JSONBExtractPathText(prefix, *keys)
+            )
+            position = {"in": f"{value_alias}__gt",
+                        "nin": value_alias}[self.condition]
+            return aliases, Q(**{type_alias: "string", position: 0})
+        raise UntranslatableCondition(
+            f"Can't translate '{self.condition}' for '{self.type}' to SQL")
+
+
+class CompiledConditions:
+    """
+    Rules of the conditional stage with paths split, control values
+    coerced to their types and operators resolved. Task responses fit
+    the conditions if all rules are true.
+    """
+
+    def __init__(self, rules, source=None):
+        self.rules = tuple(rules)
+        self.source = source
+
+    def __len__(self):
+        return len(self.rules)
+
+    def evaluate(self, responses, limit_count=None):
+        """
+        Check responses of a single task. If limit_count is passed, it is
+        compared instead of the responses values (conditional limits).
+        """
+        if responses is None:
+            return False
+        for rule in self.rules:
+            if limit_count is None:
+                actual_value = rule.get_actual_value(responses)
+            else:
+                actual_value = limit_count
+            try:
+                if not rule.check(actual_value):
+                    return False
+            except Exception as exc:
+                raise ConditionEvaluationError(rule) from exc
+        return True
+
+    def evaluate_many(self, responses_list, limit_count=None):
+        """
+        Check responses of many tasks against the same rules.
+        """
+        return [self.evaluate(responses, limit_count)
+                for responses in responses_list]
+
+    def to_filter(self, prefix="responses", alias="_condition"):
+        """
+        Translate rules into aliases and single Q object over the JSON
+        field, so fitting tasks are selected in one query:
+        queryset.alias(**aliases).filter(q). Alias names start with alias
+        param, so filters of different stages may be combined.
+        Raises UntranslatableCondition if any rule can't be translated.
+        """
+        aliases = {}
+        q = Q(**{f"{prefix}__isnull": False})
+        for index, rule in enumerate(self.rules):
+            rule_aliases, rule_q = rule.to_filter(f"{alias}_{index}", prefix)
+            aliases.update(rule_aliases)
+            q &= rule_q
+        return aliases, q
+
+
+def coerce_value(type_, value):
+    if type_ == "boolean" and isinstance(value, str):
+        return value.lower() in ["1", "true"]
+    return ConditionalStageConstants.SUPPORTED_TYPES[type_](value)
+
+
+def compile_rule(index, rule, strict=False):
+    """
+    Compile single rule. In strict mode (on stage saving) all rule fields
+    must be provided, otherwise missing type means string.
+    """
+    if not isinstance(rule, dict):
+        raise InvalidCondition(index, None, "Rule must be an object")
+
+    type_ = rule.get("type")
+    if not type_:
+        if strict:
+            raise InvalidCondition(index, type_,
+                                   "Please, provide 'type' field")
+        type_ = "string"
+    if type_ not in ConditionalStageConstants.SUPPORTED_TYPES:
+        raise InvalidCondition(index, type_, "Please, provide valid type")
+
+    value = rule.get("value")
+    if strict and value in (None, ""):
+        raise InvalidCondition(index, type_, "Please, provide 'value' field")
+    try:
+        value = coerce_value(type_, value)
+    except (TypeError, ValueError):
+        raise InvalidCondition(
+            index, type_, f"'{rule.get('value')}' is not of type '{type_}'"
+        )
+
+    condition = rule.get("condition")
+    if condition not in ConditionalStageConstants.OPERATORS:
+        raise InvalidCondition(index, type_,
+                               "Please, provide valid condition")
+
+    field = rule.get("field")
+    if field is not None and not isinstance(field, str) \
+            or strict and not field:
+        raise InvalidCondition(index, type_, "Please, provide 'field' field")
+    return CompiledRule(field, condition, type_, value)
+
+
+@lru_cache(maxsize=1024)
+def _compile_dumped(dumped, strict):
+    conditions = json.loads(dumped)
+    rules = [compile_rule(index, rule, strict)
+             for index, rule in enumerate(conditions)]
+    return CompiledConditions(rules, source=conditions)
+
+
+def compile_conditions(conditions, strict=False):
+    """
+    Compile conditions of the conditional stage. Equal rule sets share
+    the same compiled object.
+    """
+    conditions = conditions if conditions else []
+    if not isinstance(conditions, list):
+        raise InvalidCondition(0, None, "Conditions must be a list")
+    return _compile_dumped(
+        json.dumps(conditions, sort_keys=True, ensure_ascii=False), strict
+    )
@@ -1,6 +1,6 @@
 from django.contrib.postgres.fields import ArrayField
 from django.core.exceptions import FieldError
-from django.db.models import Subquery
+from django.db.models import Subquery, Func, CharField, TextField, JSONField
 
 
 class ArraySubquery(Subquery):
@@ -14,3 +14,22 @@ class ArraySubquery(Subquery):
             raise FieldError('More than one column detected')
 
         return ArrayField(base_field=output_fields[0])
+
+
+class JSONBTypeOf(Func):
+    function = 'jsonb_typeof'
+    output_field = CharField()
+
+
+class JSONBExtractPathText(Func):
+    """
+    Text of the value on the path. Unlike key transforms, keys are always
+    treated as object keys, even if they look like array indexes.
+    """
+    function = 'jsonb_extract_path_text'
+    output_field = TextField()
+
+
+class JSONBExtractPath(Func):
+    function = 'jsonb_extract_path'
+    output_field = JSONField()
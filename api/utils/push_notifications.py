@@ -1,15 +1,203 @@
-from firebase_admin import messaging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+from firebase_admin import exceptions, messaging
 
-def send_push_notification(token, title, body, data):
+INVALID_TOKEN_ERRORS = (
+    messaging.UnregisteredError,
+    messaging.SenderIdMismatchError,
+)
+
+
+class PushMessage:
+    """
+    Notification pushed to one or many devices.
+    """
+    __slots__ = ("tokens", "title", "body", "data")
+
+    def __init__(self, tokens, title, body, data=None):
+        self.tokens = list(tokens)
+        self.title = title
+        self.body = body
+        self.data = data or {}
+
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def send_each(messages):
+    """
+    Send every message in its own FCM v1 request, the requests are made
+    concurrently. Same as messaging.send_each of firebase-admin 6.2+,
+    which replaces the batch endpoint of send_all shut down by FCM.
+    """
+    if hasattr(messaging, "send_each"):
+        return messaging.send_each(messages)
+
+    def send(message):
+        try:
+            return messaging.SendResponse({"name": messaging.send(message)},
+                                          None)
+        except exceptions.FirebaseError as e:
+            return messaging.SendResponse(None, e)
+
+    workers = min(len(messages), settings.PUSH_NOTIFICATION_WORKERS)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return messaging.BatchResponse(list(executor.map(send, messages)))
+
+
+class FirebaseSender:
+    """
+    Sends messages through FCM. Messages with many tokens are split into
+    a message per token, all messages are sent by send_each in batches of
+    PUSH_NOTIFICATION_BATCH_SIZE.
+    """
+
+    def send(self, messages):
+        """
+        Returns set of tokens rejected by FCM as invalid.
+        """
+        invalid_tokens = set()
+        single = [(token, message) for message in messages
+                  for token in message.tokens]
+        for batch in chunks(single, settings.PUSH_NOTIFICATION_BATCH_SIZE):
+            response = send_each([
+                messaging.Message(
+                    notification=messaging.Notification(title=message.title,
+                                                        body=message.body),
+                    token=token,
+                    data=message.data)
+                for token, message in batch
+            ])
+            invalid_tokens.update(self.get_invalid_tokens(
+                [token for token, _ in batch], response))
+        return invalid_tokens
+
+    @staticmethod
+    def get_invalid_tokens(tokens, batch_response):
+        return [token for token, response
+                in zip(tokens, batch_response.responses)
+                if isinstance(response.exception, INVALID_TOKEN_ERRORS)]
+
+
+class LocalSender:
+    """
+    Keeps messages in memory instead of sending them. Used in tests and
+    local development. Tokens of invalid_tokens are reported invalid.
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.invalid_tokens = set()
+
+    def send(self, messages):
+        self.messages += messages
+        return {token for message in messages for token in message.tokens
+                if token in self.invalid_tokens}
 
+
+@lru_cache(maxsize=None)
+def load_sender(path):
+    return import_string(path)()
+
+
+def get_sender():
+    """
+    Return sender of the PUSH_NOTIFICATION_SENDER setting.
+    """
+    return load_sender(settings.PUSH_NOTIFICATION_SENDER)
+
+
+def send_push_notification(token, title, body, data):
     if token is not None:
-        message = messaging.Message(
-            notification=messaging.Notification(
-                title=title,
-                body=body
-            ),
-            token=token,
-            data=data
-        )
-        messaging.send(message)
+        get_sender().send([PushMessage([token], title, body, data)])
+
+
+class PendingPushes:
+    """
+    On commit callback delivering notifications queued in one savepoint
+    of the transaction. Ids live in the callback itself, so Django drops
+    them together with the callback when the savepoint is rolled back.
+    """
+
+    def __init__(self, ids):
+        self.ids = ids
+
+    def __call__(self):
+        from django_q.tasks import async_task
+        async_task("api.utils.push_notifications.deliver_push_notifications",
+                   self.ids, group="push")
+
+
+def queue_push_notification(notification_id):
+    """
+    Push the notification once the current transaction is committed.
+    Notifications queued by the same transaction are delivered by one
+    task of the django_q cluster.
+    """
+    connection = transaction.get_connection()
+    if connection.in_atomic_block:
+        savepoint_ids = set(connection.savepoint_ids)
+        for sids, callback, *_ in connection.run_on_commit:
+            if isinstance(callback, PendingPushes) and sids == savepoint_ids:
+                callback.ids.append(notification_id)
+                return
+    transaction.on_commit(PendingPushes([notification_id]))
+
+
+def get_messages(notifications):
+    """
+    Build messages of the notifications. Notification of a user is pushed
+    to the user, notification of a rank to all users having the rank.
+    """
+    RankRecord = apps.get_model("api.rankrecord")
+    rank_tokens = defaultdict(list)
+    rank_ids = {i.rank_id for i in notifications
+                if i.target_user_id is None and i.rank_id is not None}
+    records = RankRecord.objects \
+        .filter(rank__in=rank_ids, user__fcm_token__isnull=False) \
+        .exclude(user__fcm_token="") \
+        .values_list("rank_id", "user__fcm_token").distinct()
+    for rank_id, token in records:
+        rank_tokens[rank_id].append(token)
+
+    messages = []
+    for notification in notifications:
+        if notification.target_user_id is not None:
+            tokens = [notification.target_user.fcm_token] \
+                if notification.target_user.fcm_token else []
+        else:
+            tokens = rank_tokens.get(notification.rank_id, [])
+        if tokens:
+            messages.append(PushMessage(tokens, notification.title,
+                                        notification.text, {
+                'campaign_id': str(notification.campaign_id),
+                'notification_id': str(notification.pk)
+            }))
+    return messages
+
+
+def deliver_push_notifications(notification_ids):
+    """
+    Entry point of the django_q cluster for push notifications. Tokens
+    rejected by FCM are cleared, so they aren't used again.
+    """
+    Notification = apps.get_model("api.notification")
+    CustomUser = apps.get_model("api.customuser")
+    notifications = Notification.objects.filter(id__in=notification_ids) \
+        .select_related("target_user").order_by("id")
+    messages = get_messages(list(notifications))
+    invalid_tokens = get_sender().send(messages) if messages else set()
+    if invalid_tokens:
+        CustomUser.objects.filter(fcm_token__in=invalid_tokens) \
+            .update(fcm_token=None)
+    return {"messages": len(messages),
+            "tokens": sum(len(i.tokens) for i in messages),
+            "invalid_tokens": len(invalid_tokens)}
@@ -2,13 +2,16 @@ import json
 from functools import wraps
 from json import JSONDecodeError
 
-from django.db.models import QuerySet, Count, Q, OuterRef
+from django.db.models import QuerySet, Count, Q, OuterRef, F, FilteredRelation, \
+    Exists, Prefetch, Value, BooleanField
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db.models.functions import Coalesce
 from rest_framework.response import Response
 
 from api.api_exceptions import CustomApiException
 from api.constans import TaskStageConstants, DjangoORMConstants, ConditionalStageConstants
 from api.models import TaskStage, Task, RankLimit, Campaign, Chain, Notification, RankRecord, AdminPreference, \
-    CustomUser
+    CustomUser, SelectableTask, NotificationStatus, CampaignManagement
 from django.contrib import messages
 from django.utils.translation import ngettext
 from django.utils import timezone
@@ -34,54 +37,38 @@ def filter_for_user_creatable_stages(queryset, request, ranks=None):
     if not r:
         r = request.user.ranks.all()
 
-    all_rank_limits = RankLimit.objects.filter(
-        rank__in=r,
-        is_creation_open=True,
-        stage__in=queryset
-    ).distinct().select_related("stage")
-
-    stages = queryset.filter(
-        is_creatable=True,
-        ranklimits__in=all_rank_limits
-    ).distinct()
-
-    tasks_user_by_stages = stages.values("id").annotate(
-        total=Count("tasks", filter=Q(tasks__assignee=request.user)),
-        incomplete=Count("tasks", filter=Q(tasks__assignee=request.user)
-                                         & Q(tasks__complete=False)),
+    # Counters of the user are joined to the stages, so open and total
+    # limits of rank limits are checked in a single query.
+    stages = queryset.filter(is_creatable=True).annotate(
+        user_counter=FilteredRelation(
+            "user_counters",
+            condition=Q(user_counters__user=request.user)
+        ),
+    ).annotate(
+        user_total=Coalesce(F("user_counter__total"), 0),
+        user_incomplete=Coalesce(F("user_counter__incomplete"), 0),
+    ).filter(
+        Q(ranklimits__open_limit=0)
+        | Q(ranklimits__open_limit__gt=F("user_incomplete")),
+        Q(ranklimits__total_limit=0)
+        | Q(ranklimits__total_limit__gt=F("user_total")),
+        ranklimits__rank__in=r,
+        ranklimits__is_creation_open=True,
+        ranklimits__rank__rankrecord__user=request.user,
     )
 
-    filtered_stages = set()
-    for stage_info in tasks_user_by_stages.iterator():
-        total = stage_info["total"]
-        incomplete = stage_info["incomplete"]
-        rank_limits = all_rank_limits.filter(
-            stage=stage_info["id"],
-            rank__rankrecord__user=request.user
-        )
-
-        for rank_limit in rank_limits:
-            if ((rank_limit.open_limit > incomplete and rank_limit.total_limit > total) or
-                    (rank_limit.open_limit == 0 and rank_limit.total_limit > total) or
-                    (rank_limit.open_limit > incomplete and rank_limit.total_limit == 0) or
-                    (rank_limit.open_limit == 0 and rank_limit.total_limit == 0)
-            ):
-                filtered_stages.add(stage_info["id"])
-
     return TaskStage.objects.filter(is_creatable=True) \
-        .filter(id__in=filtered_stages) \
+        .filter(id__in=stages.values("id")) \
         .select_related("chain", "assign_user_from_stage")
 
 
 def filter_for_user_selectable_tasks(queryset, user):
-    tasks = queryset \
-        .filter(complete=False) \
-        .filter(assignee__isnull=True) \
-        .filter(stage__ranks__users=user.id) \
-        .filter(stage__ranklimits__is_selection_open=True) \
-        .filter(stage__ranklimits__is_listing_allowed=True) \
-        .exclude(stage__assign_user_by=TaskStageConstants.INTEGRATOR) \
-        .distinct()
+    # Pool rows are kept in sync with tasks and rank limits, so only
+    # ranks of the user are resolved here.
+    pool = SelectableTask.objects.filter(
+        rank_id__in=RankRecord.objects.filter(user=user).values("rank_id")
+    )
+    tasks = queryset.filter(id__in=pool.values("task_id"))
     return tasks
 
 
@@ -134,6 +121,34 @@ def filter_for_user_selectable_campaigns(queryset, request):
         .exclude(open=False)
 
 
+def annotate_user_campaigns(queryset, request):
+    """
+    Annotate campaigns with the flags of the user and prefetch their
+    relations, so CampaignSerializer doesn't query every campaign.
+    """
+    user = request.user
+    queryset = queryset.annotate(
+        registration_stage_id=F("default_track__registration_stage")
+    ).prefetch_related(
+        Prefetch("managers", queryset=CustomUser.objects.only("id")),
+        "languages", "countries", "categories"
+    )
+    if user.is_anonymous:
+        no = Value(False, output_field=BooleanField())
+        return queryset.annotate(user_is_manager=no, user_is_joined=no,
+                                 user_is_completed=no)
+
+    user_ranks = RankRecord.objects.filter(user=user)
+    return queryset.annotate(
+        user_is_manager=Exists(CampaignManagement.objects.filter(
+            campaign=OuterRef("pk"), user=user)),
+        user_is_joined=Exists(user_ranks.filter(
+            rank=OuterRef("default_track__default_rank"))),
+        user_is_completed=Exists(user_ranks.filter(
+            rank=OuterRef("course_completetion_rank")))
+    )
+
+
 def paginate(func):
     @wraps(func)
     def inner(self, *args, **kwargs):
@@ -168,10 +183,12 @@ def filter_for_user_notifications(queryset, request):
     # viewed
     viewed = request.query_params.get('viewed')
     if viewed is not None:
+        is_viewed = Exists(NotificationStatus.objects.filter(
+            notification=OuterRef('pk'), user=request.user))
         if viewed == 'true':
-            notifications = notifications.filter(notification_statuses__user=request.user)
+            notifications = notifications.filter(is_viewed)
         else:
-            notifications = notifications.exclude(notification_statuses__user=request.user)
+            notifications = notifications.filter(~is_viewed)
 
     # importance
     importance = request.query_params.get('importance')
@@ -247,6 +264,16 @@ def can_complete(task, user):
     return True
 
 
+class Echo:
+    """
+    File-like object returning written value, so csv writers produce
+    lines for streaming responses.
+    """
+
+    def write(self, value):
+        return value
+
+
 def array_difference(source, target):
     return [i for i in source if i not in target]
 
@@ -302,6 +329,27 @@ def task_stage_queries():
     }
 
 
+USER_ACTIVITY_CSV_FIELDS = [
+    "stage", "stage__name", "chain_id", "chain", "case", "assignee", "email",
+    "rank_ids", "rank_names", "complete_true", "complete_false",
+    "force_complete_false", "force_complete_true", "count_tasks",
+]
+
+
+def user_activity_groups(tasks):
+    """
+    Group tasks by stage and assignee with counts of their states.
+    """
+    return tasks.values('stage', 'stage__name', 'assignee').annotate(
+        chain_id=F('stage__chain'),
+        chain=F('stage__chain__name'),
+        email=F("assignee__email"),
+        rank_ids=ArrayAgg('assignee__ranks__id', distinct=True),
+        rank_names=ArrayAgg('assignee__ranks__name', distinct=True),
+        **task_stage_queries()
+    )
+
+
 def all_uncompleted_tasks(tasks):
     return tasks.filter(
         complete=False,
@@ -0,0 +1,202 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+RETRY_STATUSES = (502, 503, 504)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_breakers = {}
+_breakers_lock = threading.Lock()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """
+    Target url failed too many times in a row and isn't called until the
+    circuit breaker lets a trial request through.
+    """
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive failures of one target url. After
+    WEBHOOK_CIRCUIT_THRESHOLD failures requests are refused for
+    WEBHOOK_CIRCUIT_RESET seconds, then one trial request is let through:
+    success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.trial or time.monotonic() - self.opened_at \
+                    < settings.WEBHOOK_CIRCUIT_RESET:
+                return False
+            self.trial = True
+            return True
+
+    def record(self, success):
+        with self.lock:
+            self.trial = False
+            if success:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.failures >= settings.WEBHOOK_CIRCUIT_THRESHOLD:
+                self.opened_at = time.monotonic()
+
+
+def get_target(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}{parts.path}"
+
+
+def get_host(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def get_breaker(url):
+    target = get_target(url)
+    with _breakers_lock:
+        breaker = _breakers.get(target)
+        if breaker is None:
+            breaker = _breakers[target] = CircuitBreaker()
+        return breaker
+
+
+def get_session(url):
+    """
+    Return session of the url host. Sessions keep connections to their
+    host open, so following requests skip TCP and TLS handshakes.
+    """
+    host = get_host(url)
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1,
+                                  pool_maxsize=settings.WEBHOOK_POOL_SIZE)
+            session.mount(f"{urlsplit(url).scheme}://", adapter)
+            _sessions[host] = session
+        return session
+
+
+def is_failure(response):
+    return response.status_code >= 500
+
+
+def is_connect_error(error):
+    """
+    Return whether the request failed before it was sent, so the webhook
+    didn't get it.
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def send(method, url, timeout=None, retries=None, **kwargs):
+    """
+    Make request to the webhook through the pooled session of its host.
+    Failed connections are retried with exponential backoff. Other
+    connection errors and 502, 503 and 504 responses are retried for
+    idempotent methods only, because the webhook may have already handled
+    the request.
+    """
+    if timeout is None:
+        timeout = (settings.WEBHOOK_CONNECT_TIMEOUT,
+                   settings.WEBHOOK_READ_TIMEOUT)
+    if retries is None:
+        retries = settings.WEBHOOK_MAX_RETRIES
+    breaker = get_breaker(url)
+    if not breaker.allow():
+        raise CircuitOpenError(f"Circuit of {get_target(url)} is open.")
+
+    idempotent = method.upper() in IDEMPOTENT_METHODS
+    session = get_session(url)
+    success = False
+    attempt = 0
+    try:
+        while True:
+            try:
+                response = session.request(method, url, timeout=timeout,
+                                           **kwargs)
+            except requests.ConnectionError as e:
+                if attempt >= retries \
+                        or not (idempotent or is_connect_error(e)):
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES \
+                        or not idempotent or attempt >= retries:
+                    success = not is_failure(response)
+                    return response
+            time.sleep(settings.WEBHOOK_RETRY_BACKOFF * 2 ** attempt)
+            attempt += 1
+    finally:
+        breaker.record(success)
+
+
+def dump_response(response):
+    """
+    Return picklable state of the response to keep it in the cache.
+    """
+    return (response.status_code, dict(response.headers), response.content,
+            response.url, response.encoding)
+
+
+def load_response(state):
+    response = requests.Response()
+    (response.status_code, headers, response._content, response.url,
+     response.encoding) = state
+    response.headers.update(headers)
+    return response
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.WEBHOOK_MAX_WORKERS,
+                thread_name_prefix="webhook")
+        return _executor
+
+
+def dispatch(calls):
+    """
+    Run independent webhook calls on the shared thread pool. Returns
+    futures in the order of calls. Calls must not touch the database:
+    worker threads don't share the connection and the transaction of the
+    caller.
+    """
+    if len(calls) == 1:
+        return [_run_now(calls[0])]
+    executor = get_executor()
+    return [executor.submit(call) for call in calls]
+
+
+def _run_now(call):
+    future = Future()
+    try:
+        future.set_result(call())
+    except Exception as e:
+        future.set_exception(e)
+    return future
@@ -1,16 +1,20 @@
 import csv
+import itertools
 import json
 from datetime import datetime
 from datetime import timedelta
 
-import requests
+from django.conf import settings
 from django.contrib.postgres.aggregates import ArrayAgg
+from django.db import transaction
 from django.db.models import (
     Count, Q, Subquery, F, When, Value, TextField, OuterRef, Case as ExCase,
 )
 from django.db.models.functions import JSONObject
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets, status, mixins
 from rest_framework.authtoken.models import Token
@@ -28,7 +32,8 @@ from api.models import (
     RankLimit, Track, RankRecord, CampaignManagement,
     Notification, ResponseFlattener, TaskAward,
     DynamicJson, CustomUser, TestWebhook, Webhook, UserDelete, Category,
-    Country, Language, Volume
+    Country, Language, Volume, PropagationJob, UserStageCounter,
+    SelectableTask, ExportJob, NotificationInbox, NotificationStatus
 )
 from api.permissions import (
     CampaignAccessPolicy, ChainAccessPolicy, TaskStageAccessPolicy,
@@ -37,7 +42,8 @@ from api.permissions import (
     CampaignManagementAccessPolicy, NotificationAccessPolicy,
     ResponseFlattenerAccessPolicy, TaskAwardAccessPolicy,
     DynamicJsonAccessPolicy, UserAccessPolicy, UserStatisticAccessPolicy,
-    CategoryAccessPolicy, CountryAccessPolicy, LanguageAccessPolicy, UserFCMTokenAccessPolicy, VolumeAccessPolicy
+    CategoryAccessPolicy, CountryAccessPolicy, LanguageAccessPolicy, UserFCMTokenAccessPolicy, VolumeAccessPolicy,
+    ExportJobAccessPolicy
 )
 from api.serializer import (
     CampaignSerializer, ChainSerializer, TaskStageSerializer,
@@ -56,9 +62,11 @@ from api.serializer import (
     LanguageListSerializer, ChainIndividualsSerializer,
     RankGroupedByTrackSerializer, TaskPublicSerializer,
     TaskUserSelectableSerializer, TaskCreateSerializer,
-    TaskStageCreateTaskSerializer, FCMTokenSerializer, VolumeSerializer
+    TaskStageCreateTaskSerializer, FCMTokenSerializer, VolumeSerializer,
+    PropagationJobSerializer, ExportJobSerializer
 )
 from api.utils import utils
+from api.utils.push_notifications import queue_push_notification
 from .api_exceptions import CustomApiException
 from .constans import ErrorConstants, TaskStageConstants
 from .filters import (
@@ -209,6 +217,12 @@ class CampaignViewSet(viewsets.ModelViewSet):
 
     serializer_class = CampaignSerializer
     permission_classes = (CampaignAccessPolicy,)
+    query_budgets = {
+        "list": 10,
+        "retrieve": 14,
+        "list_user_campaigns": 10,
+        "list_user_selectable": 10,
+    }
 
     filterset_fields = {
         "languages__code": ["exact"],
@@ -221,9 +235,12 @@ class CampaignViewSet(viewsets.ModelViewSet):
     )
 
     def get_queryset(self):
-        return CampaignAccessPolicy.scope_queryset(
+        qs = CampaignAccessPolicy.scope_queryset(
             self.request, Campaign.objects.all()
         )
+        if self.action == "retrieve":
+            qs = utils.annotate_user_campaigns(qs, self.request)
+        return qs
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -234,8 +251,8 @@ class CampaignViewSet(viewsets.ModelViewSet):
     def list(self, request, *args, **kwargs):
         qs = self.filter_queryset(
             self.get_queryset()
-        ).filter(visible=True).prefetch_related("managers", "notifications")
-        return qs
+        ).filter(visible=True)
+        return utils.annotate_user_campaigns(qs, request)
 
     @action(detail=True, methods=['post', 'get'])
     def join_campaign(self, request, pk=None):
@@ -256,13 +273,15 @@ class CampaignViewSet(viewsets.ModelViewSet):
     @action(detail=False)
     def list_user_campaigns(self, request):
         qs = self.filter_queryset(self.get_queryset())
-        return utils.filter_for_user_campaigns(qs, request)
+        qs = utils.filter_for_user_campaigns(qs, request)
+        return utils.annotate_user_campaigns(qs, request)
 
     @paginate
     @action(detail=False)
     def list_user_selectable(self, request):
         qs = self.filter_queryset(self.get_queryset())
-        return utils.filter_for_user_selectable_campaigns(qs, request)
+        qs = utils.filter_for_user_selectable_campaigns(qs, request)
+        return utils.annotate_user_campaigns(qs, request)
 
 
 class ChainViewSet(viewsets.ModelViewSet):
@@ -283,6 +302,7 @@ class ChainViewSet(viewsets.ModelViewSet):
 
     serializer_class = ChainSerializer
     permission_classes = (ChainAccessPolicy,)
+    query_budgets = {"individuals": 3}
     filterset_fields = {
         "id": ["exact"],
         "campaign": ["exact"],
@@ -756,6 +776,9 @@ class TaskViewSet(viewsets.ModelViewSet):
     get_integrated_tasks:
     Return integrated tasks of requested task.
 
+    propagation:
+    Return state of the deferred chain propagation of the task.
+
     """
 
     filterset_fields = {
@@ -804,8 +827,12 @@ class TaskViewSet(viewsets.ModelViewSet):
             return TaskEditSerializer
         elif self.action == 'request_assignment':
             return TaskRequestAssignmentSerializer
+        elif self.action == 'claim_next':
+            return TaskDefaultSerializer
         elif self.action == 'user_activity':
             return TaskUserActivitySerializer
+        elif self.action == 'propagation':
+            return PropagationJobSerializer
         else:
             return TaskDefaultSerializer
 
@@ -864,7 +891,9 @@ class TaskViewSet(viewsets.ModelViewSet):
         """
         Post:
         Update task data. Note: if task is completed,
-        process_completed_task() function will be called.
+        process_completed_task() function will be called. If chain of the
+        task has deferred propagation, the function is scheduled on the
+        django_q cluster and its state is available on propagation action.
         """
         partial = kwargs.pop('partial', False)
         instance = self.get_object()
@@ -878,6 +907,7 @@ class TaskViewSet(viewsets.ModelViewSet):
         data = serializer.validated_data
         data['id'] = instance.id
         next_direct_task = None
+        propagation_job = None
         complete = serializer.validated_data.get("complete", False)
         if (complete and not instance.stage.chain.is_individual) \
                 and not utils.can_complete(instance, request.user):
@@ -892,7 +922,9 @@ class TaskViewSet(viewsets.ModelViewSet):
                 responses=serializer.validated_data.get("responses", {}),
                 complete=complete
             )
-            if complete:
+            if complete and instance.stage.chain.deferred_propagation:
+                propagation_job = PropagationJob.schedule(task)
+            elif complete:
                 next_direct_task = process_completed_task(task)
         except Task.CompletionInProgress:
             err_message = {
@@ -924,6 +956,10 @@ class TaskViewSet(viewsets.ModelViewSet):
             response["is_new_campaign"] = instance.get_campaign().id != next_direct_task.get_campaign().id
             response["message"] = "Next direct task is available."
             response["next_direct_id"] = next_direct_task.id
+        if propagation_job:
+            response["message"] = "Task saved. Propagation is scheduled."
+            response["propagation"] = PropagationJobSerializer(
+                propagation_job).data
 
         if instance.stage.auto_notification_recipient_stages.all():
             response["notifications"] = list(
@@ -981,6 +1017,8 @@ class TaskViewSet(viewsets.ModelViewSet):
         Get:
         Return a list of not assigned
         uncompleted tasks that are allowed to the user.
+        Pass 'after' param with the last received task id to get the next
+        tasks ordered by id (keyset pagination).
         """
         queryset = self.filter_queryset(
             self.get_queryset()
@@ -1022,6 +1060,14 @@ class TaskViewSet(viewsets.ModelViewSet):
         tasks_selectable = utils.filter_for_user_selectable_tasks(tasks, request.user)
         by_datetime = utils.filter_for_datetime(tasks_selectable)
 
+        after = request.query_params.get("after")
+        if after is not None:
+            if not after.isdigit():
+                raise CustomApiException(
+                    status.HTTP_400_BAD_REQUEST,
+                    "Param 'after' must be a task id.")
+            by_datetime = by_datetime.filter(id__gt=after).order_by("id")
+
         return by_datetime
 
     @paginate
@@ -1055,14 +1101,7 @@ class TaskViewSet(viewsets.ModelViewSet):
         """
         tasks = self.filter_queryset(self.get_queryset()) \
             .select_related('stage', 'assignee')
-        groups = tasks.values('stage', 'stage__name', 'assignee').annotate(
-            chain_id=F('stage__chain'),
-            chain=F('stage__chain__name'),
-            email=F("assignee__email"),
-            rank_ids=ArrayAgg('assignee__ranks__id', distinct=True),
-            rank_names=ArrayAgg('assignee__ranks__name', distinct=True),
-            **utils.task_stage_queries()
-        ).order_by("count_tasks")
+        groups = utils.user_activity_groups(tasks).order_by("count_tasks")
 
         filename = "results"  # utils.request_to_name(request)
         response = HttpResponse(
@@ -1073,14 +1112,8 @@ class TaskViewSet(viewsets.ModelViewSet):
         )
 
         if request.query_params.get("csv", None):
-            fieldnames = ["stage", "stage__name", "chain_id", "chain",
-                          "case", "assignee", "email", "rank_ids",
-                          "rank_names",
-                          "complete_true", "complete_false",
-                          "force_complete_false",
-                          "force_complete_true", "count_tasks", ]
-
-            writer = csv.DictWriter(response, fieldnames=fieldnames)
+            writer = csv.DictWriter(response,
+                                    fieldnames=utils.USER_ACTIVITY_CSV_FIELDS)
             writer.writeheader()
             for group in groups:
                 writer.writerow(group)
@@ -1109,11 +1142,7 @@ class TaskViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(task, request.data)
         if serializer.is_valid():
             serializer.save()
-            if task.integrator_group is not None:
-                in_tasks = Task.objects.filter(out_tasks=task) \
-                    .filter(stage__assign_user_by="IN")
-                if in_tasks:
-                    in_tasks.update(assignee=request.user)
+            self._assign_integrated_in_tasks(task, request.user)
             return Response({'status': 'assignment granted', 'id': task.id})
         else:
             return Response(serializer.errors,
@@ -1133,11 +1162,81 @@ class TaskViewSet(viewsets.ModelViewSet):
                 in_tasks = Task.objects.filter(out_tasks=task) \
                     .filter(stage__assign_user_by="IN")
                 if in_tasks:
+                    pairs = UserStageCounter.get_pairs(in_tasks)
                     in_tasks.update(assignee=None)
+                    UserStageCounter.recount(pairs)
+                    SelectableTask.refresh_tasks(
+                        in_tasks.values_list("id", flat=True))
             return Response({'status': 'assignment released'})
         raise CustomApiException(status.HTTP_403_FORBIDDEN,
                                  ErrorConstants.IMPOSSIBLE_ACTION % 'release this')
 
+    @staticmethod
+    def _assign_integrated_in_tasks(task, user):
+        if task.integrator_group is not None:
+            in_tasks = Task.objects.filter(out_tasks=task) \
+                .filter(stage__assign_user_by="IN")
+            if in_tasks:
+                pairs = UserStageCounter.get_pairs(in_tasks)
+                in_tasks.update(assignee=user)
+                UserStageCounter.recount(
+                    pairs | UserStageCounter.get_pairs(in_tasks))
+                SelectableTask.remove_tasks(in_tasks.values("id"))
+
+    @action(detail=False, methods=['post'])
+    def claim_next(self, request):
+        """
+        Post:
+        Assign next selectable tasks to the user. Optional params: stage
+        (id) and count (number of tasks, 1 by default). Returns assigned
+        tasks, the list is empty if there are no tasks left.
+        """
+        try:
+            count = int(request.data.get('count', 1))
+        except (TypeError, ValueError):
+            raise CustomApiException(status.HTTP_400_BAD_REQUEST,
+                                     "Param 'count' must be a number.")
+        if not 0 < count <= settings.CLAIM_NEXT_MAX_COUNT:
+            raise CustomApiException(
+                status.HTTP_400_BAD_REQUEST,
+                f"Param 'count' must be between 1 and "
+                f"{settings.CLAIM_NEXT_MAX_COUNT}."
+            )
+        stage = None
+        stage_id = request.data.get('stage')
+        if stage_id is not None:
+            stage = TaskStage.objects.filter(id=stage_id).first()
+            if stage is None:
+                raise CustomApiException(
+                    status.HTTP_404_NOT_FOUND,
+                    ErrorConstants.ENTITY_DOESNT_EXIST % ('Stage', stage_id)
+                )
+
+        with transaction.atomic():
+            tasks = Task.claim_next(request.user, count, stage)
+            for task in tasks:
+                self._assign_integrated_in_tasks(task, request.user)
+
+        return Response({'status': 'assignment granted',
+                         'tasks': self.get_serializer(tasks, many=True).data})
+
+    @action(detail=True)
+    def propagation(self, request, pk=None):
+        """
+        Get:
+        Return state of the latest deferred propagation of the task.
+        Clients poll it until the propagation is finished.
+        """
+        task = self.get_object()
+        job = task.propagation_jobs.order_by('-created_at').first()
+        if job is None:
+            raise CustomApiException(
+                status.HTTP_404_NOT_FOUND,
+                ErrorConstants.ENTITY_DOESNT_EXIST % ('Propagation of task',
+                                                      task.id)
+            )
+        return Response(self.get_serializer(job).data)
+
     @action(detail=True, methods=['post', 'get'])
     def uncomplete(self, request, pk=None):
         task = self.get_object()
@@ -1458,6 +1557,7 @@ class NotificationViewSet(viewsets.ModelViewSet):
     #     'updated_at': ['lte', 'gte']
     # }
     permission_classes = (NotificationAccessPolicy,)
+    query_budgets = {"list_user_notifications": 4, "inbox": 3}
     filterset_fields = {
         "campaign": ["exact"],
         "rank": ["exact"],
@@ -1478,6 +1578,10 @@ class NotificationViewSet(viewsets.ModelViewSet):
             return NotificationListSerializer
         return NotificationListSerializer
 
+    def perform_create(self, serializer):
+        notification = serializer.save()
+        queue_push_notification(notification.id)
+
     def get_queryset(self):
         return NotificationAccessPolicy.scope_queryset(
             self.request, Notification.objects.all().order_by('-created_at')
@@ -1512,6 +1616,22 @@ class NotificationViewSet(viewsets.ModelViewSet):
             self.filter_queryset(self.get_queryset()), request)
         return notifications
 
+    @action(detail=False)
+    def inbox(self, request):
+        """
+        Return number of notifications of the user and unread ones by
+        campaigns. Filter by campaign with ?campaign=.
+        """
+        inboxes = NotificationInbox.objects.filter(user=request.user)
+        campaign = request.query_params.get('campaign')
+        if campaign:
+            if not campaign.isdigit():
+                raise CustomApiException(status.HTTP_400_BAD_REQUEST,
+                                         "Param 'campaign' must be a "
+                                         "campaign id.")
+            inboxes = inboxes.filter(campaign=campaign)
+        return Response(inboxes.values('campaign', 'total', 'unread'))
+
     @action(detail=True)
     def open_notification(self, request, pk):
         notification_status, created = self.get_object().open(request.user)
@@ -1531,24 +1651,26 @@ class NotificationViewSet(viewsets.ModelViewSet):
 
     @action(detail=False)
     def read_all_notifications(self, request, pk=None):
+        """
+        Mark notifications of the user read. Accepts filters of
+        list_user_notifications and cutoff: only notifications created
+        before it are marked, by default before the request.
+        """
+        cutoff = request.query_params.get('cutoff')
+        if cutoff:
+            cutoff = parse_datetime(cutoff)
+            if cutoff is None:
+                raise CustomApiException(status.HTTP_400_BAD_REQUEST,
+                                         "Cutoff must be ISO 8601 datetime.")
+        notifications = utils.filter_for_user_notifications(
+            self.filter_queryset(self.get_queryset()), request
+        ).filter(created_at__lte=cutoff or timezone.now())
 
-        campaign = request.GET.get('campaign')
-
-        if campaign:
-            notifications = utils.filter_for_user_notifications(
-                self.filter_queryset(self.get_queryset()), request)
-
-            notifications = notifications.filter(campaign=campaign)
-        else:
-            notifications = utils.filter_for_user_notifications(
-                self.filter_queryset(self.get_queryset()), request)
-
-        # notifications = utils.filter_for_user_notifications(
-        #     self.filter_queryset(self.get_queryset()), request)
-
-        for notification in notifications:
-            notification.open(request.user)
-        return HttpResponse("Notifications marked as read successfully", status=200)
+        marked, already_read = NotificationStatus.mark_read(request.user,
+                                                            notifications)
+        return Response({"message": "Notifications marked as read successfully",
+                         "marked": marked,
+                         "already_read": already_read})
 
 
 class ResponseFlattenerViewSet(viewsets.ModelViewSet):
@@ -1574,20 +1696,38 @@ class ResponseFlattenerViewSet(viewsets.ModelViewSet):
 
     @action(detail=True)
     def csv(self, request, pk=None):
+        """
+        Get:
+        Return csv file with flattened responses of stage tasks. Pass
+        stream=true to stream rows as they are flattened; columns missing
+        in the schema are listed in the description column of each row.
+        """
         response_flattener = self.get_object()
         tasks = response_flattener.task_stage.tasks.all()
         filename = 'results'
+        if request.query_params.get('stream') == 'true':
+            rows = response_flattener.iter_flattened(
+                tasks.order_by('id'), chunk_size=settings.CSV_EXPORT_CHUNK_SIZE
+            )
+            writer = csv.DictWriter(utils.Echo(), fieldnames=next(rows))
+            content = itertools.chain([writer.writeheader()],
+                                      map(writer.writerow, rows))
+            return StreamingHttpResponse(
+                content,
+                content_type='text/csv',
+                headers={
+                    'Content-Disposition': f'attachment; filename="{filename}.csv"'
+                },
+            )
         response = HttpResponse(
             content_type='text/csv',
             headers={
                 'Content-Disposition': f'attachment; filename="{filename}.csv"'
             },
         )
-        items = []
+        items = response_flattener.flatten_many(tasks)
         columns = set()
-        for task in tasks:
-            row = response_flattener.flatten_response(task)
-            items.append(row)
+        for row in items:
             [columns.add(i) for i in row.keys()]
         ordered_columns = response_flattener.ordered_columns()
 
@@ -1608,6 +1748,70 @@ class ResponseFlattenerViewSet(viewsets.ModelViewSet):
         return response
 
 
+class ExportJobViewSet(mixins.CreateModelMixin,
+                       mixins.ListModelMixin,
+                       mixins.RetrieveModelMixin,
+                       GenericViewSet):
+    """
+    list:
+    Return a list of exports of campaigns managed by the user.
+
+    create:
+    Submit export. It is written by the django_q cluster in chunks,
+    progress is reported by retrieve.
+
+    read:
+    Get export state and progress.
+
+    download:
+    Return file of the finished export.
+
+    resume:
+    Continue failed export from its last checkpoint.
+    """
+    filterset_fields = {
+        'campaign': ['exact'],
+        'kind': ['exact'],
+        'status': ['exact'],
+    }
+    serializer_class = ExportJobSerializer
+    permission_classes = (ExportJobAccessPolicy,)
+
+    def get_queryset(self):
+        return ExportJobAccessPolicy.scope_queryset(
+            self.request, ExportJob.objects.all().order_by('-created_at')
+        )
+
+    @action(detail=True)
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status != ExportJob.Status.DONE:
+            raise CustomApiException(status.HTTP_400_BAD_REQUEST,
+                                     "Export is not finished yet.")
+        filename = f"export-{job.id}.{job.extension}"
+        return StreamingHttpResponse(
+            job.iter_content(),
+            content_type=job.content_type,
+            headers={
+                'Content-Disposition': f'attachment; filename="{filename}"'
+            },
+        )
+
+    @action(detail=True, methods=['post'])
+    def resume(self, request, pk=None):
+        with transaction.atomic():
+            job = self.get_object()
+            job = ExportJob.objects.select_for_update().get(pk=job.pk)
+            if job.status != ExportJob.Status.FAILED:
+                raise CustomApiException(status.HTTP_400_BAD_REQUEST,
+                                         "Only failed exports are resumed.")
+            job.status = ExportJob.Status.PENDING
+            job.error = ""
+            job.save()
+            transaction.on_commit(job.enqueue)
+        return Response(self.get_serializer(job).data)
+
+
 class TaskAwardViewSet(viewsets.ModelViewSet):
     filterset_fields = {
         'task_stage_completion': ['exact'],
@@ -1657,8 +1861,7 @@ class TestWebhookViewSet(viewsets.ModelViewSet):
         webhook = Webhook.objects.filter(
             task_stage=expected_task.stage.pk).get()
         if webhook:
-            response = requests.post(webhook.url, json=sent_task.responses,
-                                     headers={}).json()
+            response = webhook.post(sent_task.responses, headers={}).json()
         else:
             return Response(status=status.HTTP_400_BAD_REQUEST)
         if response == expected_task.responses:
@@ -60,6 +60,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "api.middleware.QueryStatsMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -254,3 +255,74 @@ Q_CLUSTER = {
     "orm": "default",
     "save_limit": 25000,
 }
+
+# Deferred chain propagation: runs of a failing job, backoff (seconds)
+# doubled on each failed run and seconds after which a running job is
+# taken by another worker. Jobs left running or pending longer than that
+# are pushed to the cluster again by the sweep_propagation_jobs schedule
+# (every 5 minutes, see migration 0139). The stale time must stay above
+# Q_CLUSTER timeout, so running jobs aren't taken from live workers.
+PROPAGATION_MAX_ATTEMPTS = 3
+PROPAGATION_RETRY_BACKOFF = 30
+PROPAGATION_STALE = 300
+
+# The largest number of tasks claimed by one claim_next request.
+CLAIM_NEXT_MAX_COUNT = 50
+
+# Number of tasks fetched from the database at once by streaming exports.
+CSV_EXPORT_CHUNK_SIZE = 2000
+
+# Background exports: number of rows written to one part file and the
+# longest time (seconds) one run of the cluster writes before the job is
+# queued again. The budget must stay below Q_CLUSTER timeout.
+EXPORT_JOB_CHUNK_SIZE = 2000
+EXPORT_JOB_TIME_BUDGET = 60
+
+# Webhook client: default timeouts (seconds) and retries of webhooks
+# without their own, size of the connection pool of one host, circuit
+# breaker of a failing url and threads dispatching webhooks of one task.
+WEBHOOK_CONNECT_TIMEOUT = 5
+WEBHOOK_READ_TIMEOUT = 30
+WEBHOOK_MAX_RETRIES = 2
+WEBHOOK_RETRY_BACKOFF = 0.5
+WEBHOOK_POOL_SIZE = 10
+WEBHOOK_CIRCUIT_THRESHOLD = 5
+WEBHOOK_CIRCUIT_RESET = 60
+WEBHOOK_MAX_WORKERS = 8
+
+# Webhook response cache: default seconds responses are reused and the
+# largest cached response body in bytes.
+WEBHOOK_CACHE_TIMEOUT = 300
+WEBHOOK_CACHE_MAX_SIZE = 256 * 1024
+
+# Webhook outbox: deliveries sent at once to one host, attempts before a
+# delivery is left dead, backoff (seconds) doubled on each failed attempt
+# and seconds after which a running delivery is taken by another worker.
+# Targets with running or due deliveries older than that are pushed to the
+# cluster again by the sweep_webhook_deliveries schedule (every 5 minutes,
+# see migration 0140).
+WEBHOOK_OUTBOX_CONCURRENCY = 4
+WEBHOOK_OUTBOX_MAX_ATTEMPTS = 5
+WEBHOOK_OUTBOX_BACKOFF = 30
+WEBHOOK_OUTBOX_STALE = 300
+
+# Push notifications: sender class, number of messages sent together and
+# number of threads sending them.
+PUSH_NOTIFICATION_SENDER = "api.utils.push_notifications.FirebaseSender"
+PUSH_NOTIFICATION_BATCH_SIZE = 500
+PUSH_NOTIFICATION_WORKERS = 10
+
+# Query stats of requests (api/middleware.py): recording is off unless
+# enabled, X-Query-* response headers with number, time and repeated
+# queries. Enabled stats are logged by the api.queries logger anyway.
+QUERY_STATS_ENABLED = os.getenv("QUERY_STATS_ENABLED", None) == "yes"
+QUERY_STATS_HEADERS = os.getenv("QUERY_STATS_HEADERS", None) == "yes"
+
+# Compiled chain graphs and quiz answer keys kept in the memory of each
+# process, least recently used ones are dropped.
+CHAIN_GRAPH_CACHE_SIZE = 256
+QUIZ_ANSWER_KEY_CACHE_SIZE = 1024
+
+# Seconds translated json schemas are kept in the cache. Changed
+# translations get new entries anyway, old ones expire.
+TRANSLATED_SCHEMA_CACHE_TIMEOUT = 24 * 60 * 60
@@ -66,6 +66,9 @@ router.register(
     turnip_app.ResponseFlattenerViewSet,
     basename="responseflattener",
 )
+router.register(
+    api_v1 + r"exportjobs", turnip_app.ExportJobViewSet, basename="exportjob"
+)
 router.register(
     api_v1 + r"dynamicjsons", turnip_app.DynamicJsonViewSet, basename="dynamicjson"
 )